@@ -0,0 +1,396 @@
+#!/usr/bin/env python3
+#
+# Copyright (c) 2016-2026, Babak Farrokhi
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# * Redistributions of source code must retain the above copyright notice, this
+#   list of conditions and the following disclaimer.
+#
+# * Redistributions in binary form must reproduce the above copyright notice,
+#   this list of conditions and the following disclaimer in the documentation
+#   and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+# OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+"""Client-overhead microbenchmarks for the query hot path.
+
+Every benchmark is timed in wall-clock and in CPU time of the calling thread,
+so that ops_per_cpu_second is the client's throughput per core regardless of
+what the server is doing. An allocation profile (bytes still held per
+operation, peak traced memory and the top allocation sites) is taken in a
+separate pass under tracemalloc. The ping benchmarks query a fake server
+(dnsdiag.fakeserver) started in a subprocess, so that its CPU time and
+allocations are not counted.
+
+Results are written as JSON and can be compared against an earlier run:
+
+    benchmarks/bench_client.py -o before.json
+    benchmarks/bench_client.py -o after.json --compare before.json
+"""
+
+import gc
+import getopt
+import json
+import os
+import platform
+import re
+import signal
+import statistics
+import subprocess
+import sys
+import time
+import tracemalloc
+from collections.abc import Callable
+from typing import Any
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import dns.flags  # noqa: E402
+import dns.message  # noqa: E402
+import dns.rrset  # noqa: E402
+import dns.version  # noqa: E402
+
+import dnsdiag.dns  # noqa: E402
+import dnsping  # noqa: E402
+from dnsdiag.shared import random_string, valid_hostname  # noqa: E402
+
+QNAME = 'example.com'
+PING_BATCH = 20  # queries per ping() call in the transport benchmarks
+TRANSPORTS = {
+    'udp': dnsdiag.dns.PROTO_UDP,
+    'tcp': dnsdiag.dns.PROTO_TCP,
+    'tls': dnsdiag.dns.PROTO_TLS,
+    'https': dnsdiag.dns.PROTO_HTTPS,
+    'quic': dnsdiag.dns.PROTO_QUIC,
+}
+
+# a benchmark is set up with the server ports and returns (operation, operations per call)
+Setup = Callable[[dict[str, int]], tuple[Callable[[], object], int]]
+
+
+def _ping(transport: str) -> Setup:
+    def setup(ports: dict[str, int]) -> tuple[Callable[[], object], int]:
+        proto, port = TRANSPORTS[transport], ports[transport]
+
+        def op() -> object:
+            result = dnsdiag.dns.ping(QNAME, '127.0.0.1', port, 'A', 2, PING_BATCH, proto, None,
+                                      keep_response=False)
+            if result.r_lost_percent:
+                raise RuntimeError(f'{result.r_lost_percent:.0f}% of queries lost ({result.rcode_text})')
+            return result
+
+        return op, PING_BATCH
+    return setup
+
+
+def _response_wire() -> bytes:
+    query = dns.message.make_query(QNAME, 'A', use_edns=True, want_dnssec=True, payload=1232)
+    response = dns.message.make_response(query)
+    response.answer.append(dns.rrset.from_text(QNAME + '.', 300, 'IN', 'A', '192.0.2.1', '192.0.2.2'))
+    return response.to_wire()
+
+
+def _query_build(ports: dict[str, int]) -> tuple[Callable[[], object], int]:
+    return lambda: dns.message.make_query(QNAME, 'A', use_edns=True, want_dnssec=True, payload=1232), 1
+
+
+def _query_wire(ports: dict[str, int]) -> tuple[Callable[[], object], int]:
+    query = dns.message.make_query(QNAME, 'A', use_edns=True, want_dnssec=True, payload=1232)
+    return query.to_wire, 1
+
+
+def _parse_full(ports: dict[str, int]) -> tuple[Callable[[], object], int]:
+    wire = _response_wire()
+    return lambda: dns.message.from_wire(wire), 1
+
+
+def _parse_header(ports: dict[str, int]) -> tuple[Callable[[], object], int]:
+    # what ping() decodes for an answer it does not keep
+    wire = _response_wire()
+
+    def op() -> object:
+        response = dnsdiag.dns.WireResponse(wire)
+        return response.rcode(), response.ednsflags, response.answer[0].ttl
+
+    return op, 1
+
+
+def _flags_to_text(ports: dict[str, int]) -> tuple[Callable[[], object], int]:
+    flags = dns.flags.QR | dns.flags.RD | dns.flags.RA | dns.flags.AD
+    return lambda: dnsdiag.dns.flags_to_text(flags), 1
+
+
+def _valid_hostname(ports: dict[str, int]) -> tuple[Callable[[], object], int]:
+    return lambda: valid_hostname('_dnsdiag_abcdefgh_.www.example.com', allow_underscore=True), 1
+
+
+def _random_string(ports: dict[str, int]) -> tuple[Callable[[], object], int]:
+    return random_string, 1
+
+
+def _dnsping_line(ports: dict[str, int]) -> tuple[Callable[[], object], int]:
+    response = dnsdiag.dns.WireResponse(_response_wire())
+
+    def op() -> object:
+        return dnsping.format_reply(response, len(response), '127.0.0.1', 1, 1.234, show_ttl=True,
+                                    show_flags=True, want_dnssec=True, show_answer=True)
+
+    return op, 1
+
+
+BENCHMARKS: dict[str, Setup] = {
+    'query_build': _query_build,
+    'query_to_wire': _query_wire,
+    'parse_full': _parse_full,
+    'parse_header': _parse_header,
+    'flags_to_text': _flags_to_text,
+    'valid_hostname': _valid_hostname,
+    'random_string': _random_string,
+    'dnsping_line': _dnsping_line,
+    **{f'ping_{transport}': _ping(transport) for transport in TRANSPORTS},
+}
+
+
+def measure(op: Callable[[], object], per_call: int, min_time: float = 0.2, repeat: int = 5) -> dict[str, Any]:
+    """Time op in wall-clock and thread CPU time; figures are per operation."""
+    calls = 1
+    while True:
+        start = time.perf_counter()
+        for _ in range(calls):
+            op()
+        elapsed = time.perf_counter() - start
+        if elapsed >= min_time:
+            break
+        calls = max(calls * 2, int(calls * min_time / elapsed * 1.1)) if elapsed > 0 else calls * 10
+
+    wall: list[float] = []
+    cpu: list[float] = []
+    for _ in range(repeat):
+        gc.collect()
+        start, cpu_start = time.perf_counter_ns(), time.thread_time_ns()
+        for _ in range(calls):
+            op()
+        cpu.append((time.thread_time_ns() - cpu_start) / (calls * per_call))
+        wall.append((time.perf_counter_ns() - start) / (calls * per_call))
+
+    median_wall, median_cpu = statistics.median(wall), statistics.median(cpu)
+    return {
+        'ops': calls * per_call,
+        'repeat': repeat,
+        'ns_per_op': median_wall,
+        'ns_per_op_min': min(wall),
+        'ns_per_op_stddev': statistics.stdev(wall) if repeat > 1 else 0.0,
+        'cpu_ns_per_op': median_cpu,
+        'ops_per_second': 1e9 / median_wall if median_wall else 0.0,
+        'ops_per_cpu_second': 1e9 / median_cpu if median_cpu else 0.0,
+    }
+
+
+def allocations(op: Callable[[], object], per_call: int, calls: int = 100, top: int = 3) -> dict[str, Any]:
+    """Profile memory allocated by calls to op under tracemalloc."""
+    op()  # let caches and lazy imports settle first
+    gc.collect()
+    tracemalloc.start()
+    try:
+        before = tracemalloc.take_snapshot()
+        base, _ = tracemalloc.get_traced_memory()
+        tracemalloc.reset_peak()
+        for _ in range(calls):
+            op()
+        current, peak = tracemalloc.get_traced_memory()
+        after = tracemalloc.take_snapshot()
+    finally:
+        tracemalloc.stop()
+
+    ignore = [tracemalloc.Filter(False, tracemalloc.__file__)]
+    sites = after.filter_traces(ignore).compare_to(before.filter_traces(ignore), 'lineno')
+    return {
+        'retained_bytes_per_op': max(0, current - base) / (calls * per_call),
+        'peak_bytes': max(0, peak - base),
+        'top_sites': [{'site': str(stat.traceback), 'size_diff': stat.size_diff, 'count_diff': stat.count_diff}
+                      for stat in sites[:top] if stat.size_diff > 0],
+    }
+
+
+def start_server() -> tuple[subprocess.Popen[str], dict[str, int], str]:
+    """Run dnsdiag.fakeserver on free ports; returns the process, its ports and its certificate."""
+    cmd = [sys.executable, '-m', 'dnsdiag.fakeserver'] + [f'--{t}=0' for t in TRANSPORTS]
+    proc = subprocess.Popen(cmd, stdout=subprocess.PIPE, text=True,
+                            cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    assert proc.stdout is not None
+    ports: dict[str, int] = {}
+    certfile = ''
+    while len(ports) < len(TRANSPORTS) or not certfile:
+        line = proc.stdout.readline()
+        if not line:
+            raise RuntimeError('fake server did not start')
+        match = re.match(r'(\w+)\s+\S+ port (\d+)', line)
+        if match:
+            ports[match.group(1)] = int(match.group(2))
+        elif line.startswith('certificate: '):
+            certfile = line.split(': ', 1)[1].strip()
+    return proc, ports, certfile
+
+
+def run(names: list[str], min_time: float, repeat: int, profile_alloc: bool) -> dict[str, Any]:
+    proc, ports, certfile = start_server()
+    os.environ['SSL_CERT_FILE'] = certfile  # trust the fake server's self-signed certificate
+    results: dict[str, Any] = {}
+    try:
+        for name in names:
+            try:
+                op, per_call = BENCHMARKS[name](ports)
+                op()  # fail early, and warm up connections and caches
+                result = measure(op, per_call, min_time, repeat)
+                if profile_alloc:
+                    result['alloc'] = allocations(op, per_call, calls=max(1, 100 // per_call))
+            except Exception as e:
+                result = {'error': f'{type(e).__name__}: {e}'}
+            results[name] = result
+            print_result(name, result)
+    finally:
+        proc.send_signal(signal.SIGTERM)
+        proc.communicate(timeout=10)
+
+    return {
+        'meta': {
+            'timestamp': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+            'commit': git_commit(),
+            'python': platform.python_version(),
+            'implementation': platform.python_implementation(),
+            'platform': platform.platform(),
+            'machine': platform.machine(),
+            'dnspython': dns.version.version,
+            'min_time': min_time,
+            'repeat': repeat,
+            'ping_batch': PING_BATCH,
+        },
+        'results': results,
+    }
+
+
+def git_commit() -> str | None:
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True, check=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def print_result(name: str, result: dict[str, Any]) -> None:
+    if 'error' in result:
+        print(f"{name:<16} ERROR: {result['error']}", file=sys.stderr)
+        return
+    line = f"{name:<16} {result['ns_per_op'] / 1000:>10.3f} us/op  {result['ops_per_cpu_second']:>12.0f} ops/cpu-s"
+    if 'alloc' in result:
+        line += f"  {result['alloc']['retained_bytes_per_op']:>8.1f} B/op retained"
+    print(line, file=sys.stderr)
+
+
+def compare(baseline: dict[str, Any], current: dict[str, Any], threshold: float) -> list[str]:
+    """Print CPU time per operation against a baseline; returns the benchmarks that regressed."""
+    regressions = []
+    print(f"{'benchmark':<16} {'before':>12} {'after':>12} {'change':>8}  (CPU ns/op)", file=sys.stderr)
+    for name, result in current['results'].items():
+        old = baseline.get('results', {}).get(name)
+        if not old or 'error' in old or 'error' in result:
+            continue
+        before, after = old['cpu_ns_per_op'], result['cpu_ns_per_op']
+        change = (after - before) / before * 100 if before else 0.0
+        flag = ''
+        if change > threshold:
+            regressions.append(name)
+            flag = '  REGRESSION'
+        print(f"{name:<16} {before:>12.0f} {after:>12.0f} {change:>+7.1f}%{flag}", file=sys.stderr)
+    return regressions
+
+
+def usage() -> None:
+    print("""usage: bench_client.py [-h] [-l] [-b pattern] [-t min_time] [-r repeat] [-A] [-o file]
+                       [--compare file] [--threshold percent]
+  -h, --help       Show this help message
+  -l, --list       List the benchmarks and exit
+  -b, --bench      Only run benchmarks whose name matches this regular expression
+  -t, --min-time   Minimum seconds per timing run (default: 0.2)
+  -r, --repeat     Number of timing runs; the median is reported (default: 5)
+  -A, --no-alloc   Skip the allocation profile
+  -o, --output     Write the JSON results to this file (default: standard output)
+  --compare        Compare CPU time per operation with an earlier JSON result
+  --threshold      Slowdown in percent reported as a regression (default: 10)""")
+    sys.exit(0)
+
+
+def main() -> None:
+    try:
+        opts, args = getopt.getopt(sys.argv[1:], 'hlb:t:r:Ao:',
+                                   ['help', 'list', 'bench=', 'min-time=', 'repeat=', 'no-alloc', 'output=',
+                                    'compare=', 'threshold='])
+    except getopt.GetoptError as e:
+        print(f"ERROR: {e}", file=sys.stderr)
+        sys.exit(1)
+    if args:
+        usage()
+
+    pattern = ''
+    min_time = 0.2
+    repeat = 5
+    profile_alloc = True
+    output = ''
+    baseline_file = ''
+    threshold = 10.0
+    try:
+        for o, a in opts:
+            if o in ('-h', '--help'):
+                usage()
+            elif o in ('-l', '--list'):
+                print("\n".join(BENCHMARKS))
+                sys.exit(0)
+            elif o in ('-b', '--bench'):
+                pattern = a
+            elif o in ('-t', '--min-time'):
+                min_time = float(a)
+            elif o in ('-r', '--repeat'):
+                repeat = int(a)
+            elif o in ('-A', '--no-alloc'):
+                profile_alloc = False
+            elif o in ('-o', '--output'):
+                output = a
+            elif o == '--compare':
+                baseline_file = a
+            elif o == '--threshold':
+                threshold = float(a)
+    except ValueError as e:
+        print(f"ERROR: {e}", file=sys.stderr)
+        sys.exit(1)
+
+    names = [name for name in BENCHMARKS if re.search(pattern, name)]
+    report = run(names, min_time, max(1, repeat), profile_alloc)
+
+    text = json.dumps(report, indent=2)
+    if output:
+        with open(output, 'w') as f:
+            f.write(text + "\n")
+    else:
+        print(text)
+
+    if baseline_file:
+        with open(baseline_file) as f:
+            regressions = compare(json.load(f), report, threshold)
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,252 @@
+#
+# Copyright (c) 2016-2026, Babak Farrokhi
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# * Redistributions of source code must retain the above copyright notice, this
+#   list of conditions and the following disclaimer.
+#
+# * Redistributions in binary form must reproduce the above copyright notice,
+#   this list of conditions and the following disclaimer in the documentation
+#   and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+# OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+"""Offline IP-to-origin-AS lookups from a local prefix table.
+
+The source is a text dump with one "prefix asn" pair per line, as written by
+pyasn (tab separated, ';' comments) or derived from an MRT RIB dump
+("prefix|asn" also works). It is compiled into a flat binary index of
+disjoint, sorted address ranges in which the most specific prefix always
+wins, so a longest-prefix match is a single binary search. Keys are stored
+big-endian, which lets the search compare raw bytes straight out of a
+memory-mapped file without parsing it first.
+
+Index layout: an 8-byte magic, the IPv4 and IPv6 record counts as 32-bit
+integers, then the IPv4 records (start, end, asn, prefix length; 13 bytes)
+followed by the IPv6 records (37 bytes).
+"""
+
+import concurrent.futures
+import hashlib
+import ipaddress
+import mmap
+import os
+import socket
+import struct
+from collections.abc import Iterable
+from typing import Any
+
+from dnsdiag.shared import cache_path
+
+INDEX_MAGIC = b'DNSDASN1'
+_HEADER = struct.Struct('!8sII')
+_WIDTH = {socket.AF_INET: 4, socket.AF_INET6: 16}
+
+
+class AsnRecord:
+    """Origin AS of an address; mirrors the fields of a cymruwhois record that we print."""
+
+    def __init__(self, asn: int, prefix: str) -> None:
+        self.asn: str = str(asn)
+        self.prefix: str = prefix
+        self.owner: str = ''
+
+
+def parse_prefixes(lines: Iterable[str]) -> list[tuple[ipaddress.IPv4Network | ipaddress.IPv6Network, int]]:
+    """Parse "prefix asn" lines, skipping comments and lines that do not parse.
+
+    For AS sets ("{64500,64501}") the first member is used.
+    """
+    prefixes = []
+    for line in lines:
+        line = line.strip()
+        if not line or line[0] in ';#':
+            continue
+        fields = line.replace('|', ' ').split()
+        if len(fields) < 2:
+            continue
+        asn_text = fields[1].strip('{}').split(',')[0]
+        if asn_text.upper().startswith('AS'):
+            asn_text = asn_text[2:]
+        try:
+            network = ipaddress.ip_network(fields[0], strict=False)
+            asn = int(asn_text)
+        except ValueError:
+            continue
+        if 0 <= asn <= 0xffffffff:
+            prefixes.append((network, asn))
+    return prefixes
+
+
+def _flatten(prefixes: list[tuple[int, int, int, int]]) -> list[tuple[int, int, int, int]]:
+    """Turn (possibly nested) (start, end, asn, plen) prefixes into disjoint ranges.
+
+    Prefixes are swept in address order with the enclosing ones on a stack;
+    every range is attributed to the most specific prefix covering it.
+    """
+    prefixes.sort(key=lambda p: (p[0], p[3]))
+    ranges: list[tuple[int, int, int, int]] = []
+    stack: list[tuple[int, int, int]] = []  # (end, asn, plen)
+    cursor = 0
+
+    def emit(start: int, end: int, asn: int, plen: int) -> None:
+        if start <= end:
+            ranges.append((start, end, asn, plen))
+
+    for start, end, asn, plen in prefixes:
+        while stack and stack[-1][0] < start:
+            top_end, top_asn, top_plen = stack.pop()
+            emit(cursor, top_end, top_asn, top_plen)
+            cursor = top_end + 1
+        if stack:
+            emit(cursor, start - 1, stack[-1][1], stack[-1][2])
+        stack.append((end, asn, plen))
+        cursor = start
+
+    while stack:
+        top_end, top_asn, top_plen = stack.pop()
+        emit(cursor, top_end, top_asn, top_plen)
+        cursor = top_end + 1
+
+    return ranges
+
+
+def build_index(prefixes: list[tuple[ipaddress.IPv4Network | ipaddress.IPv6Network, int]]) -> bytes:
+    """Compile parsed prefixes into the binary index format."""
+    families: dict[int, list[tuple[int, int, int, int]]] = {socket.AF_INET: [], socket.AF_INET6: []}
+    for network, asn in prefixes:
+        af = socket.AF_INET if network.version == 4 else socket.AF_INET6
+        families[af].append((int(network.network_address), int(network.broadcast_address), asn,
+                             network.prefixlen))
+
+    v4 = _flatten(families[socket.AF_INET])
+    v6 = _flatten(families[socket.AF_INET6])
+    chunks = [_HEADER.pack(INDEX_MAGIC, len(v4), len(v6))]
+    for af, ranges in ((socket.AF_INET, v4), (socket.AF_INET6, v6)):
+        width = _WIDTH[af]
+        for start, end, asn, plen in ranges:
+            chunks.append(start.to_bytes(width, 'big') + end.to_bytes(width, 'big') + struct.pack('!IB', asn, plen))
+    return b''.join(chunks)
+
+
+def compile_index(source: str, target: str) -> int:
+    """Compile a text prefix dump into an index file; returns the number of prefixes read."""
+    with open(source) as dump:
+        prefixes = parse_prefixes(dump)
+    tmp_target = target + '.tmp'
+    with open(tmp_target, 'wb') as index_file:
+        index_file.write(build_index(prefixes))
+    os.replace(tmp_target, target)
+    return len(prefixes)
+
+
+def index_cache_path(source: str) -> str:
+    """Where the index compiled from a text dump is cached, keyed by the dump's path, size and mtime."""
+    st = os.stat(source)
+    key = '%s\0%d\0%d' % (os.path.abspath(source), st.st_size, st.st_mtime_ns)
+    return cache_path('asindex-%s.idx' % hashlib.sha256(key.encode()).hexdigest()[:16])
+
+
+class AsnIndex:
+    """Longest-prefix-match lookups over a compiled index held in memory or mapped from disk."""
+
+    def __init__(self, data: bytes | mmap.mmap) -> None:
+        if len(data) < _HEADER.size:
+            raise ValueError('truncated ASN index')
+        magic, count4, count6 = _HEADER.unpack_from(data, 0)
+        if magic != INDEX_MAGIC:
+            raise ValueError('not an ASN index')
+        if len(data) != _HEADER.size + count4 * 13 + count6 * 37:
+            raise ValueError('truncated ASN index')
+        self._data = data
+        self._tables = {
+            socket.AF_INET: (_HEADER.size, count4, 4),
+            socket.AF_INET6: (_HEADER.size + count4 * 13, count6, 16),
+        }
+
+    @classmethod
+    def open(cls, filename: str) -> 'AsnIndex':
+        """Map a compiled index file, or compile a text dump on the fly.
+
+        A text dump is compiled once into the cache directory (see
+        index_cache_path), so that later runs can map it directly; a changed
+        dump gets a new index. If that cannot be written, the index is kept in
+        memory.
+        """
+        with open(filename, 'rb') as index_file:
+            if index_file.read(len(INDEX_MAGIC)) == INDEX_MAGIC:
+                return cls(mmap.mmap(index_file.fileno(), 0, access=mmap.ACCESS_READ))
+
+        try:
+            compiled = index_cache_path(filename)
+            if not os.path.exists(compiled):
+                compile_index(filename, compiled)
+            return cls.open(compiled)
+        except OSError:
+            with open(filename) as dump:
+                return cls(build_index(parse_prefixes(dump)))
+
+    def __len__(self) -> int:
+        return sum(count for _, count, _ in self._tables.values())
+
+    def lookup(self, ip: str) -> AsnRecord | None:
+        """Return the origin AS of the most specific prefix covering ip, or None."""
+        try:
+            af = socket.AF_INET6 if ':' in ip else socket.AF_INET
+            key = socket.inet_pton(af, ip)
+        except OSError:
+            return None
+
+        offset, count, width = self._tables[af]
+        size = 2 * width + 5
+        data = self._data
+
+        # find the last range whose start is <= key
+        lo, hi = 0, count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            pos = offset + mid * size
+            if data[pos:pos + width] <= key:
+                lo = mid + 1
+            else:
+                hi = mid
+        if lo == 0:
+            return None
+
+        pos = offset + (lo - 1) * size
+        if key > data[pos + width:pos + 2 * width]:
+            return None
+        asn, plen = struct.unpack_from('!IB', data, pos + 2 * width)
+        network = ipaddress.ip_network((ipaddress.ip_address(key), plen), strict=False)
+        return AsnRecord(asn, str(network))
+
+    def close(self) -> None:
+        if isinstance(self._data, mmap.mmap):
+            self._data.close()
+
+
+class IndexResolver:
+    """Answer AsnResolver-style lookups from a local index, without any network access."""
+
+    def __init__(self, index: AsnIndex) -> None:
+        self.index = index
+
+    def lookup(self, ip: str) -> 'concurrent.futures.Future[Any]':
+        future: concurrent.futures.Future[Any] = concurrent.futures.Future()
+        future.set_result(self.index.lookup(ip))
+        return future
+
+    def close(self) -> None:
+        self.index.close()
@@ -0,0 +1,221 @@
+#
+# Copyright (c) 2016-2026, Babak Farrokhi
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# * Redistributions of source code must retain the above copyright notice, this
+#   list of conditions and the following disclaimer.
+#
+# * Redistributions in binary form must reproduce the above copyright notice,
+#   this list of conditions and the following disclaimer in the documentation
+#   and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+# OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+
+"""Find the query rate a server sustains within a latency and loss objective.
+
+A capacity search offers the server one rate after another for a fixed
+time each, with an open-loop Flood (queries go out on schedule whether or
+not the server keeps up), and records latency percentiles and loss at every
+step until the objective (SLO) breaks. The steps make up the server's
+latency-versus-load curve; the highest offered rate that met the objective
+is its sustainable rate.
+
+Two searches are available. SEARCH_STEP raises the rate by a fixed step
+and stops at the first step that breaks the objective. SEARCH_AIMD keeps
+going after a break: it backs off multiplicatively and climbs again in
+smaller steps, which probes the neighbourhood of the knee more closely and
+shows whether a break was a fluke, until the objective has broken
+MAX_BREAKS times.
+"""
+
+import math
+from collections.abc import Callable
+from typing import Any
+
+from dnsdiag.dns import Flood, FloodResult
+from dnsdiag.overhead import Watchdog
+
+SEARCH_STEP = 'step'
+SEARCH_AIMD = 'aimd'
+SEARCHES = (SEARCH_STEP, SEARCH_AIMD)
+
+PERCENTILES = (50, 90, 99, 99.9)
+DEFAULT_SLO = 'p99=100,loss=1'
+AIMD_DECREASE = 0.75  # share of the rate kept after a break
+MAX_BREAKS = 3  # AIMD stops after this many broken steps
+MIN_SENT_RATIO = 0.9  # below this share of the offered rate, the client is what limits the load
+DEFAULT_WINDOW = 1000  # queries outstanding at most; a rate beyond window / timeout is lost anyway
+
+
+class Slo:
+    """Upper bounds on latency percentiles (milliseconds) and loss (percent).
+
+    Written as comma-separated limits, e.g. "p99=100,loss=1" or
+    "p50=20,p99.9=250". Percentiles are those in PERCENTILES.
+    """
+
+    __slots__ = ('limits',)
+
+    def __init__(self, limits: dict[str, float]) -> None:
+        self.limits = limits
+
+    @classmethod
+    def parse(cls, text: str) -> 'Slo':
+        names = {'p%s' % p for p in PERCENTILES} | {'loss'}
+        limits: dict[str, float] = {}
+        for item in text.split(','):
+            name, sep, value = item.strip().partition('=')
+            if not sep or name not in names:
+                raise ValueError(f"invalid objective '{item}', expected one of {', '.join(sorted(names))}=LIMIT")
+            try:
+                limits[name] = float(value)
+            except ValueError:
+                raise ValueError(f"invalid limit for {name}: {value}") from None
+            if not limits[name] >= 0:
+                raise ValueError(f"invalid limit for {name}: {value}")
+        return cls(limits)
+
+    def breaches(self, result: FloodResult) -> list[str]:
+        """Describe every limit result exceeds; empty when the objective is met."""
+        breaches = []
+        for name, limit in self.limits.items():
+            value = result.lost_percent if name == 'loss' else result.percentile(float(name[1:]))
+            if value > limit:
+                unit = '%' if name == 'loss' else ' ms'
+                breaches.append('%s=%.3f%s > %g%s' % (name, value, unit, limit, unit))
+        return breaches
+
+    def __str__(self) -> str:
+        return ', '.join('%s <= %g%s' % (name, limit, '%' if name == 'loss' else ' ms')
+                         for name, limit in self.limits.items())
+
+
+class CapacityStep:
+    """One offered rate and what the server made of it."""
+
+    __slots__ = ('rate', 'result', 'breaches', 'unreliable')
+
+    def __init__(self, rate: float, result: FloodResult, breaches: list[str], unreliable: str = '') -> None:
+        self.rate = rate
+        self.result = result
+        self.breaches = breaches
+        self.unreliable = unreliable  # why the client could not be trusted meanwhile, see dnsdiag.overhead
+
+    @property
+    def met(self) -> bool:
+        return not self.breaches
+
+    def to_dict(self) -> dict[str, Any]:
+        result = self.result
+        record: dict[str, Any] = {
+            'offered_qps': self.rate,
+            'sent_qps': round(result.sent_qps, 3),
+            'answered_qps': round(result.qps, 3),
+            'sent': result.sent,
+            'received': result.received,
+            'lost_percent': round(result.lost_percent, 3),
+        }
+        for p in PERCENTILES:
+            record['p%s' % p] = round(result.percentile(p), 3)
+        record['rcodes'] = dict(sorted(result.rcodes.items()))
+        record['slo_met'] = self.met
+        record['breaches'] = self.breaches
+        record['unreliable'] = self.unreliable
+        return record
+
+
+class CapacityReport:
+    """Every step of a search, in the order they ran."""
+
+    __slots__ = ('search', 'slo', 'steps')
+
+    def __init__(self, search: str, slo: Slo) -> None:
+        self.search = search
+        self.slo = slo
+        self.steps: list[CapacityStep] = []
+
+    @property
+    def sustainable(self) -> float:
+        """Highest offered rate that met the objective, 0.0 if none did."""
+        return max((step.rate for step in self.steps if step.met), default=0.0)
+
+    def to_dict(self) -> dict[str, Any]:
+        return {
+            'search': self.search,
+            'slo': self.slo.limits,
+            'sustainable_qps': self.sustainable,
+            'steps': [step.to_dict() for step in self.steps],
+        }
+
+
+def search_capacity(flood: Flood, slo: Slo, search: str = SEARCH_STEP, start: float = 100.0,
+                    step: float = 100.0, max_rate: float = 100000.0, step_time: float = 5.0,
+                    watchdog: Watchdog | None = None, on_step: Callable[[CapacityStep], None] | None = None,
+                    stop: Callable[[], bool] | None = None) -> CapacityReport:
+    """Offer flood's server increasing rates (queries per second) and return the curve.
+
+    Each step lasts step_time seconds. The search also ends at max_rate,
+    when stop() returns true, or at a step where the client could not send
+    at the offered rate, because sending itself was too slow or the watchdog
+    found the client saturated; beyond it the client, not the server, is
+    measured. A step sent below the rate only because the window was full
+    of unanswered queries breaks the objective instead, as does a step
+    during which the server could not be connected to. With a watchdog,
+    steps run while the client was saturated are marked unreliable.
+    on_step is called after every step.
+    """
+    if search not in SEARCHES:
+        raise ValueError(f"unknown search: {search}")
+    if start <= 0 or step <= 0:
+        raise ValueError("start and step rates must be positive")
+    report = CapacityReport(search, slo)
+    rate = start
+    breaks = 0
+    while rate <= max_rate:
+        mark = watchdog.mark() if watchdog is not None else None
+        result = flood.run(max(1, math.ceil(rate * step_time)), stop=stop, rate=rate)
+        if stop is not None and stop():
+            break
+        breaches = slo.breaches(result)
+        if result.error:
+            breaches.append('connection failed: %s' % result.error)
+        unreliable = ''
+        if watchdog is not None and mark is not None:
+            health = watchdog.report(mark)
+            unreliable = str(health) if health.unreliable else ''
+        short = not result.error and result.sent_qps < rate * MIN_SENT_RATIO
+        # a sender held back by a full window is waiting for the server, which is what is measured
+        client_bound = short and (result.unblocked_qps < rate * MIN_SENT_RATIO or bool(unreliable))
+        if client_bound:
+            breaches.append('client sent %.1f qps' % result.sent_qps)
+        elif short:
+            breaches.append('window full, sent %.1f qps' % result.sent_qps)
+        current = CapacityStep(rate, result, breaches, unreliable)
+        report.steps.append(current)
+        if on_step is not None:
+            on_step(current)
+        if client_bound:
+            break
+        if current.met:
+            rate += step
+            continue
+        breaks += 1
+        if search == SEARCH_STEP or breaks >= MAX_BREAKS:
+            break
+        # back off and climb again, more finely, towards the rate that broke
+        step = max(step / 2, 1.0)
+        rate = max(round(rate * AIMD_DECREASE, 3), start)
+    return report
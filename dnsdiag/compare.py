@@ -0,0 +1,92 @@
+#
+# Copyright (c) 2016-2026, Babak Farrokhi
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# * Redistributions of source code must retain the above copyright notice, this
+#   list of conditions and the following disclaimer.
+#
+# * Redistributions in binary form must reproduce the above copyright notice,
+#   this list of conditions and the following disclaimer in the documentation
+#   and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+# OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+
+"""Paired comparison of response times from servers queried in the same rounds.
+
+When servers take turns in every round, each round sees about the same
+network conditions and client load for all of them. Differences taken
+within a round cancel out what the rounds do not have in common, so their
+median says which server is faster with far fewer queries than comparing
+two separate runs would need. The confidence interval of the median comes
+from order statistics (a sign test), which assumes nothing about how
+response times are distributed.
+"""
+
+import math
+import statistics
+
+CONFIDENCE = 0.95
+
+
+def median_interval(values: list[float], confidence: float = CONFIDENCE) -> tuple[float, float] | None:
+    """Distribution-free confidence interval of the median, None if there are too few values for one."""
+    n = len(values)
+    ordered = sorted(values)
+    # the interval between the k-th smallest and the k-th largest value holds the median
+    # unless at least n - k + 1 values fall on one side of it, with probability 2 * P(X < k)
+    tail = (1 - confidence) / 2
+    # binomial(n, 1/2) probabilities from the ratio of successive terms, in log space so that
+    # neither 2 ** -n underflows nor exact binomial coefficients grow with the number of rounds
+    k = 0
+    cumulative = 0.0
+    log_p = -n * math.log(2)
+    while k < n // 2:
+        cumulative += math.exp(log_p)
+        if cumulative > tail:
+            break
+        log_p += math.log(n - k) - math.log(k + 1)
+        k += 1
+    if k == 0:
+        return None
+    return ordered[k - 1], ordered[n - k]
+
+
+class PairedDifference:
+    """How much slower (positive) or faster (negative) a server is than the baseline, round by round."""
+
+    __slots__ = ('rounds', 'differences')
+
+    def __init__(self, baseline: list[float | None], other: list[float | None]) -> None:
+        self.rounds = min(len(baseline), len(other))
+        # only rounds in which both answered can be compared
+        self.differences = [b - a for a, b in zip(baseline, other) if a is not None and b is not None]
+
+    @property
+    def pairs(self) -> int:
+        return len(self.differences)
+
+    @property
+    def median(self) -> float:
+        return statistics.median(self.differences) if self.differences else 0.0
+
+    @property
+    def interval(self) -> tuple[float, float] | None:
+        return median_interval(self.differences)
+
+    @property
+    def faster(self) -> int:
+        """Rounds in which this server answered first."""
+        return sum(1 for difference in self.differences if difference < 0)
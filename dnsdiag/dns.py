@@ -23,13 +23,22 @@
 # OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
 # OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
 
+import array
+import base64
 import errno
+import math
+import select
 import socket
+import ssl
+import struct
 import time
-from statistics import stdev
+from collections.abc import Callable, Iterator
 from typing import Any
 
 import dns.edns
+import dns.entropy
+import dns.exception
+import dns.flags
 import dns.message
 import dns.query
 import dns.rcode
@@ -68,6 +77,11 @@ _PROTO_PORT: dict[int, int] = {
 
 
 class PingResponse:
+    """Aggregated outcome of ping(); response and answer are only kept when asked for."""
+
+    __slots__ = ('r_avg', 'r_min', 'r_max', 'r_stddev', 'r_lost_percent', 'flags', 'ednsflags', 'ttl', 'answer',
+                 'rcode', 'rcode_text', 'response', 'phases', 'bytes_sent', 'bytes_received', 'unreliable')
+
     def __init__(self) -> None:
         self.r_avg: float = 0.0
         self.r_min: float = 0.0
@@ -81,6 +95,112 @@ class PingResponse:
         self.rcode: int = 0
         self.rcode_text: str = ''
         self.response: Any | None = None
+        self.phases: dict[str, float] = {}  # average milliseconds per phase, see Phases
+        self.bytes_sent: int = 0
+        self.bytes_received: int = 0
+        self.unreliable: str = ''  # why the client could not be trusted meanwhile, see dnsdiag.overhead
+
+
+class RunningStats:
+    """Round-trip time aggregates updated one sample at a time, in constant memory.
+
+    The standard deviation is the sample standard deviation, kept with
+    Welford's online algorithm so that no RTT history is needed.
+    """
+
+    __slots__ = ('count', 'r_min', 'r_max', 'r_avg', '_m2')
+
+    def __init__(self) -> None:
+        self.count = 0
+        self.r_min = 0.0
+        self.r_max = 0.0
+        self.r_avg = 0.0
+        self._m2 = 0.0  # sum of squared deviations from the mean
+
+    def add(self, rtt: float) -> None:
+        self.count += 1
+        if self.count == 1:
+            self.r_min = self.r_max = rtt
+        else:
+            self.r_min = min(self.r_min, rtt)
+            self.r_max = max(self.r_max, rtt)
+        delta = rtt - self.r_avg
+        self.r_avg += delta / self.count
+        self._m2 += delta * (rtt - self.r_avg)
+
+    @property
+    def r_stddev(self) -> float:
+        return math.sqrt(self._m2 / (self.count - 1)) if self.count > 1 else 0.0
+
+    def fill(self, retval: PingResponse, sent: int) -> None:
+        """Copy the aggregates into retval, with loss computed against sent queries."""
+        retval.r_lost_percent = (100 * (sent - self.count)) / sent if sent else 0.0
+        retval.r_min = self.r_min
+        retval.r_max = self.r_max
+        retval.r_avg = self.r_avg
+        retval.r_stddev = self.r_stddev
+
+
+PHASES = ('build', 'connect', 'handshake', 'send', 'wait', 'parse')
+
+
+class Phases:
+    """Where the time of one query went, in milliseconds, and the DNS message bytes it moved.
+
+    build: making and serializing the query; connect: setting up the socket
+    and, for TCP, the connection; handshake: the TLS handshake of a new
+    connection; send: writing the query; wait: from the end of the send until
+    the response was read; parse: decoding the response fields that are kept.
+    Exchanges that run inside dnspython (DoT and DoQ) have their send, wait
+    and parse reported together as wait.
+    """
+
+    __slots__ = PHASES + ('bytes_sent', 'bytes_received')
+
+    def __init__(self) -> None:
+        self.build = 0.0
+        self.connect = 0.0
+        self.handshake = 0.0
+        self.send = 0.0
+        self.wait = 0.0
+        self.parse = 0.0
+        self.bytes_sent = 0
+        self.bytes_received = 0
+
+
+class PhaseStats:
+    """Per-phase averages over answered queries, and byte totals over all queries."""
+
+    __slots__ = ('count', 'totals', 'bytes_sent', 'bytes_received')
+
+    def __init__(self) -> None:
+        self.count = 0
+        self.totals = dict.fromkeys(PHASES, 0.0)
+        self.bytes_sent = 0
+        self.bytes_received = 0
+
+    def add(self, phases: Phases, answered: bool) -> None:
+        self.bytes_sent += phases.bytes_sent
+        self.bytes_received += phases.bytes_received
+        if answered:
+            self.count += 1
+            for name in PHASES:
+                self.totals[name] += getattr(phases, name)
+
+    def averages(self) -> dict[str, float]:
+        if not self.count:
+            return {}
+        return {name: total / self.count for name, total in self.totals.items()}
+
+    def fill(self, retval: PingResponse) -> None:
+        retval.phases = self.averages()
+        retval.bytes_sent = self.bytes_sent
+        retval.bytes_received = self.bytes_received
+
+
+def format_phases(averages: dict[str, float]) -> str:
+    """One-line summary of per-phase averages, e.g. for a statistics footer."""
+    return ', '.join('%s=%.3f ms' % (name, averages[name]) for name in PHASES if name in averages)
 
 
 def proto_to_text(proto: int) -> str:
@@ -106,11 +226,20 @@ class CustomSocket(socket.socket):
 
 def ping(qname: str, server: str, dst_port: int, rdtype: str, timeout: float, count: int, proto: int,
          src_ip: str | None, use_edns: bool = False, force_miss: bool = False,
-         want_dnssec: bool = False, want_nsid: bool = False, socket_ttl: int | None = None) -> PingResponse:
+         want_dnssec: bool = False, want_nsid: bool = False, socket_ttl: int | None = None,
+         keep_response: bool = True, overhead: float = 0.0) -> PingResponse:
+    """Send count queries and return the aggregated result.
+
+    With keep_response=False the parsed message of the last response is not
+    kept (response and answer stay None), which matters when results for many
+    servers are held at once. overhead (in milliseconds, see
+    dnsdiag.overhead.calibrate) is subtracted from every response time.
+    """
     retval = PingResponse()
     retval.rcode_text = "No Response"
 
-    response_times: list[float] = []
+    stats = RunningStats()
+    phase_stats = PhaseStats()
 
     if socket_ttl is not None:
         global _TTL
@@ -127,6 +256,8 @@ def ping(qname: str, server: str, dst_port: int, rdtype: str, timeout: float, co
             pass
 
     for i in range(count):
+        phases = Phases()
+        btime = time.perf_counter()
 
         if force_miss:
             fqdn = "_dnsdiag_%s_.%s" % (random_string(), qname)
@@ -141,14 +272,15 @@ def ping(qname: str, server: str, dst_port: int, rdtype: str, timeout: float, co
                                            options=edns_options if edns_options else None)
         else:
             query = dns.message.make_query(fqdn, rdtype, dns.rdataclass.IN, use_edns=False, want_dnssec=False)
+        phases.build = (time.perf_counter() - btime) * 1000
 
         try:
             stime = time.perf_counter()
+            response: WireResponse | dns.message.Message
             if proto == PROTO_UDP:
-                response = dns.query.udp(query, server, timeout=timeout, port=dst_port, source=src_ip,
-                                         ignore_unexpected=True)
+                response = udp_exchange(query, server, timeout, dst_port, src_ip, phases=phases)
             elif proto == PROTO_TCP:
-                response = dns.query.tcp(query, server, timeout=timeout, port=dst_port, source=src_ip)
+                response = tcp_exchange(query, server, timeout, dst_port, src_ip, phases=phases)
             elif proto == PROTO_TLS:
                 if hasattr(dns.query, 'tls'):
                     response = dns.query.tls(query, server, timeout, dst_port, src_ip)
@@ -171,16 +303,33 @@ def ping(qname: str, server: str, dst_port: int, rdtype: str, timeout: float, co
                     response = dns.query._http3(query, server, url, timeout, dst_port, src_ip)
                 else:
                     unsupported_feature()
+            etime = time.perf_counter()
+
+            if isinstance(response, dns.message.Message):
+                # the whole exchange happened inside dnspython
+                phases.wait = (etime - stime) * 1000
+                phases.bytes_sent = len(query.to_wire())
+                phases.bytes_received = len(response.to_wire())
+
+            # only decode what is kept; WireResponse parses its records on demand
+            ptime = time.perf_counter()
+            rcode = response.rcode()
+            ednsflags = response.ednsflags
+            answer = response.answer
+            ttl = answer[0].ttl if answer else None
+            message = response.message() if isinstance(response, WireResponse) and keep_response else response
+            phases.parse += (time.perf_counter() - ptime) * 1000
 
         except dns.query.NoDOH:
             raise
         except (httpx.ConnectTimeout, httpx.ReadTimeout,
                 httpx.ConnectError):
             raise ConnectionError('Connection failed')
-        except ValueError:
+        except (ValueError, dns.exception.FormError):
             retval.rcode_text = "Invalid Response"
             break
         except dns.exception.Timeout:
+            phase_stats.add(phases, answered=False)
             break
         except OSError as e:
             # Transient network errors should be re-raised for caller to handle
@@ -200,40 +349,974 @@ def ping(qname: str, server: str, dst_port: int, rdtype: str, timeout: float, co
             err(f"ERROR: {type(e).__name__}: {e}")
             break
         else:
-            etime = time.perf_counter()
             # Use perf_counter() measurements for accurate wall-clock time
             elapsed = (etime - stime) * 1000  # Convert seconds to milliseconds
-            response_times.append(elapsed)
-            if response:
-                retval.response = response
-                retval.flags = response.flags
-                retval.ednsflags = response.ednsflags
-                retval.answer = response.answer
-                retval.rcode = response.rcode()
-                retval.rcode_text = dns.rcode.to_text(response.rcode())
-                if len(response.answer) > 0:
-                    retval.ttl = response.answer[0].ttl
-
-    r_sent = i + 1
-    r_received = len(response_times)
-    retval.r_lost_percent = (100 * (r_sent - r_received)) / r_sent
-    if response_times:
-        retval.r_min = min(response_times)
-        retval.r_max = max(response_times)
-        retval.r_avg = sum(response_times) / r_received
-        if len(response_times) > 1:
-            retval.r_stddev = stdev(response_times)
-        else:
-            retval.r_stddev = 0.0
-    else:
-        retval.r_min = 0.0
-        retval.r_max = 0.0
-        retval.r_avg = 0.0
-        retval.r_stddev = 0.0
+            stats.add(max(0.0, elapsed - overhead))
+            phase_stats.add(phases, answered=True)
+            if keep_response:
+                retval.response = message
+                retval.answer = answer
+            retval.flags = response.flags
+            retval.ednsflags = ednsflags
+            retval.rcode = rcode
+            retval.rcode_text = dns.rcode.to_text(rcode)
+            if ttl is not None:
+                retval.ttl = ttl
+
+    stats.fill(retval, i + 1)
+    phase_stats.fill(retval)
 
     return retval
 
 
+class ProbeResult:
+    """Outcome of a single query sent by a Prober; rtt is None when no valid response arrived."""
+
+    __slots__ = ('seq', 'qname', 'rtt', 'size', 'error', 'rcode', 'rcode_text', 'flags', 'ednsflags', 'ttl',
+                 'answer', 'response')
+
+    def __init__(self, seq: int, qname: str) -> None:
+        self.seq: int = seq
+        self.qname: str = qname
+        self.rtt: float | None = None  # milliseconds
+        self.size: int = 0  # response size in bytes
+        self.error: str | None = None
+        self.rcode: int | None = None
+        self.rcode_text: str = "No Response"
+        self.flags: int = 0
+        self.ednsflags: int = 0
+        self.ttl: int | None = None
+        self.answer: Any | None = None
+        self.response: dns.message.Message | None = None
+
+
+class Prober:
+    """Send repeated DNS queries to one server over one transport.
+
+    This is the library interface for embedding dnsdiag. Target, transport
+    and query options are fixed when the prober is created. query() sends
+    one query and returns its ProbeResult, and summary() returns the running
+    aggregates as a PingResponse.
+
+    Connections stay open between queries: one UDP socket, and one TCP, TLS
+    or QUIC connection, or HTTP/2 client, for DoH. A connection the server
+    has dropped is re-established before the next query is timed, resuming
+    the previous TLS session where the server allows it. The query
+    is built once and only gets a fresh ID per query, unless force_miss asks
+    for a new random name each time. A caller that needs other query options
+    passes its own query instead: a message to reuse, or a callable that
+    builds a fresh one per query. No global state is touched: no signal
+    handlers, no dnsdiag.shared.shutdown, no dns.query.socket_factory. The
+    hop limit (ttl) is set only on the prober's own sockets, which is why it
+    is only available for UDP, TCP and TLS. Errors are reported in the
+    result, never printed.
+
+    The server is given by address; server_hostname, when known, is sent as
+    SNI and checked against the certificate for DoT, DoQ and DoH3, and names
+    the DoH URL. overhead (in milliseconds, see dnsdiag.overhead.calibrate)
+    is subtracted from every response time, as in ping().
+
+    A prober is not thread-safe; use one per thread at a time. Example:
+
+        with Prober('9.9.9.9', 'example.com', proto=PROTO_TLS) as prober:
+            for _ in range(5):
+                print(prober.query().rtt)
+            print(prober.summary().r_avg)
+    """
+
+    def __init__(self, server: str, qname: str, rdtype: str = 'A', proto: int = PROTO_UDP,
+                 port: int | None = None, timeout: float = 2.0, src_ip: str | None = None,
+                 use_edns: bool = False, want_dnssec: bool = False, want_nsid: bool = False,
+                 force_miss: bool = False, ttl: int | None = None,
+                 query: dns.message.Message | Callable[[], dns.message.Message] | None = None,
+                 server_hostname: str | None = None, overhead: float = 0.0) -> None:
+        if proto not in _PROTO_NAME:
+            raise ValueError(f"unknown transport protocol: {proto}")
+        if ttl is not None and proto not in (PROTO_UDP, PROTO_TCP, PROTO_TLS):
+            raise ValueError("ttl is only supported with UDP, TCP and TLS")
+        self.server = server
+        self.qname = qname
+        self.rdtype = rdtype
+        self.proto = proto
+        self.port = port if port is not None else get_default_port(proto)
+        self.timeout = timeout
+        self.src_ip = src_ip
+        self.use_edns = use_edns or want_dnssec or want_nsid
+        self.want_dnssec = want_dnssec
+        self.want_nsid = want_nsid
+        self.force_miss = force_miss
+        self.ttl = ttl
+        self.server_hostname = server_hostname
+        self.overhead = overhead
+        self.af = socket.AF_INET6 if ':' in server else socket.AF_INET
+
+        self._template = query if isinstance(query, dns.message.Message) else self._make_query(qname)
+        self._factory = query if callable(query) else None
+        self._tls = TlsSession(server_hostname, alpns=['dot'])  # no hostname check without a hostname
+        self._sock: socket.socket | None = None
+        self._doh: DohSession | None = None
+        self._quic_manager: Any | None = None
+        self._quic_connection: Any | None = None
+
+        self.sent = 0
+        self.stats = RunningStats()
+        self._last: ProbeResult | None = None
+
+    def __enter__(self) -> 'Prober':
+        return self
+
+    def __exit__(self, *exc: object) -> None:
+        self.close()
+
+    def _make_query(self, qname: str) -> dns.message.Message:
+        options: list[dns.edns.Option] | None = None
+        if self.want_nsid:
+            options = [dns.edns.GenericOption(dns.edns.NSID, b'')]
+        if self.use_edns:
+            return dns.message.make_query(qname, self.rdtype, dns.rdataclass.IN, use_edns=True,
+                                          want_dnssec=self.want_dnssec, payload=1232, options=options)
+        return dns.message.make_query(qname, self.rdtype, dns.rdataclass.IN, use_edns=False)
+
+    def _socket(self, kind: int) -> socket.socket:
+        sock = socket.socket(self.af, kind)
+        try:
+            if self.ttl is not None:
+                if self.af == socket.AF_INET:
+                    sock.setsockopt(socket.SOL_IP, socket.IP_TTL, self.ttl)
+                else:
+                    sock.setsockopt(socket.IPPROTO_IPV6, socket.IPV6_UNICAST_HOPS, self.ttl)
+            if self.src_ip:
+                sock.bind((self.src_ip, 0))
+            sock.settimeout(self.timeout)
+            if kind == socket.SOCK_STREAM:
+                sock.connect((self.server, self.port))
+            if self.proto == PROTO_TLS:
+                return self._tls.wrap(sock)[0]
+        except BaseException:
+            sock.close()
+            raise
+        return sock
+
+    def _connect(self) -> None:
+        """Open the connection for the transport unless it is already open; not part of the timed query."""
+        if self.proto == PROTO_UDP and self._sock is None:
+            self._sock = self._socket(socket.SOCK_DGRAM)
+        elif self.proto in (PROTO_TCP, PROTO_TLS) and self._sock is None:
+            self._sock = self._socket(socket.SOCK_STREAM)
+        elif self.proto == PROTO_HTTPS and self._doh is None:
+            self._doh = DohSession(self.timeout, self.src_ip)
+        elif self.proto == PROTO_QUIC and self._quic_connection is None:
+            import dns.quic
+            if self._quic_manager is None:
+                self._quic_manager = dns.quic.SyncQuicManager(  # type: ignore[no-untyped-call]
+                    server_name=self.server_hostname)
+            self._quic_connection = self._quic_manager.connect(self.server, self.port, self.src_ip)
+
+    def _disconnect(self) -> None:
+        if self._sock is not None:
+            self._sock.close()
+            self._sock = None
+        if self._doh is not None:
+            self._doh.close()
+            self._doh = None
+        if self._quic_connection is not None:
+            self._quic_connection.close()
+            self._quic_connection = None
+
+    def _exchange(self, query: dns.message.Message, phases: Phases) -> 'WireResponse | dns.message.Message':
+        if self.proto == PROTO_UDP:
+            return dns.query.udp(query, self.server, self.timeout, self.port, sock=self._sock,
+                                 ignore_unexpected=True)
+        if self.proto == PROTO_TCP:
+            return dns.query.tcp(query, self.server, self.timeout, self.port, sock=self._sock)
+        if self.proto == PROTO_TLS:
+            assert isinstance(self._sock, ssl.SSLSocket)
+            return dns.query.tls(query, self.server, self.timeout, self.port, sock=self._sock)
+        if self.proto == PROTO_HTTPS:
+            assert self._doh is not None
+            return self._doh.query(query, self._url(), self.timeout, self.port, phases=phases)
+        if self.proto == PROTO_QUIC:
+            return dns.query.quic(query, self.server, self.timeout, self.port, connection=self._quic_connection)
+        return dns.query._http3(query, self.server, self._url(), self.timeout, self.port, self.src_ip)
+
+    def _url(self) -> str:
+        """The DoH URL, by server_hostname where known; DoH3 still connects to the address."""
+        host = self.server_hostname or (f"[{self.server}]" if ':' in self.server else self.server)
+        return f"https://{host}:{self.port}/dns-query"
+
+    def query(self) -> ProbeResult:
+        """Send one query and wait for its response, at most timeout seconds."""
+        self.sent += 1
+        if self._factory is not None:
+            query = self._factory()
+        elif self.force_miss:
+            query = self._make_query("_dnsdiag_%s_.%s" % (random_string(), self.qname))
+        else:
+            query = self._template
+            query.id = dns.entropy.random_16()
+        result = ProbeResult(self.sent, str(query.question[0].name))
+
+        for attempt in range(2):
+            try:
+                reused = self._sock is not None or self._doh is not None or self._quic_connection is not None
+                self._connect()
+                phases = Phases()
+                stime = time.perf_counter()
+                response = self._exchange(query, phases)
+                # a DoH connection is (re)opened inside the exchange; its setup is not part of the rtt
+                elapsed = (time.perf_counter() - stime) * 1000 - phases.connect - phases.handshake
+                result.rtt = max(0.0, elapsed - self.overhead)
+            except (EOFError, ConnectionError) as e:
+                # an idle connection the server has closed; reconnect and retry once
+                self._disconnect()
+                if reused and attempt == 0 and self.proto != PROTO_UDP:
+                    continue
+                result.error = f"{type(e).__name__}: {e}"
+            except (dns.exception.Timeout, TimeoutError):
+                if self.proto != PROTO_UDP:  # a stream may still deliver the late response
+                    self._disconnect()
+                result.error = "timeout"
+            except (OSError, ValueError, dns.exception.DNSException, httpx.HTTPError) as e:
+                self._disconnect()
+                result.error = f"{type(e).__name__}: {e}"
+            else:
+                if isinstance(self._sock, ssl.SSLSocket):
+                    self._tls.remember(self._sock)
+                if isinstance(response, WireResponse):
+                    result.size = len(response)
+                    response = response.message()
+                else:
+                    result.size = len(response.to_wire())
+                result.response = response
+                result.rcode = response.rcode()
+                result.rcode_text = dns.rcode.to_text(response.rcode())
+                result.flags = response.flags
+                result.ednsflags = response.ednsflags
+                result.answer = response.answer
+                if response.answer:
+                    result.ttl = response.answer[0].ttl
+            break
+
+        if result.rtt is not None:
+            self.stats.add(result.rtt)
+        self._last = result
+        return result
+
+    @property
+    def received(self) -> int:
+        return self.stats.count
+
+    def summary(self) -> PingResponse:
+        """Aggregate statistics of every query sent so far, with the fields of the last response."""
+        retval = PingResponse()
+        self.stats.fill(retval, self.sent)
+        last = self._last
+        if last is not None:
+            retval.rcode_text = last.rcode_text
+            retval.rcode = last.rcode or 0
+            retval.flags = last.flags
+            retval.ednsflags = last.ednsflags
+            retval.ttl = last.ttl
+            retval.answer = last.answer
+            retval.response = last.response
+        return retval
+
+    def reset(self) -> None:
+        """Start the aggregates of summary() afresh, keeping the connection open."""
+        self.sent = 0
+        self.stats = RunningStats()
+        self._last = None
+
+    def close(self) -> None:
+        self._disconnect()
+        self._quic_manager = None
+
+
+class PingSample:
+    """Compact per-query record yielded by iter_ping(); holds no parsed message."""
+
+    __slots__ = ('seq', 'rtt', 'rcode', 'size', 'flags', 'ednsflags', 'ttl', 'error')
+
+    def __init__(self, result: ProbeResult) -> None:
+        self.seq: int = result.seq
+        self.rtt: float | None = result.rtt  # milliseconds, None if lost
+        self.rcode: int | None = result.rcode
+        self.size: int = result.size
+        self.flags: int = result.flags
+        self.ednsflags: int = result.ednsflags
+        self.ttl: int | None = result.ttl
+        self.error: str | None = result.error
+
+
+def iter_ping(qname: str, server: str, dst_port: int | None = None, rdtype: str = 'A', timeout: float = 2.0,
+              count: int = 0, proto: int = PROTO_UDP, src_ip: str | None = None, use_edns: bool = False,
+              force_miss: bool = False, want_dnssec: bool = False, want_nsid: bool = False,
+              interval: float = 0.0) -> Iterator[PingSample]:
+    """Query server repeatedly and yield one PingSample per query as it completes.
+
+    Nothing is accumulated between samples, so a caller can stream results
+    into its own aggregator (e.g. RunningStats) or sink in constant memory.
+    count=0 keeps going until the caller stops iterating; interval is the
+    minimum time between the starts of consecutive queries, in seconds.
+    The connection is closed when the generator is closed or exhausted.
+    """
+    with Prober(server, qname, rdtype=rdtype, proto=proto, port=dst_port, timeout=timeout, src_ip=src_ip,
+                use_edns=use_edns, want_dnssec=want_dnssec, want_nsid=want_nsid,
+                force_miss=force_miss) as prober:
+        seq = 0
+        while count == 0 or seq < count:
+            seq += 1
+            stime = time.monotonic()
+            yield PingSample(prober.query())
+            if interval > 0 and (count == 0 or seq < count):
+                delay = stime + interval - time.monotonic()
+                if delay > 0:
+                    time.sleep(delay)
+
+
+_DNS_HEADER = struct.Struct('!HHHHHH')
+_QUESTIONLESS_RCODES = (dns.rcode.FORMERR, dns.rcode.SERVFAIL, dns.rcode.NOTIMP, dns.rcode.REFUSED)
+
+
+class WireResponse:
+    """A received response kept as raw bytes, with only its 12-byte header decoded.
+
+    The record sections are parsed by dnspython the first time something
+    asks for them (answer, options, to_text(), ...). A response without
+    additional records cannot carry an OPT record, so its rcode, EDNS flags
+    and options are known from the header alone and never trigger a parse.
+    """
+
+    __slots__ = ('wire', 'id', 'flags', 'qdcount', 'ancount', 'nscount', 'arcount', '_message')
+
+    def __init__(self, wire: bytes) -> None:
+        if len(wire) < _DNS_HEADER.size:
+            raise dns.message.ShortHeader
+        header: tuple[int, int, int, int, int, int] = _DNS_HEADER.unpack_from(wire)
+        self.wire = wire
+        self.id, self.flags, self.qdcount, self.ancount, self.nscount, self.arcount = header
+        self._message: dns.message.Message | None = None
+
+    def __len__(self) -> int:
+        return len(self.wire)
+
+    def message(self) -> dns.message.Message:
+        """The fully parsed message; parsed once, on first use."""
+        if self._message is None:
+            self._message = dns.message.from_wire(self.wire)
+        return self._message
+
+    def rcode(self) -> dns.rcode.Rcode:
+        if self.arcount == 0:
+            return dns.rcode.Rcode(self.flags & 0x000f)
+        return self.message().rcode()
+
+    @property
+    def ednsflags(self) -> int:
+        return self.message().ednsflags if self.arcount else 0
+
+    @property
+    def options(self) -> list[Any]:
+        return list(self.message().options) if self.arcount else []
+
+    @property
+    def answer(self) -> list[dns.rrset.RRset]:
+        return self.message().answer if self.ancount else []
+
+    def to_text(self) -> str:
+        return self.message().to_text()
+
+
+def _question_end(wire: bytes) -> int:
+    """Offset just past the first question of a message whose name is not compressed."""
+    offset = _DNS_HEADER.size
+    while wire[offset]:
+        offset += wire[offset] + 1
+    return offset + 5  # root label, qtype, qclass
+
+
+def _is_response(query: bytes, qend: int, wire: bytes) -> bool:
+    """Match a raw response against the raw query, as dns.message.Message.is_response() does."""
+    if len(wire) < _DNS_HEADER.size or wire[:2] != query[:2]:
+        return False
+    flags = (wire[2] << 8) | wire[3]
+    if not flags & dns.flags.QR or (flags ^ ((query[2] << 8) | query[3])) & 0x7800:  # QR set, same opcode
+        return False
+    qdcount = (wire[4] << 8) | wire[5]
+    if qdcount == 0:
+        return (flags & 0x000f) in _QUESTIONLESS_RCODES
+    # names compare case-insensitively; label lengths (< 64) are unaffected by lower()
+    name_end = qend - 4
+    if qdcount != 1 or wire[name_end:qend] != query[name_end:qend]:
+        return False
+    return wire[_DNS_HEADER.size:name_end].lower() == query[_DNS_HEADER.size:name_end].lower()
+
+
+def _source(where: str, source: str | None, source_port: int) -> tuple[int, tuple[str, int] | None]:
+    af = socket.AF_INET6 if ':' in where else socket.AF_INET
+    if source is None and source_port == 0:
+        return af, None
+    return af, (source or ('::' if af == socket.AF_INET6 else '0.0.0.0'), source_port)
+
+
+def udp_exchange(query: dns.message.Message, where: str, timeout: float, port: int = 53,
+                 source: str | None = None, source_port: int = 0, phases: Phases | None = None) -> WireResponse:
+    """Send query over UDP and return the raw response, parsing only its header.
+
+    Datagrams from other sources or that do not answer this query are
+    ignored, like dns.query.udp(ignore_unexpected=True). Sockets come from
+    dns.query.socket_factory so that callers overriding it still apply.
+    Phase timings and byte counts are added to phases when given.
+    """
+    phases = phases if phases is not None else Phases()
+    t0 = time.perf_counter()
+    wire = query.to_wire()
+    qend = _question_end(wire)
+    af, bind_to = _source(where, source, source_port)
+    expiration = time.monotonic() + timeout
+    t1 = time.perf_counter()
+    phases.build += (t1 - t0) * 1000
+    with dns.query.socket_factory(af, socket.SOCK_DGRAM, 0) as sock:
+        if bind_to is not None:
+            sock.bind(bind_to)
+        destination = socket.getaddrinfo(where, port, af, socket.SOCK_DGRAM)[0][4]
+        t2 = time.perf_counter()
+        phases.connect += (t2 - t1) * 1000
+        sock.sendto(wire, destination)
+        phases.bytes_sent += len(wire)
+        t3 = time.perf_counter()
+        phases.send += (t3 - t2) * 1000
+        while True:
+            remaining = expiration - time.monotonic()
+            if remaining <= 0:
+                raise dns.exception.Timeout
+            sock.settimeout(remaining)
+            try:
+                data, peer = sock.recvfrom(65535)
+            except TimeoutError:
+                raise dns.exception.Timeout from None
+            phases.bytes_received += len(data)
+            if peer[:2] == destination[:2] and _is_response(wire, qend, data):
+                t4 = time.perf_counter()
+                phases.wait += (t4 - t3) * 1000
+                response = WireResponse(data)
+                phases.parse += (time.perf_counter() - t4) * 1000
+                return response
+
+
+def _recv_exactly(sock: socket.socket, count: int, expiration: float) -> bytes:
+    data = b''
+    while len(data) < count:
+        remaining = expiration - time.monotonic()
+        if remaining <= 0:
+            raise dns.exception.Timeout
+        sock.settimeout(remaining)
+        try:
+            chunk = sock.recv(count - len(data))
+        except TimeoutError:
+            raise dns.exception.Timeout from None
+        if not chunk:
+            raise EOFError("EOF")
+        data += chunk
+    return data
+
+
+def tcp_exchange(query: dns.message.Message, where: str, timeout: float, port: int = 53,
+                 source: str | None = None, source_port: int = 0, sock: socket.socket | None = None,
+                 phases: Phases | None = None) -> WireResponse:
+    """Send query over TCP and return the raw response, parsing only its header.
+
+    An already connected sock is used as is and left open; otherwise a new
+    connection is made for this query. Messages on the stream that do not
+    answer this query are skipped. Phase timings and byte counts are added
+    to phases when given.
+    """
+    phases = phases if phases is not None else Phases()
+    t0 = time.perf_counter()
+    wire = query.to_wire()
+    qend = _question_end(wire)
+    expiration = time.monotonic() + timeout
+    t1 = time.perf_counter()
+    phases.build += (t1 - t0) * 1000
+    own_sock = sock is None
+    if sock is None:
+        af, bind_to = _source(where, source, source_port)
+        sock = dns.query.socket_factory(af, socket.SOCK_STREAM, 0)
+    try:
+        if own_sock:
+            if bind_to is not None:
+                sock.bind(bind_to)
+            sock.settimeout(timeout)
+            try:
+                sock.connect((where, port))
+            except TimeoutError:
+                raise dns.exception.Timeout from None
+        t2 = time.perf_counter()
+        phases.connect += (t2 - t1) * 1000
+        sock.settimeout(max(expiration - time.monotonic(), 0))
+        try:
+            sock.sendall(struct.pack('!H', len(wire)) + wire)
+        except TimeoutError:
+            raise dns.exception.Timeout from None
+        phases.bytes_sent += len(wire)
+        t3 = time.perf_counter()
+        phases.send += (t3 - t2) * 1000
+        while True:
+            (length,) = struct.unpack('!H', _recv_exactly(sock, 2, expiration))
+            data = _recv_exactly(sock, length, expiration)
+            phases.bytes_received += len(data)
+            if _is_response(wire, qend, data):
+                t4 = time.perf_counter()
+                phases.wait += (t4 - t3) * 1000
+                response = WireResponse(data)
+                phases.parse += (time.perf_counter() - t4) * 1000
+                return response
+    finally:
+        if own_sock:
+            sock.close()
+
+
+# How a TLS-based query got its connection
+TLS_FULL = 'full'  # new connection, full handshake
+TLS_RESUMED = 'resumed'  # new connection, abbreviated handshake with a stored session
+TLS_REUSED = 'reused'  # an already open connection, no handshake
+
+
+class TlsSession:
+    """TLS state kept for a whole run: one SSL context and the last session ticket.
+
+    Every new connection offers the stored session, so that after the first
+    full handshake the server can resume it, as production clients do.
+    """
+
+    def __init__(self, server_hostname: str | None = None, verify: bool = True,
+                 alpns: list[str] | None = None) -> None:
+        self.server_hostname = server_hostname
+        self.context = dns.query.make_ssl_context(verify, server_hostname is not None, alpns)
+        self.session: ssl.SSLSession | None = None
+
+    def wrap(self, sock: socket.socket, phases: Phases | None = None) -> tuple[ssl.SSLSocket, str]:
+        """Run the TLS handshake on a connected socket; returns the TLS socket and TLS_FULL or TLS_RESUMED."""
+        phases = phases if phases is not None else Phases()
+        start = time.perf_counter()
+        try:
+            tls_sock = self.context.wrap_socket(sock, server_hostname=self.server_hostname, session=self.session)
+        except TimeoutError:
+            raise dns.exception.Timeout from None
+        phases.handshake += (time.perf_counter() - start) * 1000
+        return tls_sock, TLS_RESUMED if tls_sock.session_reused else TLS_FULL
+
+    def connect(self, where: str, port: int, timeout: float, source: str | None = None, source_port: int = 0,
+                phases: Phases | None = None) -> tuple[ssl.SSLSocket, str]:
+        """Open a new TCP connection and run the TLS handshake on it."""
+        phases = phases if phases is not None else Phases()
+        af, bind_to = _source(where, source, source_port)
+        sock = dns.query.socket_factory(af, socket.SOCK_STREAM, 0)
+        try:
+            if bind_to is not None:
+                sock.bind(bind_to)
+            sock.settimeout(timeout)
+            start = time.perf_counter()
+            try:
+                sock.connect((where, port))
+            except TimeoutError:
+                raise dns.exception.Timeout from None
+            phases.connect += (time.perf_counter() - start) * 1000
+            return self.wrap(sock, phases)
+        except BaseException:
+            sock.close()
+            raise
+
+    def remember(self, tls_sock: ssl.SSLSocket) -> None:
+        """Keep the session of a connection for the next one.
+
+        With TLS 1.3 the ticket arrives after the handshake, so call this
+        once a response has been read.
+        """
+        if tls_sock.session is not None:
+            self.session = tls_sock.session
+
+
+class DohSession:
+    """One HTTP/2 client kept for a whole run, so that DoH (RFC 8484) queries reuse its connection.
+
+    Queries are sent as GET requests and answered with a WireResponse.
+    Connection setup is timed through httpcore trace events; after each
+    query, state tells whether it reused the open connection or needed a
+    new one (TLS_FULL, or TLS_RESUMED should the TLS layer resume a session).
+    """
+
+    def __init__(self, timeout: float, source: str | None = None, verify: bool = True) -> None:
+        transport = httpx.HTTPTransport(http1=False, http2=True, verify=verify, local_address=source,
+                                        limits=httpx.Limits(keepalive_expiry=60.0))
+        self.client = httpx.Client(http1=False, http2=True, verify=verify, transport=transport, timeout=timeout,
+                                   event_hooks={'request': [self._add_trace]})
+        self.state = TLS_REUSED
+        self._phases = Phases()
+        self._started: dict[str, float] = {}
+
+    def _add_trace(self, request: httpx.Request) -> None:
+        request.extensions['trace'] = self._trace
+
+    def _trace(self, event: str, info: dict[str, Any]) -> None:
+        _, name, stage = event.rsplit('.', 2)
+        if name not in ('connect_tcp', 'start_tls'):
+            return
+        if stage == 'started':
+            self._started[name] = time.perf_counter()
+            return
+        if stage != 'complete' or name not in self._started:
+            return
+        elapsed = (time.perf_counter() - self._started.pop(name)) * 1000
+        if name == 'connect_tcp':
+            self._phases.connect += elapsed
+            self.state = TLS_FULL
+        else:
+            self._phases.handshake += elapsed
+            stream = info.get('return_value')
+            ssl_object = stream.get_extra_info('ssl_object') if stream is not None else None
+            if ssl_object is not None and ssl_object.session_reused:
+                self.state = TLS_RESUMED
+
+    def query(self, query: dns.message.Message, where: str, timeout: float, port: int = 443,
+              phases: Phases | None = None) -> WireResponse:
+        """Send query to where, a server address or a full https:// URL.
+
+        Raises ValueError for a non-2xx status and dns.query.BadResponse for
+        a reply that does not answer the query.
+        """
+        self.state = TLS_REUSED
+        self._phases = phases = phases if phases is not None else Phases()
+        if where.startswith('https://'):
+            url = where
+        elif ':' in where:
+            url = f"https://[{where}]:{port}/dns-query"
+        else:
+            url = f"https://{where}:{port}/dns-query"
+
+        start = time.perf_counter()
+        wire = query.to_wire()
+        qend = _question_end(wire)
+        params = {'dns': base64.urlsafe_b64encode(wire).rstrip(b'=').decode()}
+        send_start = time.perf_counter()
+        phases.build += (send_start - start) * 1000
+        response = self.client.get(url, params=params, headers={'accept': 'application/dns-message'},
+                                   timeout=timeout)
+        received = time.perf_counter()
+        phases.wait += (received - send_start) * 1000 - phases.connect - phases.handshake
+        phases.bytes_sent += len(wire)
+        phases.bytes_received += len(response.content)
+        if not 200 <= response.status_code <= 299:
+            raise ValueError(f"{where} responded with status code {response.status_code}")
+        if not _is_response(wire, qend, response.content):
+            raise dns.query.BadResponse
+        answer = WireResponse(response.content)
+        phases.parse += (time.perf_counter() - received) * 1000
+        return answer
+
+    def close(self) -> None:
+        self.client.close()
+
+
+class FloodResult:
+    """Outcome of a Flood run; rtts holds every response time in milliseconds, in arrival order."""
+
+    __slots__ = ('window', 'rate', 'sent', 'received', 'lost', 'duration', 'send_span', 'rtts', 'rcodes',
+                 'window_wait', 'reconnects', 'error', '_sorted')
+
+    def __init__(self, window: int, rate: float = 0.0) -> None:
+        self.window = window
+        self.rate = rate  # offered queries per second, 0 for a closed loop
+        self.sent = 0
+        self.received = 0
+        self.lost = 0
+        self.duration = 0.0  # seconds from the first query to the last response or timeout
+        self.send_span = 0.0  # seconds from the start to the moment the last query actually went out
+        self.window_wait = 0.0  # seconds during which a query was due but the window was full
+        self.rtts = array.array('d')
+        self.rcodes: dict[str, int] = {}
+        self.reconnects = 0  # connections re-established after the server dropped one or a send failed
+        self.error = ''  # why the run ended early, when a connection could not be (re)established
+        self._sorted: list[float] | None = None
+
+    @property
+    def qps(self) -> float:
+        """Responses received per second."""
+        return self.received / self.duration if self.duration > 0 else 0.0
+
+    @property
+    def sent_qps(self) -> float:
+        """Queries actually sent per second; below rate when the client or the window could not keep up."""
+        if self.rate and self.sent:
+            return self.sent / (self.send_span + 1 / self.rate)
+        return self.sent / self.duration if self.duration > 0 else 0.0
+
+    @property
+    def unblocked_qps(self) -> float:
+        """Queries sent per second, leaving out the time spent waiting for space in the window.
+
+        Below rate, the client itself could not send at the offered load.
+        """
+        if self.rate and self.sent:
+            return self.sent / (max(self.send_span - self.window_wait, 0.0) + 1 / self.rate)
+        return self.sent_qps
+
+    @property
+    def lost_percent(self) -> float:
+        return 100 * self.lost / self.sent if self.sent else 0.0
+
+    def percentile(self, p: float) -> float:
+        """Nearest-rank percentile of the response times, 0.0 when none arrived."""
+        if self._sorted is None or len(self._sorted) != len(self.rtts):
+            self._sorted = sorted(self.rtts)
+        if not self._sorted:
+            return 0.0
+        rank = math.ceil(p / 100 * len(self._sorted))
+        return self._sorted[min(max(rank, 1), len(self._sorted)) - 1]
+
+    def stats(self) -> RunningStats:
+        stats = RunningStats()
+        for rtt in self.rtts:
+            stats.add(rtt)
+        return stats
+
+
+MAX_WINDOW = 0xffff  # queries in flight need distinct 16-bit IDs
+
+_CONNECTION_ERRORS = (OSError, dns.exception.Timeout)  # refused, reset, unreachable or timed out
+
+
+def _connection_error(e: BaseException) -> str:
+    return 'connection timed out' if isinstance(e, (TimeoutError, dns.exception.Timeout)) else str(e)
+
+
+class Flood:
+    """Keep up to window queries in flight to one server, sending the next one as each completes.
+
+    This is a closed loop: throughput is whatever the server sustains with
+    window outstanding queries, rather than the 1/RTT of one query at a
+    time. UDP uses one socket and TCP or TLS one connection, pipelining
+    queries and matching responses by ID, in whatever order they come
+    back (RFC 7766, Section 6.2.1.1). A connection the server drops, or a
+    send that fails, counts the outstanding queries as lost and the
+    connection is opened again; when that fails too, run() ends early and
+    returns what it measured so far, with the reason in FloodResult.error.
+
+    query is either a message, sent again with a new ID each time, or a
+    callable that builds a fresh message per query (e.g. random names to
+    force cache misses). IDs are handed out sequentially, so one is not
+    reused until 65536 queries later and a late response cannot be
+    mistaken for the answer to a newer query.
+
+    Given a rate, run() is an open loop instead: queries are sent on a
+    fixed schedule whether or not earlier ones were answered, with window
+    only capping how many may be outstanding. Response times are then
+    measured from the scheduled send time, so that a query the client had
+    to hold back is not reported as faster than it really was.
+    """
+
+    def __init__(self, server: str, query: dns.message.Message | Callable[[], dns.message.Message],
+                 proto: int = PROTO_UDP, port: int | None = None, window: int = 1, timeout: float = 2.0,
+                 src_ip: str | None = None, src_port: int = 0, tls: TlsSession | None = None) -> None:
+        if proto not in (PROTO_UDP, PROTO_TCP, PROTO_TLS):
+            raise ValueError("only UDP, TCP and TLS can keep several queries in flight")
+        if not 1 <= window <= MAX_WINDOW:
+            raise ValueError(f"window must be between 1 and {MAX_WINDOW}: {window}")
+        self.server = server
+        self.proto = proto
+        self.port = port if port is not None else get_default_port(proto)
+        self.window = window
+        self.timeout = timeout
+        self.src_ip = src_ip
+        self.src_port = src_port
+        self._tls = tls if tls is not None else TlsSession(alpns=['dot'])
+        self._make_query = query if callable(query) else None
+        self._template = query.to_wire() if isinstance(query, dns.message.Message) else b''
+        self._template_qend = _question_end(self._template) if self._template else 0
+        self._next_id = dns.entropy.random_16()
+        self._sock: socket.socket | None = None
+        self._destination: Any = None
+        self._buffer = b''
+
+    def _connect(self) -> None:
+        af, bind_to = _source(self.server, self.src_ip, self.src_port)
+        if self.proto == PROTO_TLS:
+            self._sock, _ = self._tls.connect(self.server, self.port, self.timeout, source=self.src_ip,
+                                              source_port=self.src_port)
+        else:
+            kind = socket.SOCK_DGRAM if self.proto == PROTO_UDP else socket.SOCK_STREAM
+            sock = dns.query.socket_factory(af, kind, 0)
+            try:
+                if bind_to is not None:
+                    sock.bind(bind_to)
+                sock.settimeout(self.timeout)
+                if self.proto == PROTO_UDP:
+                    self._destination = socket.getaddrinfo(self.server, self.port, af, socket.SOCK_DGRAM)[0][4]
+                else:
+                    sock.connect((self.server, self.port))
+            except BaseException:
+                sock.close()
+                raise
+            self._sock = sock
+        self._buffer = b''
+
+    def _close(self) -> None:
+        if self._sock is not None:
+            self._sock.close()
+            self._sock = None
+
+    def _reconnect(self, result: FloodResult, outstanding: dict[int, tuple[float, bytes, int]]) -> bool:
+        """Count the queries in flight as lost and connect again; False, with result.error set, if that fails."""
+        result.lost += len(outstanding)
+        outstanding.clear()
+        self._close()
+        try:
+            self._connect()
+        except ssl.SSLCertVerificationError:
+            raise
+        except _CONNECTION_ERRORS as e:
+            result.error = _connection_error(e)
+            return False
+        result.reconnects += 1
+        return True
+
+    def _next_query(self, outstanding: dict[int, tuple[float, bytes, int]]) -> tuple[int, bytes, int]:
+        qid = self._next_id
+        while qid in outstanding:
+            qid = (qid + 1) & 0xffff
+        self._next_id = (qid + 1) & 0xffff
+        if self._make_query is not None:
+            query = self._make_query()
+            query.id = qid
+            wire = query.to_wire()
+            return qid, wire, _question_end(wire)
+        return qid, struct.pack('!H', qid) + self._template[2:], self._template_qend
+
+    def _send(self, wire: bytes) -> None:
+        assert self._sock is not None
+        if self.proto == PROTO_UDP:
+            self._sock.sendto(wire, self._destination)
+        else:
+            self._sock.sendall(struct.pack('!H', len(wire)) + wire)
+
+    def _receive(self, wait: float) -> list[bytes]:
+        """Return the messages that arrive within wait seconds; raises EOFError when the stream ends."""
+        sock = self._sock
+        assert sock is not None
+        pending = isinstance(sock, ssl.SSLSocket) and sock.pending() > 0
+        if not pending and not select.select([sock], [], [], wait)[0]:
+            return []
+        if self.proto == PROTO_UDP:
+            data, peer = sock.recvfrom(65535)
+            return [data] if peer[:2] == self._destination[:2] else []
+        try:
+            chunk = sock.recv(65535)
+        except TimeoutError:
+            return []
+        if not chunk:
+            raise EOFError("EOF")
+        buffer = self._buffer + chunk
+        messages = []
+        while len(buffer) >= 2:
+            (length,) = struct.unpack_from('!H', buffer)
+            if len(buffer) < 2 + length:
+                break
+            messages.append(buffer[2:2 + length])
+            buffer = buffer[2 + length:]
+        self._buffer = buffer
+        return messages
+
+    def run(self, count: int = 0, stop: Callable[[], bool] | None = None, rate: float = 0.0) -> FloodResult:
+        """Send count queries (0: until stop() returns true) and wait for the last of them.
+
+        rate is the offered load in queries per second, 0 to send the next
+        query as soon as the window allows. Queries still in flight when
+        stop() turns true are abandoned and left out of the counts.
+        """
+        result = FloodResult(self.window, rate)
+        outstanding: dict[int, tuple[float, bytes, int]] = {}  # ID -> (send time, query wire, question end)
+        try:
+            self._connect()
+        except ssl.SSLCertVerificationError:
+            raise  # a configuration problem rather than the server giving way
+        except _CONNECTION_ERRORS as e:
+            result.error = _connection_error(e)
+            return result
+        start = end = due = time.perf_counter()
+        full_since = None  # when the window filled up with more queries to send at a rate
+        try:
+            while not result.error:
+                if stop is not None and stop():
+                    result.sent -= len(outstanding)
+                    break
+                now = time.perf_counter()
+                # queries are sent in order and share one timeout, so the oldest expires first
+                while outstanding:
+                    qid, (sent_at, _, _) = next(iter(outstanding.items()))
+                    if now - sent_at < self.timeout:
+                        break
+                    del outstanding[qid]
+                    result.lost += 1
+                    end = now
+                while len(outstanding) < self.window and (count == 0 or result.sent < count):
+                    sent_at = time.perf_counter()
+                    if rate:
+                        if due > now:
+                            break
+                        if full_since is not None:
+                            # how long this query, due since due, was held back by the full window
+                            result.window_wait += max(sent_at - max(full_since, due), 0.0)
+                            full_since = None
+                        # response times count from the schedule, including any wait for the window
+                        sent_at, due = due, start + (result.sent + 1) / rate  # from the start, so errors do not add up
+                    qid, wire, qend = self._next_query(outstanding)
+                    outstanding[qid] = (sent_at, wire, qend)
+                    result.sent += 1
+                    result.send_span = time.perf_counter() - start
+                    try:
+                        self._send(wire)
+                    except _CONNECTION_ERRORS:
+                        end = time.perf_counter()
+                        self._reconnect(result, outstanding)
+                        break
+                if result.error:
+                    break
+                more = count == 0 or result.sent < count
+                if not outstanding and not more:
+                    break
+                if rate and more and full_since is None and len(outstanding) >= self.window:
+                    full_since = time.perf_counter()
+
+                # until the oldest query times out or, with a rate, the next one is due
+                wait = next(iter(outstanding.values()))[0] + self.timeout if outstanding else math.inf
+                if rate and more and len(outstanding) < self.window:
+                    wait = min(wait, due)
+                wait -= time.perf_counter()
+                if stop is not None:
+                    wait = min(wait, 0.1)
+                try:
+                    messages = self._receive(max(wait, 0.0))
+                except (EOFError, *_CONNECTION_ERRORS):
+                    end = time.perf_counter()
+                    self._reconnect(result, outstanding)
+                    continue
+                received = time.perf_counter()
+                for data in messages:
+                    entry = outstanding.get((data[0] << 8) | data[1]) if len(data) >= 2 else None
+                    if entry is None or not _is_response(entry[1], entry[2], data):
+                        continue
+                    del outstanding[(data[0] << 8) | data[1]]
+                    result.received += 1
+                    result.rtts.append((received - entry[0]) * 1000)
+                    rcode = dns.rcode.to_text(dns.rcode.Rcode(data[3] & 0x0f))
+                    result.rcodes[rcode] = result.rcodes.get(rcode, 0) + 1
+                    end = received
+        finally:
+            self._close()
+        result.duration = end - start
+        return result
+
+
 def valid_rdatatype(rtype: str) -> bool:
     # validate RR type
     try:
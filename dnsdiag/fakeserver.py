@@ -0,0 +1,661 @@
+#
+# Copyright (c) 2016-2026, Babak Farrokhi
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# * Redistributions of source code must retain the above copyright notice, this
+#   list of conditions and the following disclaimer.
+#
+# * Redistributions in binary form must reproduce the above copyright notice,
+#   this list of conditions and the following disclaimer in the documentation
+#   and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+# OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+"""A self-contained DNS server for offline testing and benchmarking.
+
+It answers from a fixed zone over UDP, TCP, DoT, DoH (HTTP/2) and DoQ, with
+a self-signed certificate for the encrypted transports. Answers can be
+delayed (fixed or drawn from a distribution), dropped, truncated or rate
+limited, so that client behaviour and overhead can be measured reproducibly
+without touching the network.
+
+All listeners share one asyncio event loop on a background thread; use it
+in-process as a context manager, or run it standalone:
+
+    python -m dnsdiag.fakeserver --udp 5353 --tcp 5353 --tls 8853
+"""
+
+import asyncio
+import base64
+import datetime
+import getopt
+import ipaddress
+import os
+import random
+import shutil
+import signal
+import ssl
+import struct
+import sys
+import tempfile
+import threading
+import time
+import urllib.parse
+from typing import Any, cast
+
+import dns.edns
+import dns.exception
+import dns.flags
+import dns.message
+import dns.opcode
+import dns.rcode
+import dns.rdataclass
+import dns.rdatatype
+import dns.rrset
+import dns.zone
+
+TRANSPORTS = ('udp', 'tcp', 'tls', 'https', 'quic')
+
+NSID = b'dnsdiag-fakeserver'
+
+DEFAULT_ZONE = """\
+$ORIGIN example.com.
+$TTL 300
+@       IN SOA  ns1 hostmaster 1 7200 3600 1209600 300
+@       IN NS   ns1
+@       IN A    192.0.2.1
+@       IN AAAA 2001:db8::1
+@       IN MX   10 mail
+@       IN TXT  "v=spf1 -all"
+ns1     IN A    192.0.2.53
+mail    IN A    192.0.2.25
+www     IN CNAME @
+big     IN TXT  "0000000000000000000000000000000000000000000000000000000000000000"
+big     IN TXT  "1111111111111111111111111111111111111111111111111111111111111111"
+big     IN TXT  "2222222222222222222222222222222222222222222222222222222222222222"
+big     IN TXT  "3333333333333333333333333333333333333333333333333333333333333333"
+big     IN TXT  "4444444444444444444444444444444444444444444444444444444444444444"
+big     IN TXT  "5555555555555555555555555555555555555555555555555555555555555555"
+big     IN TXT  "6666666666666666666666666666666666666666666666666666666666666666"
+big     IN TXT  "7777777777777777777777777777777777777777777777777777777777777777"
+"""
+
+
+class Delay:
+    """Response delay drawn from a distribution, given in milliseconds.
+
+    Specs are "fixed:MS" (or just "MS"), "uniform:LOW,HIGH", "normal:MEAN,STDDEV"
+    (clipped at zero) and "exp:MEAN".
+    """
+
+    KINDS = {'fixed': 1, 'uniform': 2, 'normal': 2, 'exp': 1}
+
+    def __init__(self, kind: str = 'fixed', *params: float) -> None:
+        if kind not in self.KINDS:
+            raise ValueError(f'unknown delay distribution: {kind}')
+        if len(params) != self.KINDS[kind] or any(p < 0 for p in params):
+            raise ValueError(f'invalid parameters for {kind} delay')
+        self.kind = kind
+        self.params = params
+
+    @classmethod
+    def parse(cls, spec: str) -> 'Delay':
+        kind, _, args = spec.partition(':') if ':' in spec else ('fixed', '', spec)
+        try:
+            params = [float(arg) for arg in args.split(',')]
+        except ValueError:
+            raise ValueError(f'invalid delay: {spec}') from None
+        return cls(kind, *params)
+
+    def sample(self, rng: random.Random) -> float:
+        """Return the next delay in seconds."""
+        if self.kind == 'fixed':
+            ms = self.params[0]
+        elif self.kind == 'uniform':
+            ms = rng.uniform(*self.params)
+        elif self.kind == 'normal':
+            ms = max(0.0, rng.gauss(*self.params))
+        else:
+            ms = rng.expovariate(1 / self.params[0]) if self.params[0] else 0.0
+        return ms / 1000
+
+
+class TokenBucket:
+    """Admit on average `rate` events per second, with bursts of up to `burst`."""
+
+    def __init__(self, rate: float, burst: float | None = None) -> None:
+        self.rate = rate
+        self.burst = burst if burst is not None else max(rate, 1.0)
+        self.tokens = self.burst
+        self.stamp = time.monotonic()
+
+    def admit(self) -> bool:
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.stamp) * self.rate)
+        self.stamp = now
+        if self.tokens < 1:
+            return False
+        self.tokens -= 1
+        return True
+
+
+class Responder:
+    """Answer queries from a zone and decide what happens to each answer.
+
+    respond() returns the response wire and the delay before sending it, or
+    None when the query is to go unanswered (lost or over the rate limit).
+    With reflect, every query is echoed back as an empty response without
+    being parsed, so that the server adds next to nothing to a round trip.
+    """
+
+    def __init__(self, zone: dns.zone.Zone, delay: Delay | None = None, loss: float = 0.0,
+                 truncate: float = 0.0, rate: float = 0.0, burst: float | None = None,
+                 seed: int | None = None, reflect: bool = False) -> None:
+        self.zone = zone
+        self.reflect = reflect
+        self.delay = delay
+        self.loss = loss
+        self.truncate = truncate
+        self.bucket = TokenBucket(rate, burst) if rate > 0 else None
+        self.rng = random.Random(seed)
+        self.counters = {'queries': 0, 'answered': 0, 'lost': 0, 'limited': 0, 'truncated': 0, 'malformed': 0}
+
+    def answer(self, query: dns.message.Message) -> dns.message.Message:
+        """Build the authoritative answer for a query, without any impairment."""
+        response = dns.message.make_response(query)
+        if query.edns >= 0 and any(option.otype == dns.edns.NSID for option in query.options):
+            response.use_edns(0, payload=query.payload, options=[dns.edns.NSIDOption(NSID)])
+        if query.opcode() != dns.opcode.QUERY or len(query.question) != 1:
+            response.set_rcode(dns.rcode.NOTIMP if query.opcode() != dns.opcode.QUERY else dns.rcode.FORMERR)
+            return response
+
+        question = query.question[0]
+        origin = self.zone.origin
+        assert origin is not None
+        if question.rdclass != dns.rdataclass.IN or not question.name.is_subdomain(origin):
+            response.set_rcode(dns.rcode.REFUSED)
+            return response
+
+        response.flags |= dns.flags.AA
+        name = question.name
+        for _ in range(8):  # follow in-zone CNAME chains, within reason
+            node = self.zone.get_node(name)
+            if node is None:
+                if name == question.name:
+                    response.set_rcode(dns.rcode.NXDOMAIN)
+                break
+            rdataset = node.get_rdataset(dns.rdataclass.IN, question.rdtype)
+            if rdataset is None and question.rdtype != dns.rdatatype.CNAME:
+                cname = node.get_rdataset(dns.rdataclass.IN, dns.rdatatype.CNAME)
+                if cname is not None:
+                    response.answer.append(dns.rrset.from_rdata_list(name, cname.ttl, list(cname)))
+                    name = cname[0].target.derelativize(origin)
+                    continue
+            if rdataset is not None:
+                response.answer.append(dns.rrset.from_rdata_list(name, rdataset.ttl, list(rdataset)))
+            break
+
+        if not response.answer:
+            soa = self.zone.get_rdataset(origin, dns.rdatatype.SOA)
+            if soa is not None:
+                response.authority.append(dns.rrset.from_rdata_list(origin, soa.ttl, list(soa)))
+        return response
+
+    def respond(self, wire: bytes, transport: str) -> tuple[bytes, float] | None:
+        self.counters['queries'] += 1
+        if self.reflect:
+            if len(wire) < 12 or wire[2] & 0x80:
+                self.counters['malformed'] += 1
+                return None
+            self.counters['answered'] += 1
+            return wire[:2] + bytes((wire[2] | 0x80, wire[3])) + wire[4:], 0.0
+        try:
+            query = dns.message.from_wire(wire)
+        except dns.message.ShortHeader:
+            self.counters['malformed'] += 1
+            return None
+        except dns.exception.DNSException:
+            self.counters['malformed'] += 1
+            # echo the ID back with FORMERR, as real servers do for garbage with a readable header
+            (qid, flags) = struct.unpack('!HH', wire[:4])
+            if flags & dns.flags.QR:
+                return None
+            return struct.pack('!HHHHHH', qid, dns.flags.QR | dns.rcode.FORMERR, 0, 0, 0, 0), 0.0
+
+        if query.flags & dns.flags.QR:
+            self.counters['malformed'] += 1
+            return None
+        if self.bucket is not None and not self.bucket.admit():
+            self.counters['limited'] += 1
+            return None
+        if self.loss and self.rng.random() < self.loss:
+            self.counters['lost'] += 1
+            return None
+
+        response = self.answer(query)
+        if transport == 'udp':
+            limit = max(512, query.payload) if query.edns >= 0 else 512
+            forced = self.truncate and self.rng.random() < self.truncate
+            try:
+                wire = response.to_wire(max_size=limit)
+            except dns.exception.TooBig:
+                forced = True
+            if forced:
+                self.counters['truncated'] += 1
+                response.flags |= dns.flags.TC
+                response.answer = []
+                response.authority = []
+                response.additional = []
+                wire = response.to_wire()
+        else:
+            wire = response.to_wire(max_size=65535)
+
+        self.counters['answered'] += 1
+        return wire, self.delay.sample(self.rng) if self.delay is not None else 0.0
+
+
+def make_certificate(directory: str, address: str = '127.0.0.1') -> tuple[str, str]:
+    """Write a self-signed certificate for address (and localhost) into directory.
+
+    Returns the (certfile, keyfile) paths.
+    """
+    # imported here: only needed when an encrypted listener is started without a certificate
+    from cryptography import x509
+    from cryptography.hazmat.primitives import hashes, serialization
+    from cryptography.hazmat.primitives.asymmetric import ec
+    from cryptography.x509.oid import NameOID
+
+    key = ec.generate_private_key(ec.SECP256R1())
+    name = x509.Name([x509.NameAttribute(NameOID.COMMON_NAME, address)])
+    now = datetime.datetime.now(datetime.timezone.utc)
+    alt_names: list[x509.GeneralName] = [x509.DNSName('localhost')]
+    try:
+        alt_names.append(x509.IPAddress(ipaddress.ip_address(address)))
+    except ValueError:
+        alt_names.append(x509.DNSName(address))
+    cert = (x509.CertificateBuilder().subject_name(name).issuer_name(name).public_key(key.public_key())
+            .serial_number(x509.random_serial_number())
+            .not_valid_before(now - datetime.timedelta(minutes=5))
+            .not_valid_after(now + datetime.timedelta(days=30))
+            .add_extension(x509.SubjectAlternativeName(alt_names), critical=False)
+            .sign(key, hashes.SHA256()))
+    certfile = os.path.join(directory, 'fakeserver.crt')
+    keyfile = os.path.join(directory, 'fakeserver.key')
+    with open(certfile, 'wb') as f:
+        f.write(cert.public_bytes(serialization.Encoding.PEM))
+    with open(keyfile, 'wb') as f:
+        f.write(key.private_bytes(serialization.Encoding.PEM, serialization.PrivateFormat.PKCS8,
+                                  serialization.NoEncryption()))
+    return certfile, keyfile
+
+
+class _UdpProtocol(asyncio.DatagramProtocol):
+
+    def __init__(self, server: 'FakeServer') -> None:
+        self.server = server
+        self.transport: asyncio.DatagramTransport | None = None
+
+    def connection_made(self, transport: asyncio.BaseTransport) -> None:
+        self.transport = cast(asyncio.DatagramTransport, transport)
+
+    def datagram_received(self, data: bytes, addr: tuple[str | Any, int]) -> None:
+        result = self.server.responder.respond(data, 'udp')
+        if result is None or self.transport is None:
+            return
+        wire, delay = result
+        if delay:
+            self.server.loop.call_later(delay, self.transport.sendto, wire, addr)
+        else:
+            self.transport.sendto(wire, addr)
+
+
+class FakeServer:
+    """Serve a zone on the loopback interface over any of TRANSPORTS.
+
+    ports maps each transport to start to its port; 0 picks a free one (TCP
+    then shares the UDP port when it can). The actual ports are in
+    self.ports once start() returns. Without a certfile, a self-signed
+    certificate is generated into a temporary directory for DoT, DoH and DoQ;
+    self.certfile points clients at it.
+    """
+
+    def __init__(self, address: str = '127.0.0.1', ports: dict[str, int] | None = None,
+                 zone: dns.zone.Zone | str | None = None, delay: Delay | None = None, loss: float = 0.0,
+                 truncate: float = 0.0, rate: float = 0.0, burst: float | None = None, seed: int | None = None,
+                 certfile: str | None = None, keyfile: str | None = None, reflect: bool = False) -> None:
+        if ports is None:
+            ports = {'udp': 0, 'tcp': 0}
+        for transport in ports:
+            if transport not in TRANSPORTS:
+                raise ValueError(f'unknown transport: {transport}')
+        if not 0 <= loss <= 1 or not 0 <= truncate <= 1:
+            raise ValueError('loss and truncate are probabilities between 0 and 1')
+        if zone is None or isinstance(zone, str):
+            zone = dns.zone.from_text(zone or DEFAULT_ZONE, relativize=False)
+        self.address = address
+        self.ports = dict(ports)
+        self.responder = Responder(zone, delay, loss, truncate, rate, burst, seed, reflect)
+        self.certfile = certfile
+        self.keyfile = keyfile or certfile
+        self.loop = asyncio.new_event_loop()
+        self._thread: threading.Thread | None = None
+        self._tmpdir: str | None = None
+        self._closers: list[Any] = []
+        self._writers: set[asyncio.StreamWriter] = set()
+
+    @property
+    def counters(self) -> dict[str, int]:
+        return self.responder.counters
+
+    def __enter__(self) -> 'FakeServer':
+        return self.start()
+
+    def __exit__(self, *exc_info: object) -> None:
+        self.stop()
+
+    def start(self) -> 'FakeServer':
+        if self.certfile is None and set(self.ports) & {'tls', 'https', 'quic'}:
+            self._tmpdir = tempfile.mkdtemp(prefix='dnsdiag-fakeserver-')
+            self.certfile, self.keyfile = make_certificate(self._tmpdir, self.address)
+        self._thread = threading.Thread(target=self.loop.run_forever, name='fakeserver', daemon=True)
+        self._thread.start()
+        try:
+            asyncio.run_coroutine_threadsafe(self._open(), self.loop).result()
+        except BaseException:
+            self.stop()
+            raise
+        return self
+
+    def stop(self) -> None:
+        if self._thread is not None:
+            asyncio.run_coroutine_threadsafe(self._close(), self.loop).result()
+            self.loop.call_soon_threadsafe(self.loop.stop)
+            self._thread.join()
+            self._thread = None
+        if not self.loop.is_closed():
+            self.loop.close()
+        if self._tmpdir is not None:
+            shutil.rmtree(self._tmpdir, ignore_errors=True)
+            self._tmpdir = None
+
+    def _tls_context(self, alpn: str) -> ssl.SSLContext:
+        context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+        assert self.certfile is not None
+        context.load_cert_chain(self.certfile, self.keyfile)
+        context.set_alpn_protocols([alpn])
+        return context
+
+    async def _open(self) -> None:
+        loop = asyncio.get_running_loop()
+        if 'udp' in self.ports:
+            transport, _ = await loop.create_datagram_endpoint(lambda: _UdpProtocol(self),
+                                                               local_addr=(self.address, self.ports['udp']))
+            self._closers.append(transport)
+            self.ports['udp'] = transport.get_extra_info('sockname')[1]
+        if 'tcp' in self.ports:
+            port = self.ports['tcp']
+            if port == 0 and 'udp' in self.ports:
+                try:
+                    await self._listen('tcp', self.ports['udp'], self._serve_stream)
+                except OSError:
+                    await self._listen('tcp', 0, self._serve_stream)
+            else:
+                await self._listen('tcp', port, self._serve_stream)
+        if 'tls' in self.ports:
+            await self._listen('tls', self.ports['tls'], self._serve_stream, self._tls_context('dot'))
+        if 'https' in self.ports:
+            await self._listen('https', self.ports['https'], self._serve_https, self._tls_context('h2'))
+        if 'quic' in self.ports:
+            await self._listen_quic()
+
+    async def _listen(self, transport: str, port: int, handler: Any, context: ssl.SSLContext | None = None) -> None:
+        server = await asyncio.start_server(handler, self.address, port, ssl=context)
+        self._closers.append(server)
+        self.ports[transport] = server.sockets[0].getsockname()[1]
+
+    async def _close(self) -> None:
+        for closer in self._closers:
+            closer.close()
+        for writer in list(self._writers):
+            writer.close()
+        for closer in self._closers:
+            if isinstance(closer, asyncio.Server):
+                await closer.wait_closed()
+        self._closers.clear()
+
+    async def _serve_stream(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        """DNS over TCP and TLS: length-prefixed messages, answered as they are ready (RFC 7766)."""
+        transport = 'tls' if writer.get_extra_info('sslcontext') is not None else 'tcp'
+        self._writers.add(writer)
+        try:
+            while True:
+                (length,) = struct.unpack('!H', await reader.readexactly(2))
+                wire = await reader.readexactly(length)
+                result = self.responder.respond(wire, transport)
+                if result is not None:
+                    self._later(result[1], self._write_framed, writer, result[0])
+        except (asyncio.IncompleteReadError, ConnectionError, ssl.SSLError):
+            pass
+        finally:
+            self._writers.discard(writer)
+            writer.close()
+
+    def _later(self, delay: float, callback: Any, *args: Any) -> None:
+        if delay:
+            self.loop.call_later(delay, callback, *args)
+        else:
+            callback(*args)
+
+    @staticmethod
+    def _write_framed(writer: asyncio.StreamWriter, wire: bytes) -> None:
+        if not writer.is_closing():
+            writer.write(struct.pack('!H', len(wire)) + wire)
+
+    async def _serve_https(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        """DNS over HTTPS (RFC 8484) on HTTP/2: GET with ?dns= or POST of application/dns-message."""
+        import h2.config
+        import h2.connection
+        import h2.events
+
+        conn = h2.connection.H2Connection(config=h2.config.H2Configuration(client_side=False))
+        conn.initiate_connection()
+        writer.write(conn.data_to_send())
+        requests: dict[int, tuple[dict[bytes, bytes], bytearray]] = {}
+
+        def reply(stream_id: int, status: int, body: bytes = b'') -> None:
+            if writer.is_closing():
+                return
+            headers = [(':status', str(status)), ('content-length', str(len(body)))]
+            if body:
+                headers.append(('content-type', 'application/dns-message'))
+            try:
+                conn.send_headers(stream_id, headers, end_stream=not body)
+                if body:
+                    conn.send_data(stream_id, body, end_stream=True)
+            except h2.exceptions.ProtocolError:
+                return  # stream reset by the client meanwhile
+            writer.write(conn.data_to_send())
+
+        def handle(stream_id: int) -> None:
+            headers, body = requests.pop(stream_id)
+            url = urllib.parse.urlsplit(headers.get(b':path', b'/').decode())
+            method = headers.get(b':method')
+            if url.path != '/dns-query':
+                return reply(stream_id, 404)
+            if method == b'GET':
+                param = urllib.parse.parse_qs(url.query).get('dns')
+                try:
+                    wire = base64.urlsafe_b64decode(param[0] + '=' * (-len(param[0]) % 4)) if param else b''
+                except ValueError:
+                    wire = b''
+            elif method == b'POST':
+                wire = bytes(body)
+            else:
+                return reply(stream_id, 405)
+            if len(wire) < 12:
+                return reply(stream_id, 400)
+            result = self.responder.respond(wire, 'https')
+            if result is not None:
+                self._later(result[1], reply, stream_id, 200, result[0])
+
+        self._writers.add(writer)
+        try:
+            while True:
+                data = await reader.read(65535)
+                if not data:
+                    break
+                for event in conn.receive_data(data):
+                    if isinstance(event, h2.events.RequestReceived):
+                        requests[event.stream_id] = (dict(event.headers), bytearray())
+                        if event.stream_ended:
+                            handle(event.stream_id)
+                    elif isinstance(event, h2.events.DataReceived):
+                        if event.stream_id in requests:
+                            requests[event.stream_id][1].extend(event.data)
+                        conn.acknowledge_received_data(event.flow_controlled_length, event.stream_id)
+                    elif isinstance(event, h2.events.StreamEnded) and event.stream_id in requests:
+                        handle(event.stream_id)
+                    elif isinstance(event, h2.events.ConnectionTerminated):
+                        return
+                writer.write(conn.data_to_send())
+        except (ConnectionError, ssl.SSLError, h2.exceptions.ProtocolError):
+            pass
+        finally:
+            self._writers.discard(writer)
+            writer.close()
+
+    async def _listen_quic(self) -> None:
+        """DNS over QUIC (RFC 9250): one query per bidirectional stream."""
+        from aioquic.asyncio.protocol import QuicConnectionProtocol
+        from aioquic.asyncio.server import serve
+        from aioquic.quic.configuration import QuicConfiguration
+        from aioquic.quic.events import StreamDataReceived
+
+        server = self
+
+        class DoqProtocol(QuicConnectionProtocol):
+
+            def __init__(self, *args: Any, **kwargs: Any) -> None:
+                super().__init__(*args, **kwargs)
+                self.buffers: dict[int, bytearray] = {}
+
+            def quic_event_received(self, event: Any) -> None:
+                if not isinstance(event, StreamDataReceived):
+                    return
+                buffer = self.buffers.setdefault(event.stream_id, bytearray())
+                buffer.extend(event.data)
+                if not event.end_stream:
+                    return
+                del self.buffers[event.stream_id]
+                if len(buffer) < 2 or struct.unpack('!H', buffer[:2])[0] != len(buffer) - 2:
+                    return
+                result = server.responder.respond(bytes(buffer[2:]), 'quic')
+                if result is not None:
+                    server._later(result[1], self.send, event.stream_id, result[0])
+
+            def send(self, stream_id: int, wire: bytes) -> None:
+                self._quic.send_stream_data(stream_id, struct.pack('!H', len(wire)) + wire, end_stream=True)
+                self.transmit()
+
+        configuration = QuicConfiguration(is_client=False, alpn_protocols=['doq'])
+        assert self.certfile is not None
+        configuration.load_cert_chain(self.certfile, self.keyfile)
+        quic = await serve(self.address, self.ports['quic'], configuration=configuration,
+                           create_protocol=DoqProtocol)
+        self._closers.append(quic)
+        assert quic._transport is not None
+        self.ports['quic'] = quic._transport.get_extra_info('sockname')[1]
+
+
+def usage() -> None:
+    print("""usage: python -m dnsdiag.fakeserver [-h] [--address addr] [--udp port] [--tcp port] [--tls port]
+       [--https port] [--quic port] [--zone file] [--delay spec] [--loss p] [--truncate p]
+       [--rate qps] [--burst n] [--seed n] [--cert file] [--key file] [--reflect]
+  --address    address to listen on (default: 127.0.0.1)
+  --udp, --tcp, --tls, --https, --quic
+               start a listener for that transport on the given port (0 for any free port)
+  --zone       zone file to answer from (default: a built-in example.com zone)
+  --delay      response delay in ms: MS, fixed:MS, uniform:LOW,HIGH, normal:MEAN,STDDEV or exp:MEAN
+  --loss       probability of dropping a query (0..1)
+  --truncate   probability of answering a UDP query with TC set (0..1)
+  --rate       answer at most this many queries per second on average
+  --burst      allow bursts of this many queries above --rate
+  --seed       seed the random generator for reproducible delays and loss
+  --reflect    echo every query back as an empty response instead of answering from the zone
+  --cert, --key
+               certificate and key for DoT, DoH and DoQ (default: generate a self-signed one)""")
+    sys.exit(0)
+
+
+def main() -> None:
+    try:
+        opts, args = getopt.getopt(sys.argv[1:], 'h', [
+            'help', 'address=', 'udp=', 'tcp=', 'tls=', 'https=', 'quic=', 'zone=', 'delay=', 'loss=',
+            'truncate=', 'rate=', 'burst=', 'seed=', 'cert=', 'key=', 'reflect'])
+    except getopt.GetoptError as e:
+        print(f"ERROR: {e}", file=sys.stderr)
+        sys.exit(1)
+    if args:
+        usage()
+
+    kwargs: dict[str, Any] = {}
+    ports: dict[str, int] = {}
+    try:
+        for o, a in opts:
+            if o in ('-h', '--help'):
+                usage()
+            elif o[2:] in TRANSPORTS:
+                ports[o[2:]] = int(a)
+            elif o == '--address':
+                kwargs['address'] = a
+            elif o == '--zone':
+                with open(a) as zone_file:
+                    kwargs['zone'] = dns.zone.from_file(zone_file, relativize=False)
+            elif o == '--delay':
+                kwargs['delay'] = Delay.parse(a)
+            elif o in ('--loss', '--truncate', '--rate', '--burst'):
+                kwargs[o[2:]] = float(a)
+            elif o == '--seed':
+                kwargs['seed'] = int(a)
+            elif o == '--cert':
+                kwargs['certfile'] = a
+            elif o == '--key':
+                kwargs['keyfile'] = a
+            elif o == '--reflect':
+                kwargs['reflect'] = True
+        server = FakeServer(ports=ports or None, **kwargs).start()
+    except (ValueError, OSError, dns.exception.DNSException) as e:
+        print(f"ERROR: {e}", file=sys.stderr)
+        sys.exit(1)
+
+    for transport, port in server.ports.items():
+        print(f"{transport:<6} {server.address} port {port}")
+    if server.certfile:
+        print(f"certificate: {server.certfile}")
+    sys.stdout.flush()
+
+    stopped = threading.Event()
+    signal.signal(signal.SIGTERM, lambda *_: stopped.set())
+    try:
+        stopped.wait()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.stop()
+        print(", ".join(f"{name}: {count}" for name, count in server.counters.items()))
+
+
+if __name__ == '__main__':
+    main()
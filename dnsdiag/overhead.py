@@ -0,0 +1,176 @@
+#
+# Copyright (c) 2016-2026, Babak Farrokhi
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# * Redistributions of source code must retain the above copyright notice, this
+#   list of conditions and the following disclaimer.
+#
+# * Redistributions in binary form must reproduce the above copyright notice,
+#   this list of conditions and the following disclaimer in the documentation
+#   and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+# OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+"""How much of a reported RTT is the client itself.
+
+calibrate() measures the floor: a round trip through ping() to a loopback
+server that echoes queries back, which is the time spent building, sending,
+receiving and decoding a query with no network in between. A Watchdog runs
+next to the measurements and notices when the client has become the
+bottleneck, either because the process keeps a whole core busy or because
+threads wake up late while they wait for the CPU or the GIL; response times
+measured meanwhile are inflated and should not be trusted.
+"""
+
+import collections
+import statistics
+import threading
+import time
+
+from dnsdiag.dns import (
+    PROTO_HTTPS,
+    PROTO_TCP,
+    PROTO_TLS,
+    PROTO_UDP,
+    ping,
+)
+
+WATCH_INTERVAL = 0.02  # seconds between watchdog wakeups
+# Judged on the median: even an idle virtual machine has the odd late wakeup, while a
+# thread starved of the GIL is typically late by a whole switch interval (5 ms).
+MAX_LAG = 2.0  # milliseconds of median wakeup lag
+MAX_CPU = 0.9  # share of one core used by the process
+MIN_CPU_WINDOW = 0.5  # seconds; CPU load over shorter windows is too noisy to judge
+
+
+def plain_transport(proto: int) -> int:
+    """Return the unencrypted transport calibration uses for proto.
+
+    Encrypted transports cannot be reflected without trusting a throwaway
+    certificate, so they are calibrated over the transport they run on.
+    """
+    return PROTO_TCP if proto in (PROTO_TCP, PROTO_TLS, PROTO_HTTPS) else PROTO_UDP
+
+
+def calibrate(proto: int = PROTO_UDP, count: int = 20, rdtype: str = 'A', use_edns: bool = False,
+              want_dnssec: bool = False, want_nsid: bool = False) -> float:
+    """Return the median loopback round trip through ping() in milliseconds, or 0.0 if none succeeded."""
+    # imported here: the fake server pulls in asyncio and is only needed when calibrating
+    from dnsdiag.fakeserver import FakeServer
+
+    plain = plain_transport(proto)
+    transport = 'tcp' if plain == PROTO_TCP else 'udp'
+    samples = []
+    with FakeServer(ports={transport: 0}, reflect=True) as server:
+        port = server.ports[transport]
+        for _ in range(count + 1):
+            result = ping('calibration.invalid', '127.0.0.1', port, rdtype, 1, 1, plain, None,
+                          use_edns=use_edns, want_dnssec=want_dnssec, want_nsid=want_nsid, keep_response=False)
+            if not result.r_lost_percent:
+                samples.append(result.r_avg)
+    # the first round trip pays for lazy imports and cold caches
+    return statistics.median(samples[1:]) if len(samples) > 1 else 0.0
+
+
+class WatchdogReport:
+    """Client health over a window: CPU load (share of one core) and scheduler lag in milliseconds."""
+
+    __slots__ = ('cpu_load', 'lag_p50', 'lag_p99', 'lag_max', 'samples', 'window')
+
+    def __init__(self, cpu_load: float, lag_p50: float, lag_p99: float, lag_max: float, samples: int,
+                 window: float) -> None:
+        self.cpu_load = cpu_load
+        self.lag_p50 = lag_p50
+        self.lag_p99 = lag_p99
+        self.lag_max = lag_max
+        self.samples = samples
+        self.window = window
+
+    @property
+    def reasons(self) -> list[str]:
+        reasons = []
+        if self.window >= MIN_CPU_WINDOW and self.cpu_load >= MAX_CPU:
+            reasons.append("cpu=%d%%" % (self.cpu_load * 100))
+        if self.lag_p50 > MAX_LAG:
+            reasons.append("scheduler lag median=%.1f ms, p99=%.1f ms" % (self.lag_p50, self.lag_p99))
+        return reasons
+
+    @property
+    def unreliable(self) -> bool:
+        return bool(self.reasons)
+
+    def __str__(self) -> str:
+        return ", ".join(self.reasons) or "cpu=%d%%, scheduler lag median=%.1f ms, p99=%.1f ms" % (
+            self.cpu_load * 100, self.lag_p50, self.lag_p99)
+
+
+class Watchdog:
+    """Sample process CPU time and how late a sleeping thread wakes up.
+
+    A background thread asks to be woken every WATCH_INTERVAL seconds and
+    records how late it actually runs; on a healthy client that is a fraction
+    of a millisecond. report() summarises the samples since a mark().
+    """
+
+    def __init__(self, interval: float = WATCH_INTERVAL, max_samples: int = 65536) -> None:
+        self.interval = interval
+        self._lags: collections.deque[tuple[float, float]] = collections.deque(maxlen=max_samples)
+        self._stop = threading.Event()
+        self._thread: threading.Thread | None = None
+        self._start = self.mark()
+
+    def __enter__(self) -> 'Watchdog':
+        return self.start()
+
+    def __exit__(self, *exc_info: object) -> None:
+        self.stop()
+
+    def start(self) -> 'Watchdog':
+        self._start = self.mark()
+        self._thread = threading.Thread(target=self._run, name='watchdog', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def _run(self) -> None:
+        due = time.monotonic() + self.interval
+        while not self._stop.wait(max(0.0, due - time.monotonic())):
+            now = time.monotonic()
+            self._lags.append((now, (now - due) * 1000))
+            due += self.interval
+            if due < now:
+                due = now + self.interval
+
+    @staticmethod
+    def mark() -> tuple[float, float]:
+        """Return the current (wall, CPU) time, to pass to report() later."""
+        return time.monotonic(), time.process_time()
+
+    def report(self, since: tuple[float, float] | None = None) -> WatchdogReport:
+        """Summarise client health since a mark (default: since start())."""
+        wall_start, cpu_start = since if since is not None else self._start
+        wall_now, cpu_now = self.mark()
+        window = wall_now - wall_start
+        lags = sorted(lag for stamp, lag in list(self._lags) if stamp >= wall_start)
+        cpu_load = (cpu_now - cpu_start) / window if window > 0 else 0.0
+        if not lags:
+            return WatchdogReport(cpu_load, 0.0, 0.0, 0.0, 0, window)
+        return WatchdogReport(cpu_load, lags[len(lags) // 2], lags[min(len(lags) - 1, int(len(lags) * 0.99))],
+                              lags[-1], len(lags), window)
@@ -0,0 +1,157 @@
+#
+# Copyright (c) 2016-2026, Babak Farrokhi
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# * Redistributions of source code must retain the above copyright notice, this
+#   list of conditions and the following disclaimer.
+#
+# * Redistributions in binary form must reproduce the above copyright notice,
+#   this list of conditions and the following disclaimer in the documentation
+#   and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+# OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+import concurrent.futures
+import json
+import os
+import socket
+import threading
+import time
+from collections import OrderedDict
+
+from dnsdiag.shared import cache_path
+
+PTR_CACHE_FILE = 'ptr.cache'
+
+POSITIVE_TTL = 86400  # seconds to keep a resolved name
+NEGATIVE_TTL = 3600  # seconds to remember that an address has no name
+MAX_ENTRIES = 4096
+
+
+class PtrCache:
+    """LRU cache of reverse lookups with per-entry expiry.
+
+    A failed lookup is stored as an empty name so that it is not retried
+    until its (shorter) negative TTL runs out.
+    """
+
+    def __init__(self, max_entries: int = MAX_ENTRIES) -> None:
+        self.max_entries = max_entries
+        self.dirty = False
+        self._entries: OrderedDict[str, tuple[str, float]] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, addr: str, now: float | None = None) -> str | None:
+        """Return the cached name ('' for a cached failure), or None on a miss."""
+        now = time.time() if now is None else now
+        with self._lock:
+            entry = self._entries.get(addr)
+            if entry is None:
+                return None
+            if entry[1] <= now:
+                del self._entries[addr]
+                self.dirty = True
+                return None
+            self._entries.move_to_end(addr)
+            return entry[0]
+
+    def put(self, addr: str, name: str, ttl: float, now: float | None = None) -> None:
+        now = time.time() if now is None else now
+        with self._lock:
+            self._entries[addr] = (name, now + ttl)
+            self._entries.move_to_end(addr)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+            self.dirty = True
+
+    def restore(self, filename: str | None = None) -> None:
+        filename = filename or cache_path(PTR_CACHE_FILE)
+        try:
+            with open(filename) as cache_file:
+                data = json.load(cache_file)
+        except (OSError, ValueError):
+            return
+        if not isinstance(data, dict):
+            return
+        now = time.time()
+        with self._lock:
+            for addr, entry in data.items():
+                # skip anything but [name, expiry], as written by save()
+                if not isinstance(entry, list) or len(entry) != 2:
+                    continue
+                name, expires = entry
+                if isinstance(name, str) and isinstance(expires, (int, float)) and expires > now:
+                    self._entries[addr] = (name, expires)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def save(self, filename: str | None = None) -> None:
+        if not self.dirty:
+            return
+        filename = filename or cache_path(PTR_CACHE_FILE)
+        now = time.time()
+        with self._lock:
+            data = {addr: entry for addr, entry in self._entries.items() if entry[1] > now}
+        tmp_filename = filename + '.tmp'
+        with open(tmp_filename, 'w') as cache_file:
+            json.dump(data, cache_file)
+        os.replace(tmp_filename, filename)
+        self.dirty = False
+
+
+def _gethostbyaddr(addr: str) -> str:
+    try:
+        return socket.gethostbyaddr(addr)[0]
+    except OSError:
+        return ''
+
+
+class PtrResolver:
+    """Run reverse lookups concurrently in a small thread pool, consulting the cache first."""
+
+    def __init__(self, cache: PtrCache, max_workers: int = 8) -> None:
+        self.cache = cache
+        self._pool = concurrent.futures.ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='ptr')
+        self._inflight: dict[str, concurrent.futures.Future[str]] = {}
+        self._lock = threading.Lock()
+
+    def lookup(self, addr: str) -> 'concurrent.futures.Future[str]':
+        """Start resolving addr and return a future for its name ('' if none)."""
+        cached = self.cache.get(addr)
+        if cached is not None:
+            future: concurrent.futures.Future[str] = concurrent.futures.Future()
+            future.set_result(cached)
+            return future
+
+        with self._lock:
+            if addr in self._inflight:
+                return self._inflight[addr]
+            future = self._pool.submit(self._resolve, addr)
+            self._inflight[addr] = future
+            return future
+
+    def _resolve(self, addr: str) -> str:
+        name = _gethostbyaddr(addr)
+        self.cache.put(addr, name, POSITIVE_TTL if name else NEGATIVE_TTL)
+        with self._lock:
+            self._inflight.pop(addr, None)
+        return name
+
+    def close(self) -> None:
+        # lookups still running past their deadline are abandoned, not awaited
+        self._pool.shutdown(wait=False, cancel_futures=True)
@@ -23,15 +23,21 @@
 # OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
 # OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
 
+import cProfile
 import ipaddress
+import json
+import os
 import random
 import signal
 import socket
 import string
 import sys
+import threading
+import time
 from typing import Any, NoReturn
 
 shutdown: bool = False
+shutdown_event = threading.Event()  # set along with shutdown, to wake up whoever waits for it
 
 __version__ = '2.9.4'
 
@@ -41,11 +47,13 @@ def signal_handler(sig: int, frame: Any) -> None:
     if shutdown:  # pressed twice, so exit immediately
         sys.exit(0)
     shutdown = True  # pressed once, exit gracefully
+    shutdown_event.set()
 
 
 def setup_signal_handler() -> None:
     global shutdown
     shutdown = False
+    shutdown_event.clear()
     try:
         if hasattr(signal, 'SIGTSTP'):
             signal.signal(signal.SIGTSTP, signal.SIG_IGN)  # ignore CTRL+Z
@@ -54,12 +62,118 @@ def setup_signal_handler() -> None:
         pass
 
 
+class Schedule:
+    """Absolute send times on the monotonic clock: the k-th wait() returns at start + k * interval.
+
+    Deadlines are computed from the first one rather than from the previous
+    send, so that time spent on a query does not push the next one back and
+    a long run keeps exactly the requested rate. When a query overran its
+    slot, the next one goes out straight away; more than a whole interval
+    behind, the missed slots are skipped rather than sent in a burst. jitter
+    (a fraction of the interval, 0 to 1) delays each send by a random amount
+    within its slot, which keeps the average rate. Waiting ends as soon as
+    stop is set.
+    """
+
+    def __init__(self, interval: float, jitter: float = 0.0, stop: threading.Event | None = None) -> None:
+        if interval < 0 or not 0 <= jitter <= 1:
+            raise ValueError("interval must be non-negative and jitter between 0 and 1")
+        self.interval = interval
+        self.jitter = jitter
+        self.stop = stop if stop is not None else threading.Event()
+        self.skipped = 0  # slots missed because a query took more than an interval longer than planned
+        self._start: float | None = None
+        self._slot = 0
+
+    def wait(self) -> bool:
+        """Sleep until the next send time; returns False if stop was set meanwhile."""
+        now = time.monotonic()
+        if self._start is None:
+            self._start = now
+        deadline = self._start + self._slot * self.interval
+        if self.interval and now - deadline > self.interval:
+            missed = int((now - deadline) / self.interval)
+            self.skipped += missed
+            self._slot += missed
+            deadline += missed * self.interval
+        self._slot += 1
+        if self.jitter:
+            deadline += random.uniform(0, self.jitter * self.interval)
+        if deadline > now:
+            return not self.stop.wait(deadline - now)
+        return not self.stop.is_set()
+
+
+class JsonLines:
+    """Stream records to a file ('-' for standard output), one JSON object per line.
+
+    Lines are buffered and only written out every flush_interval seconds
+    (checked as records come in; 0 writes each one at once), so that a high
+    query rate does not cost a write and a flush per record. close() writes
+    whatever is left.
+    """
+
+    def __init__(self, filename: str, flush_interval: float = 1.0) -> None:
+        self.flush_interval = flush_interval
+        self._file = sys.stdout if filename == '-' else open(filename, 'a')
+        self._lines: list[str] = []
+        self._due = time.monotonic() + flush_interval
+
+    def write(self, record: dict[str, Any]) -> None:
+        self._lines.append(json.dumps(record))
+        if time.monotonic() >= self._due:
+            self.flush()
+
+    def flush(self) -> None:
+        if self._lines:
+            self._file.write('\n'.join(self._lines) + '\n')
+            self._lines.clear()
+        self._file.flush()
+        self._due = time.monotonic() + self.flush_interval
+
+    def close(self) -> None:
+        self.flush()
+        if self._file is not sys.stdout:
+            self._file.close()
+
+
 def random_string(min_length: int = 5, max_length: int = 10) -> str:
     char_set = string.ascii_letters + string.digits
     length = random.randint(min_length, max_length)
     return ''.join(random.choices(char_set, k=length))
 
 
+def cache_path(filename: str) -> str:
+    """Return the location of a persistent cache file.
+
+    Caches live in $XDG_CACHE_HOME/dnsdiag (~/.cache/dnsdiag by default), or
+    in the current directory if that cannot be created.
+    """
+    cache_home = os.environ.get('XDG_CACHE_HOME') or os.path.join(os.path.expanduser('~'), '.cache')
+    cache_dir = os.path.join(cache_home, 'dnsdiag')
+    try:
+        os.makedirs(cache_dir, exist_ok=True)
+    except OSError:
+        return filename
+    return os.path.join(cache_dir, filename)
+
+
+def start_profiler() -> cProfile.Profile:
+    """Start profiling the current thread (for --profile)."""
+    profiler = cProfile.Profile()
+    profiler.enable()
+    return profiler
+
+
+def stop_profiler(profiler: cProfile.Profile, filename: str) -> None:
+    """Stop profiling and write the statistics in pstats format (read with python -m pstats)."""
+    profiler.disable()
+    try:
+        profiler.dump_stats(filename)
+    except OSError as e:
+        err(f"ERROR: cannot write profile to {filename}: {e.strerror}")
+
+
 def die(s: str, exit_code: int = 1) -> NoReturn:
     err(s)
     sys.exit(exit_code)
@@ -0,0 +1,524 @@
+#
+# Copyright (c) 2016-2026, Babak Farrokhi
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# * Redistributions of source code must retain the above copyright notice, this
+#   list of conditions and the following disclaimer.
+#
+# * Redistributions in binary form must reproduce the above copyright notice,
+#   this list of conditions and the following disclaimer in the documentation
+#   and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+# OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+import collections
+import ipaddress
+import json
+import os
+import selectors
+import socket
+import threading
+import time
+from collections.abc import Callable
+from typing import Any
+
+import dns.edns
+import dns.exception
+import dns.message
+import dns.rdataclass
+
+from dnsdiag import shared
+
+# ICMP "Time Exceeded" message types
+ICMP_TIME_EXCEEDED: int = 11
+ICMP6_TIME_EXCEEDED: int = 3
+
+STATS_WINDOW: int = 100  # probes per hop that rolling statistics are computed over
+
+PATH_CACHE_FILE = 'paths.json'
+MAX_PATHS = 1024  # known paths kept, one per (server, port, protocol)
+SAMPLE_HOPS = 3  # intermediate hops re-checked when confirming a known path
+LOCATE_RETRIES = 2  # extra probes of a TTL that got neither a DNS response nor ICMP
+
+
+class Hop:
+    def __init__(self, ttl: int) -> None:
+        self.ttl: int = ttl
+        self.addr: str | None = None
+        self.rtt: float | None = None  # milliseconds
+        self.reached: bool = False  # a DNS response came back for this TTL
+        self.nsid: str | None = None
+
+
+class HopStats:
+    """Rolling statistics for one TTL over its most recent probes.
+
+    Samples live in a fixed-size ring buffer (a lost probe is stored as
+    None), so memory stays constant however long a trace runs; only the
+    total probe count keeps growing.
+    """
+
+    def __init__(self, ttl: int, size: int = STATS_WINDOW) -> None:
+        self.ttl: int = ttl
+        self.addr: str | None = None  # last address that answered for this TTL
+        self.sent: int = 0
+        self.samples: collections.deque[float | None] = collections.deque(maxlen=size)
+
+    def add(self, addr: str | None, rtt: float | None) -> None:
+        self.sent += 1
+        if addr is not None:
+            self.addr = addr
+        self.samples.append(rtt if addr is not None else None)
+
+    def _received(self) -> list[float]:
+        return [rtt for rtt in self.samples if rtt is not None]
+
+    def loss(self) -> float:
+        """Share of probes in the window that went unanswered, in percent."""
+        if not self.samples:
+            return 0.0
+        return 100 * (len(self.samples) - len(self._received())) / len(self.samples)
+
+    def last(self) -> float | None:
+        return self.samples[-1] if self.samples else None
+
+    def avg(self) -> float | None:
+        received = self._received()
+        return sum(received) / len(received) if received else None
+
+    def best(self) -> float | None:
+        return min(self._received(), default=None)
+
+    def worst(self) -> float | None:
+        return max(self._received(), default=None)
+
+    def jitter(self) -> float | None:
+        """Mean absolute difference between consecutive response times."""
+        received = self._received()
+        if len(received) < 2:
+            return None
+        return sum(abs(b - a) for a, b in zip(received, received[1:])) / (len(received) - 1)
+
+
+class PathStore:
+    """Last known path to each DNS server, kept in a small JSON file.
+
+    A path is the list of hop addresses by TTL (None for a silent hop),
+    ending with the server itself. Every update re-reads the file first, so
+    traces to different servers running at the same time do not undo each
+    other's updates; the oldest paths are dropped beyond MAX_PATHS.
+    """
+
+    def __init__(self, filename: str | None = None) -> None:
+        self.filename = filename or shared.cache_path(PATH_CACHE_FILE)
+
+    def _load(self) -> dict[str, dict[str, Any]]:
+        try:
+            with open(self.filename) as cache_file:
+                data = json.load(cache_file)
+        except (OSError, ValueError):
+            return {}
+        return data if isinstance(data, dict) else {}
+
+    def get(self, key: str) -> list[str | None] | None:
+        entry = self._load().get(key)
+        if not isinstance(entry, dict) or not entry.get('hops'):
+            return None
+        return list(entry['hops'])
+
+    def put(self, key: str, path: list[str | None]) -> None:
+        data = self._load()
+        data.pop(key, None)
+        data[key] = {'hops': path, 'time': time.time()}
+        while len(data) > MAX_PATHS:
+            del data[next(iter(data))]
+        tmp_filename = self.filename + '.tmp'
+        with open(tmp_filename, 'w') as cache_file:
+            json.dump(data, cache_file)
+        os.replace(tmp_filename, self.filename)
+
+
+def check_ttls(path_len: int, samples: int = SAMPLE_HOPS) -> list[int]:
+    """TTLs that confirm a known path: the destination, the hop before it and a few evenly spaced hops."""
+    ttls = {path_len, path_len - 1}
+    inner = path_len - 2
+    for i in range(1, samples + 1):
+        ttls.add(round(i * (inner + 1) / (samples + 1)))
+    return sorted(ttl for ttl in ttls if 1 <= ttl <= path_len)
+
+
+def changed_segment(path: list[str | None], observed: dict[int, str | None]) -> tuple[int, int | None] | None:
+    """Compare fresh probe results (address by TTL) with a known path.
+
+    Returns None when they agree. Otherwise returns (lo, hi): the hops up to
+    TTL lo and from TTL hi on are confirmed, so only TTLs lo+1 .. hi-1 need
+    to be probed again. hi is None when the destination no longer answers at
+    its old distance, and the trace must carry on until it is reached. A
+    silent hop agrees with anything, except at the destination TTL.
+    """
+    dest_ttl = len(path)
+    matched = [ttl for ttl, addr in observed.items() if addr is not None and addr == path[ttl - 1]]
+    mismatched = [ttl for ttl, addr in observed.items() if addr is not None and addr != path[ttl - 1]]
+    dest_ok = observed.get(dest_ttl) == path[-1]
+    if not mismatched and dest_ok:
+        return None
+
+    first = min(mismatched, default=dest_ttl)
+    lo = max((ttl for ttl in matched if ttl < first), default=0)
+    if not dest_ok:
+        return lo, None
+    return lo, min(ttl for ttl in matched if ttl > max(mismatched))
+
+
+def open_icmp_socket(af: int) -> socket.socket:
+    """Open a socket that receives ICMP errors for the given address family.
+
+    Some platforms permit opening a DGRAM socket for ICMP without root
+    permission; RAW is tried first and requires elevated privileges.
+    Raises OSError when neither is available.
+    """
+    if af == socket.AF_INET:
+        icmp_proto = socket.getprotobyname('icmp')
+    else:  # AF_INET6
+        icmp_proto = socket.getprotobyname('ipv6-icmp')
+
+    try:
+        return socket.socket(af, socket.SOCK_RAW, icmp_proto)
+    except OSError:
+        return socket.socket(af, socket.SOCK_DGRAM, icmp_proto)
+
+
+def parse_time_exceeded(packet: bytes, af: int) -> tuple[int, int, str] | None:
+    """Return (src_port, dst_port, dst_addr) of the probe quoted in an ICMP Time Exceeded message.
+
+    IPv4 raw sockets deliver the outer IP header while IPv6 ones do not, so
+    the outer header is skipped only when present. Both TCP and UDP carry
+    the port pair in the first four bytes of the quoted transport header.
+    Returns None for any other ICMP message or a truncated packet.
+    """
+    if af == socket.AF_INET:
+        offset = 0
+        if len(packet) > 0 and packet[0] >> 4 == 4:
+            offset = (packet[0] & 0x0f) * 4
+        if len(packet) < offset + 8 + 20 or packet[offset] != ICMP_TIME_EXCEEDED:
+            return None
+        inner = offset + 8
+        l4 = inner + (packet[inner] & 0x0f) * 4
+        dst = packet[inner + 16:inner + 20]
+    else:  # AF_INET6
+        if len(packet) < 8 or packet[0] != ICMP6_TIME_EXCEEDED:
+            return None
+        l4 = 8 + 40
+        dst = packet[8 + 24:8 + 40]
+
+    if len(packet) < l4 + 4:
+        return None
+    return packet[l4] << 8 | packet[l4 + 1], packet[l4 + 2] << 8 | packet[l4 + 3], socket.inet_ntop(af, dst)
+
+
+class IcmpProbe:
+    def __init__(self, dst_port: int, src_port: int | None = None) -> None:
+        self.dst_port: int = dst_port
+        self.src_port: int | None = src_port  # None matches any source port
+        self.addr: str | None = None
+        self.recv_time: float | None = None  # time.perf_counter() at arrival
+        self.event = threading.Event()
+
+
+class IcmpListener:
+    """Receive ICMP Time Exceeded messages on one socket for the lifetime of a trace.
+
+    A background thread reads every ICMP message and hands it to the oldest
+    registered probe whose ports match the quoted transport header. Probes
+    registered without a source port are matched on destination port alone,
+    in registration order.
+    """
+
+    def __init__(self, af: int) -> None:
+        self.af = af
+        self._sock = open_icmp_socket(af)
+        self._sock.settimeout(0.1)
+        self._pending: list[IcmpProbe] = []
+        self._lock = threading.Lock()
+        self._closed = False
+        self._thread = threading.Thread(target=self._run, name='icmp-listener', daemon=True)
+
+    def __enter__(self) -> 'IcmpListener':
+        self.start()
+        return self
+
+    def __exit__(self, *exc: object) -> None:
+        self.close()
+
+    def start(self) -> None:
+        self._thread.start()
+
+    def close(self) -> None:
+        self._closed = True
+        if self._thread.is_alive():
+            self._thread.join()
+        self._sock.close()
+
+    def register(self, dst_port: int, src_port: int | None = None) -> IcmpProbe:
+        probe = IcmpProbe(dst_port, src_port)
+        with self._lock:
+            self._pending.append(probe)
+        return probe
+
+    def cancel(self, probes: list[IcmpProbe]) -> None:
+        with self._lock:
+            self._pending = [p for p in self._pending if p not in probes]
+
+    def _run(self) -> None:
+        while not self._closed:
+            try:
+                packet, addr = self._sock.recvfrom(512)
+            except OSError:  # includes socket.timeout
+                continue
+            recv_time = time.perf_counter()
+            quoted = parse_time_exceeded(packet, self.af)
+            if quoted is None:
+                continue
+            with self._lock:
+                for probe in self._pending:
+                    if probe.dst_port == quoted[1] and probe.src_port in (None, quoted[0]):
+                        self._pending.remove(probe)
+                        probe.addr = addr[0]
+                        probe.recv_time = recv_time
+                        probe.event.set()
+                        break
+
+
+def extract_nsid(response: dns.message.Message) -> str | None:
+    for option in response.options:
+        if option.otype == dns.edns.OptionType.NSID:
+            nsid_bytes = option.nsid
+            if nsid_bytes:
+                try:
+                    return str(nsid_bytes.decode("utf-8"))
+                except UnicodeDecodeError:
+                    return str(nsid_bytes.hex())
+            break
+    return None
+
+
+def _set_ttl(sock: socket.socket, af: int, ttl: int) -> None:
+    if af == socket.AF_INET:
+        sock.setsockopt(socket.SOL_IP, socket.IP_TTL, ttl)
+    else:
+        sock.setsockopt(socket.IPPROTO_IPV6, socket.IPV6_UNICAST_HOPS, ttl)
+
+
+def multi_trace(qname: str, servers: list[tuple[str, int]], port: int, rdtype: str, max_ttl: int,
+                timeout: float, src_ip: str | None = None, use_edns: bool = False, want_nsid: bool = False,
+                ttls: list[int] | None = None, rate: float = 0.0) -> dict[str, list[Hop]]:
+    """Trace the paths to several DNS servers at once with TTL-limited UDP probes.
+
+    servers holds (address, address family) pairs. Each TTL gets one UDP
+    socket per address family, shared by all servers, and one ICMP socket per
+    family receives every Time Exceeded reply. Replies are matched to a probe
+    by the quoted destination address and source port. Probes are sent in TTL
+    order, round robin across servers, at no more than rate probes per second
+    (0 means no limit). A server that has already answered at a lower TTL
+    gets no further probes. The trace ends when every path is known, or one
+    timeout after the last probe at most. For each server the hops are
+    returned up to and including the first one that answered the DNS query.
+    """
+    servers = list(dict.fromkeys(servers))
+    canonical = {str(ipaddress.ip_address(server)): server for server, _ in servers}
+    ttl_list = list(ttls or range(1, max_ttl + 1))
+    hops = {server: {ttl: Hop(ttl) for ttl in ttl_list} for server, _ in servers}
+    queries: dict[tuple[str, int], tuple[int, float]] = {}  # (server, ttl) -> (query id, send time)
+    icmp_sockets: dict[socket.socket, int] = {}  # socket -> address family
+    udp_sockets: dict[tuple[int, int], socket.socket] = {}  # (address family, ttl) -> socket
+    by_socket: dict[socket.socket, int] = {}  # udp socket -> ttl
+    by_port: dict[tuple[int, int], int] = {}  # (address family, source port) -> ttl
+
+    def finished(server: str) -> bool:
+        for ttl in ttl_list:
+            hop = hops[server][ttl]
+            if hop.reached:
+                return True
+            if hop.addr is None:
+                return False
+        return True
+
+    def reached_below(server: str, ttl: int) -> bool:
+        return any(hop.reached for hop_ttl, hop in hops[server].items() if hop_ttl < ttl)
+
+    selector = selectors.DefaultSelector()
+    try:
+        for af in sorted({af for _, af in servers}):
+            icmp_socket = open_icmp_socket(af)
+            icmp_sockets[icmp_socket] = af
+            selector.register(icmp_socket, selectors.EVENT_READ)
+            for ttl in ttl_list:
+                sock = socket.socket(af, socket.SOCK_DGRAM)
+                udp_sockets[(af, ttl)] = sock
+                by_socket[sock] = ttl
+                bind_ip = src_ip if src_ip and (':' in src_ip) == (af == socket.AF_INET6) else None
+                sock.bind((bind_ip or ('::' if af == socket.AF_INET6 else ''), 0))
+                _set_ttl(sock, af, ttl)
+                sock.setblocking(False)
+                by_port[(af, sock.getsockname()[1])] = ttl
+                selector.register(sock, selectors.EVENT_READ)
+
+        pending = collections.deque((server, af, ttl) for ttl in ttl_list for server, af in servers)
+        interval = 1.0 / rate if rate > 0 else 0.0
+        next_send = time.perf_counter()
+        deadline = next_send + timeout
+        while not shared.shutdown:
+            now = time.perf_counter()
+            while pending and now >= next_send:
+                server, af, ttl = pending.popleft()
+                if reached_below(server, ttl):
+                    continue
+                edns_options: list[dns.edns.Option] | None = None
+                if want_nsid:
+                    edns_options = [dns.edns.GenericOption(dns.edns.NSID, b'')]
+                query = dns.message.make_query(qname, rdtype, dns.rdataclass.IN, use_edns=use_edns, payload=1232,
+                                               options=edns_options)
+                queries[(server, ttl)] = (query.id, now)
+                try:
+                    udp_sockets[(af, ttl)].sendto(query.to_wire(), (server, port))
+                except OSError:
+                    pass  # e.g. no route; the hop simply stays silent
+                deadline = now + timeout
+                if interval:
+                    next_send = now + interval
+
+            if not pending and (now >= deadline or all(finished(server) for server, _ in servers)):
+                break
+
+            wait = deadline - now if not pending else next_send - now
+            for key, _ in selector.select(timeout=max(0.0, min(wait, 0.1))):
+                ready = key.fileobj
+                assert isinstance(ready, socket.socket)
+                now = time.perf_counter()
+                if ready in icmp_sockets:
+                    try:
+                        packet, addr = ready.recvfrom(512)
+                    except OSError:
+                        continue
+                    quoted = parse_time_exceeded(packet, icmp_sockets[ready])
+                    if quoted is None or quoted[1] != port or quoted[2] not in canonical:
+                        continue
+                    server = canonical[quoted[2]]
+                    ttl = by_port.get((icmp_sockets[ready], quoted[0]), 0)
+                    hop = hops[server].get(ttl)
+                    if hop is None or (server, ttl) not in queries or hop.addr is not None or hop.reached:
+                        continue
+                    hop.addr = addr[0]
+                    hop.rtt = (now - queries[(server, ttl)][1]) * 1000
+                else:
+                    ttl = by_socket[ready]
+                    try:
+                        wire, addr = ready.recvfrom(65535)
+                        response = dns.message.from_wire(wire)
+                    except (OSError, dns.exception.DNSException):
+                        continue
+                    try:
+                        server = canonical[str(ipaddress.ip_address(addr[0].split('%')[0]))]
+                    except (KeyError, ValueError):
+                        continue
+                    hop = hops[server][ttl]
+                    if (server, ttl) not in queries or response.id != queries[(server, ttl)][0] or hop.reached:
+                        continue
+                    hop.reached = True
+                    hop.addr = server
+                    hop.rtt = (now - queries[(server, ttl)][1]) * 1000
+                    if want_nsid:
+                        hop.nsid = extract_nsid(response)
+    finally:
+        selector.close()
+        for sock in [*icmp_sockets, *udp_sockets.values()]:
+            sock.close()
+
+    paths = {}
+    for server, _ in servers:
+        path = [hops[server][ttl] for ttl in ttl_list]
+        for index, hop in enumerate(path):
+            if hop.reached:
+                path = path[:index + 1]
+                break
+        paths[server] = path
+    return paths
+
+
+def shared_hops(paths: dict[str, list[Hop]]) -> list[tuple[str, int, int, int]]:
+    """Find routers that appear on the paths to more than one server.
+
+    Returns (address, number of paths, lowest TTL, highest TTL) tuples, most
+    widely shared first.
+    """
+    seen: dict[str, list[int]] = {}
+    for path in paths.values():
+        on_path: dict[str, int] = {}
+        for hop in path:
+            if hop.addr is not None and not hop.reached:
+                on_path.setdefault(hop.addr, hop.ttl)
+        for addr, ttl in on_path.items():
+            seen.setdefault(addr, []).append(ttl)
+    common = [(addr, len(ttls), min(ttls), max(ttls)) for addr, ttls in seen.items() if len(ttls) > 1]
+    common.sort(key=lambda item: (-item[1], item[2], item[0]))
+    return common
+
+
+def parallel_trace(qname: str, server: str, port: int, rdtype: str, max_ttl: int, timeout: float, af: int,
+                   src_ip: str | None = None, use_edns: bool = False, want_nsid: bool = False,
+                   ttls: list[int] | None = None) -> list[Hop]:
+    """Trace the path to one DNS server by sending all TTL-limited UDP probes at once.
+
+    The trace completes once every hop before the first answering TTL is
+    known, or after a single timeout at most. Pass ttls to probe only those
+    TTLs instead of 1 to max_ttl. See multi_trace().
+    """
+    return multi_trace(qname, [(server, af)], port, rdtype, max_ttl, timeout, src_ip=src_ip, use_edns=use_edns,
+                       want_nsid=want_nsid, ttls=ttls)[server]
+
+
+def locate_responder(probe: Callable[[int], Hop], max_ttl: int) -> tuple[int | None, list[Hop]]:
+    """Binary search for the smallest TTL at which a DNS response, rather than ICMP, comes back.
+
+    Once a probe is answered at some TTL, it is answered at every larger TTL
+    too, so the first responding hop is found in O(log max_ttl) probes.
+    probe(ttl) sends one TTL-limited query. A TTL that gets no reply at all
+    may just have lost its response, so it is probed up to LOCATE_RETRIES
+    more times before it counts as not reached; otherwise one lost answer
+    would send the search past the responder. Returns the TTL (None if even
+    max_ttl gets no response) and the probed hops in the order they were sent.
+    """
+    probed: list[Hop] = []
+
+    def probe_until_heard(ttl: int) -> Hop:
+        for _ in range(1 + LOCATE_RETRIES):
+            hop = probe(ttl)
+            probed.append(hop)
+            if hop.reached or hop.addr is not None or shared.shutdown:
+                break
+        return hop
+
+    if not probe_until_heard(max_ttl).reached:
+        return None, probed
+
+    lo, hi = 1, max_ttl
+    while lo < hi and not shared.shutdown:
+        mid = (lo + hi) // 2
+        hop = probe_until_heard(mid)
+        if hop.reached:
+            hi = mid
+        else:
+            lo = mid + 1
+    return hi, probed
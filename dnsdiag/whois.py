@@ -23,41 +23,275 @@
 # OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
 # OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
 
-import pickle
+
+import concurrent.futures
+import ipaddress
+import queue
+import socket
+import sqlite3
+import threading
 import time
 from typing import Any
 
 import cymruwhois
 
-WHOIS_CACHE_FILE = 'whois.cache'
+from dnsdiag.shared import cache_path
+
+WHOIS_CACHE_FILE = 'whois.db'
+WHOIS_HOST = 'whois.cymru.com'
+WHOIS_PORT = 43
+WHOIS_CACHE_TTL = 36000  # seconds
+WHOIS_CACHE_MAX_ENTRIES = 65536
+
+_SCHEMA = '''
+CREATE TABLE IF NOT EXISTS prefixes (
+    family INTEGER NOT NULL,
+    start BLOB NOT NULL,
+    end BLOB NOT NULL,
+    plen INTEGER NOT NULL,
+    asn TEXT,
+    prefix TEXT,
+    cc TEXT,
+    owner TEXT,
+    expires REAL NOT NULL,
+    PRIMARY KEY (family, start, plen)
+)
+'''
+
+
+class WhoisRecord:
+    """The fields of a cymruwhois record that are kept in the cache."""
+
+    def __init__(self, asn: str, prefix: str, cc: str, owner: str) -> None:
+        self.asn = asn
+        self.prefix = prefix
+        self.cc = cc
+        self.owner = owner
+
+
+def _address_key(ip: str) -> tuple[int, bytes] | None:
+    try:
+        af = socket.AF_INET6 if ':' in ip else socket.AF_INET
+        return af, socket.inet_pton(af, ip)
+    except OSError:
+        return None
+
+
+class WhoisCache:
+    """Persistent whois cache keyed by announced prefix, stored in SQLite.
+
+    An answer is stored for the whole prefix it came with, so a single lookup
+    covers every hop inside the same /24 (or larger). Addresses without an
+    answer are remembered as host routes. Prefix bounds are stored as
+    big-endian blobs so that containment is a plain range comparison.
+    Entries expire after the TTL and the oldest are evicted beyond
+    max_entries. SQLite locking makes the file safe to share between
+    concurrent traceroutes; a cache that cannot be opened or written
+    silently degrades to an in-memory one.
+    """
+
+    def __init__(self, filename: str | None = None, ttl: float = WHOIS_CACHE_TTL,
+                 max_entries: int = WHOIS_CACHE_MAX_ENTRIES) -> None:
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        try:
+            self._db = self._connect(filename or cache_path(WHOIS_CACHE_FILE))
+        except sqlite3.Error:
+            self._db = self._connect(':memory:')
+
+    @staticmethod
+    def _connect(filename: str) -> sqlite3.Connection:
+        db = sqlite3.connect(filename, timeout=5, check_same_thread=False)
+        try:
+            if filename != ':memory:':
+                db.execute('PRAGMA journal_mode=WAL')
+            db.execute(_SCHEMA)
+            db.execute('DELETE FROM prefixes WHERE expires <= ?', (time.time(),))
+            db.commit()
+        except sqlite3.Error:
+            db.close()
+            raise
+        return db
+
+    def __len__(self) -> int:
+        with self._lock:
+            return int(self._db.execute('SELECT COUNT(*) FROM prefixes').fetchone()[0])
+
+    def get(self, ip: str, now: float | None = None) -> tuple[bool, WhoisRecord | None]:
+        """Return (hit, record) for the most specific unexpired prefix covering ip.
+
+        A hit with a None record means the address is known to have no answer.
+        """
+        key = _address_key(ip)
+        if key is None:
+            return False, None
+        now = time.time() if now is None else now
+        with self._lock:
+            try:
+                row = self._db.execute(
+                    'SELECT asn, prefix, cc, owner FROM prefixes '
+                    'WHERE family = ? AND start <= ? AND end >= ? AND expires > ? '
+                    'ORDER BY plen DESC LIMIT 1', (key[0], key[1], key[1], now)).fetchone()
+            except sqlite3.Error:
+                return False, None
+        if row is None:
+            return False, None
+        if row[0] is None:
+            return True, None
+        return True, WhoisRecord(*row)
+
+    def put_many(self, records: dict[str, Any], now: float | None = None) -> None:
+        """Store lookup results (record or None) for a batch of addresses."""
+        now = time.time() if now is None else now
+        rows = []
+        for ip, record in records.items():
+            key = _address_key(ip)
+            if key is None:
+                continue
+            network = ipaddress.ip_network(ip)
+            values: tuple[str | None, ...] = (None, None, None, None)
+            if record is not None:
+                try:
+                    announced = ipaddress.ip_network(str(record.prefix), strict=False)
+                    if network.subnet_of(announced):  # type: ignore[arg-type]
+                        network = announced
+                except (ValueError, TypeError):
+                    pass
+                values = (str(record.asn), str(record.prefix), str(record.cc), str(record.owner))
+            width = 4 if key[0] == socket.AF_INET else 16
+            rows.append((key[0], int(network.network_address).to_bytes(width, 'big'),
+                         int(network.broadcast_address).to_bytes(width, 'big'), network.prefixlen,
+                         *values, now + self.ttl))
 
+        with self._lock:
+            try:
+                self._db.executemany('INSERT OR REPLACE INTO prefixes VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)', rows)
+                self._db.execute('DELETE FROM prefixes WHERE expires <= ?', (now,))
+                self._db.execute(
+                    'DELETE FROM prefixes WHERE rowid IN '
+                    '(SELECT rowid FROM prefixes ORDER BY expires DESC LIMIT -1 OFFSET ?)', (self.max_entries,))
+                self._db.commit()
+            except sqlite3.Error:
+                self._db.rollback()
 
-def asn_lookup(ip: str, whois_cache: dict[str, Any]) -> tuple[Any | None, dict[str, Any]]:
+    def close(self) -> None:
+        with self._lock:
+            self._db.close()
+
+
+def asn_lookup(ip: str, whois_cache: WhoisCache) -> tuple[Any | None, WhoisCache]:
     asn: Any | None = None
     try:
-        currenttime = time.time()
-        if ip in whois_cache:
-            asn, ts = whois_cache[ip]
-        else:
-            ts = 0
-        if (currenttime - ts) > 36000:
-            c = cymruwhois.Client()
-            asn = c.lookup(ip)
-            whois_cache[ip] = (asn, currenttime)
+        asn = bulk_lookup([ip], whois_cache).get(ip)
     except Exception:
         pass
     return asn, whois_cache
 
 
-def restore() -> dict[str, Any]:
-    try:
-        with open(WHOIS_CACHE_FILE, 'rb') as pkl_file:
-            whois: dict[str, Any] = pickle.load(pkl_file)
-            return whois
-    except (OSError, EOFError, pickle.UnpicklingError):
-        return {}
+def bulk_lookup(ips: list[str], whois_cache: WhoisCache, client: Any | None = None,
+                host: str = WHOIS_HOST, port: int = WHOIS_PORT) -> dict[str, Any]:
+    """Look up every address the cache has no answer for in one bulk whois session.
+
+    Pass a connected client to keep using its session; otherwise a new one is
+    opened and closed again. Addresses the server has no match for are cached
+    as None so they are not asked for again until they expire. Returns the
+    records (or None) for all requested addresses. Network errors propagate.
+    """
+    results: dict[str, Any] = {}
+    missing = []
+    for ip in ips:
+        hit, record = whois_cache.get(ip)
+        if hit:
+            results[ip] = record
+        else:
+            missing.append(ip)
+
+    missing = sorted(set(missing))
+    if missing:
+        own_client = client is None
+        if client is None:
+            client = cymruwhois.Client(host=host, port=port, memcache_host=None)
+        try:
+            records = client.lookupmany_dict(missing)
+        finally:
+            if own_client:
+                client.disconnect()
+        fetched = {ip: records.get(ip) for ip in missing}
+        whois_cache.put_many(fetched)
+        results.update(fetched)
+
+    return results
+
+
+class AsnResolver:
+    """Resolve ASNs in a background thread, batching queued addresses into one whois session.
+
+    Everything queued while a batch is in flight goes out together in the
+    next batch, over the same connection, so a trace (or many traces) costs
+    one bulk session instead of one round trip per hop.
+    """
+
+    def __init__(self, whois_cache: WhoisCache, host: str = WHOIS_HOST, port: int = WHOIS_PORT) -> None:
+        self.whois_cache = whois_cache
+        self.host = host
+        self.port = port
+        self._client: Any | None = None
+        self._queue: queue.Queue[tuple[str, concurrent.futures.Future[Any]] | None] = queue.Queue()
+        self._thread = threading.Thread(target=self._run, name='asn-resolver', daemon=True)
+        self._thread.start()
+
+    def lookup(self, ip: str) -> 'concurrent.futures.Future[Any]':
+        """Return a future for the whois record of ip (None if unknown or on error)."""
+        future: concurrent.futures.Future[Any] = concurrent.futures.Future()
+        hit, record = self.whois_cache.get(ip)
+        if hit:
+            future.set_result(record)
+        else:
+            self._queue.put((ip, future))
+        return future
+
+    def _run(self) -> None:
+        while True:
+            item = self._queue.get()
+            if item is None:
+                break
+            batch = [item]
+            while True:
+                try:
+                    item = self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                if item is None:
+                    self._queue.put(None)  # finish this batch, then stop
+                    break
+                batch.append(item)
+
+            records: dict[str, Any] = {}
+            for _ in range(2):  # the server may have closed an idle session; retry once on a new one
+                try:
+                    if self._client is None:
+                        self._client = cymruwhois.Client(host=self.host, port=self.port, memcache_host=None)
+                    records = bulk_lookup([ip for ip, _ in batch], self.whois_cache, client=self._client)
+                    break
+                except Exception:
+                    self._disconnect()
+            for ip, future in batch:
+                future.set_result(records.get(ip))
+
+        self._disconnect()
 
+    def _disconnect(self) -> None:
+        if self._client is not None:
+            try:
+                self._client.disconnect()
+            except Exception:
+                pass
+            self._client = None
 
-def save(whois_data: dict[str, Any]) -> None:
-    with open(WHOIS_CACHE_FILE, 'wb') as pkl_file:
-        pickle.dump(whois_data, pkl_file)
+    def close(self) -> None:
+        """Stop the background thread and close the cache."""
+        self._queue.put(None)
+        self._thread.join(timeout=1)
+        if not self._thread.is_alive():
+            self.whois_cache.close()
@@ -35,6 +35,7 @@ import socket
 import sys
 import threading
 import time
+from typing import Any
 
 import dns.flags
 import dns.rcode
@@ -52,7 +53,9 @@ from dnsdiag.dns import (
     PROTO_UDP,
     flags_to_text,
     get_default_port,
+    proto_to_text,
 )
+from dnsdiag.overhead import Watchdog, calibrate, plain_transport
 from dnsdiag.shared import (
     Colors,
     __version__,
@@ -69,6 +72,11 @@ __license__ = 'BSD'
 __progname__ = os.path.basename(sys.argv[0])
 print_lock = threading.Lock()
 
+# set up once in main(): the client overhead subtracted from response times, and the
+# watchdog telling whether the client kept up while each server was measured
+client_overhead = 0.0
+watchdog = Watchdog()
+
 
 def _resolve_server(server: str) -> str | None:
     """Resolve a server name to an IP, returning None on any failure."""
@@ -88,7 +96,8 @@ def _resolve_server(server: str) -> str | None:
 
 def usage(exit_code: int = 0) -> None:
     print("""%s version %s
-Usage: %s [-ehmvCTXHQ3SD] [-f server-list] [-j output.json] [-c count] [-t type] [-p port] [-w wait] hostname
+Usage: %s [-ehmvCTXHQ3SD] [-f server-list] [-j output.json] [-c count] [-t type] [-p port] [-w wait]
+       %s [--every seconds] [--threshold ms] [--calibrate] [--subtract-overhead] hostname
 
   -h, --help         Display this help message
   -f, --file         Specify a DNS server list file to use (default: system resolvers)
@@ -109,7 +118,12 @@ Usage: %s [-ehmvCTXHQ3SD] [-f server-list] [-j output.json] [-c count] [-t type]
   -C, --color        Enable colorful output
   -v, --verbose      Print the full DNS response details
       --skip-warmup  Disable cache warmup (default: warmup enabled)
-""" % (__progname__, __version__, __progname__))
+      --every        Re-evaluate every N seconds and only print changes (continuous mode)
+      --threshold    Minimum avg(ms) change reported in continuous mode (default: 5)
+      --calibrate    Measure the client's own overhead with a loopback round trip before the run
+      --subtract-overhead
+                     Subtract the measured client overhead from response times (implies --calibrate)
+""" % (__progname__, __version__, __progname__, ' ' * len(__progname__)))
     sys.exit(exit_code)
 
 
@@ -124,20 +138,66 @@ def evaluate_server(server: str, qname: str, rdatatype: str, waittime: int, coun
         return ""
 
     server = server.replace(' ', '')
-    resolver = _resolve_server(server)
+    retval = measure_server(server, _resolve_server(server), qname, rdatatype, waittime, count, proto, dst_port,
+                            src_ip, use_edns, force_miss, want_dnssec, keep_response=verbose)
+    if isinstance(retval, str):
+        return retval
+
+    return format_result(server, retval, qname, width, color, verbose, json_output, json_filename)
+
+
+def measure_server(server: str, resolver: str | None, qname: str, rdatatype: str, waittime: int, count: int,
+                   proto: int, dst_port: int, src_ip: str | None, use_edns: bool, force_miss: bool,
+                   want_dnssec: bool, keep_response: bool = False) -> dnsdiag.dns.PingResponse | str:
+    """Ping an already-resolved server, returning the result or an error line.
+
+    The last response message is only kept with keep_response (needed for -v),
+    so that results held for many servers stay small.
+    """
     if resolver is None:
         return 'ERROR: cannot resolve hostname: %s' % server
 
     try:
+        mark = watchdog.mark()
         retval = dnsdiag.dns.ping(qname, resolver, dst_port, rdatatype, waittime, count, proto, src_ip,
-                                  use_edns=use_edns, force_miss=force_miss, want_dnssec=want_dnssec)
-
+                                  use_edns=use_edns, force_miss=force_miss, want_dnssec=want_dnssec,
+                                  keep_response=keep_response, overhead=client_overhead)
+        health = watchdog.report(mark)
+        if health.unreliable:
+            retval.unreliable = str(health)
+        return retval
     except (KeyboardInterrupt, SystemExit):
         raise
     except Exception as e:
         return '%s: %s' % (server, e)
 
-    resolver = server.ljust(width + 1)
+
+def probe_round(server: str, prober: dnsdiag.dns.Prober, count: int,
+                keep_response: bool = False) -> dnsdiag.dns.PingResponse | str:
+    """Send one round of count queries through a prober kept across rounds, like measure_server().
+
+    Only the aggregates start afresh; the prober's socket or TLS, HTTP/2 or
+    QUIC connection stays open from the previous round.
+    """
+    mark = watchdog.mark()
+    prober.reset()
+    error = None
+    for _ in range(count):
+        if shared.shutdown:
+            break
+        error = prober.query().error
+    if not prober.received and error not in (None, 'timeout'):
+        return '%s: %s' % (server, error)
+    retval = prober.summary()
+    if not keep_response:
+        retval.response = retval.answer = None
+    health = watchdog.report(mark)
+    if health.unreliable:
+        retval.unreliable = str(health)
+    return retval
+
+
+def result_data(qname: str, resolver: str, retval: dnsdiag.dns.PingResponse) -> dict[str, Any]:
     text_flags = flags_to_text(retval.flags)
     edns_flags_text = dns.flags.edns_to_text(retval.ednsflags)
     if edns_flags_text:
@@ -145,47 +205,57 @@ def evaluate_server(server: str, qname: str, rdatatype: str, waittime: int, coun
     else:
         text_flags = " ".join([text_flags, "--"])
 
-    s_ttl = str(retval.ttl) if retval.ttl is not None else "N/A"
+    return {
+        'hostname': qname,
+        'timestamp': str(datetime.datetime.now()),
+        'resolver': resolver,
+        'r_min': retval.r_min,
+        'r_avg': retval.r_avg,
+        'r_max': retval.r_max,
+        'r_stddev': retval.r_stddev,
+        'r_lost_percent': retval.r_lost_percent,
+        's_ttl': str(retval.ttl) if retval.ttl is not None else "N/A",
+        'text_flags': text_flags,
+        'flags': retval.flags,
+        'ednsflags': retval.ednsflags,
+        'rcode': retval.rcode,
+        'rcode_text': retval.rcode_text,
+        'phases': retval.phases,
+        'bytes_sent': retval.bytes_sent,
+        'bytes_received': retval.bytes_received,
+        'overhead': client_overhead,
+        'unreliable': retval.unreliable,
+    }
+
+
+def write_json(record: dict[str, Any], json_filename: str, output_lines: list[str]) -> None:
+    if json_filename == '-':
+        output_lines.append(json.dumps(record))
+    else:
+        with print_lock, open(json_filename, 'a+') as outfile:
+            json.dump(record, outfile)
+            outfile.write('\n')
+
+
+def format_result(server: str, retval: dnsdiag.dns.PingResponse, qname: str, width: int, color: Colors,
+                  verbose: bool, json_output: bool, json_filename: str) -> str:
+    data = result_data(qname, server, retval)
 
     if retval.r_lost_percent > 0:
         l_color = color.O
     else:
         l_color = color.N
 
-    output_lines = []
+    output_lines: list[str] = []
 
     if json_output:
-        outer_data = {
-            'hostname': qname,
-            'data': {
-                'hostname': qname,
-                'timestamp': str(datetime.datetime.now()),
-                'resolver': resolver.rstrip(),
-                'r_min': retval.r_min,
-                'r_avg': retval.r_avg,
-                'r_max': retval.r_max,
-                'r_stddev': retval.r_stddev,
-                'r_lost_percent': retval.r_lost_percent,
-                's_ttl': s_ttl,
-                'text_flags': text_flags,
-                'flags': retval.flags,
-                'ednsflags': retval.ednsflags,
-                'rcode': retval.rcode,
-                'rcode_text': retval.rcode_text,
-            }
-        }
-
-        if json_filename == '-':
-            output_lines.append(json.dumps(outer_data))
-        else:
-            with print_lock, open(json_filename, 'a+') as outfile:
-                json.dump(outer_data, outfile)
-                outfile.write('\n')
-
+        write_json({'hostname': qname, 'data': data}, json_filename, output_lines)
     else:
         result = "%s  %-7.2f  %-7.2f  %-7.2f  %-10.2f  %s%%%-3d%s     %-7s  %-26s  %-12s" % (
-            resolver, retval.r_avg, retval.r_min, retval.r_max, retval.r_stddev, l_color, retval.r_lost_percent,
-            color.N, s_ttl, text_flags, retval.rcode_text)
+            server.ljust(width + 1), retval.r_avg, retval.r_min, retval.r_max, retval.r_stddev, l_color,
+            retval.r_lost_percent, color.N, data['s_ttl'], data['text_flags'], retval.rcode_text)
+        if retval.unreliable:
+            result = "%s  %s[client saturated]%s" % (result.rstrip(), color.O, color.N)
         output_lines.append(result.rstrip())
 
     if verbose and retval.answer and not json_output:
@@ -198,7 +268,210 @@ def evaluate_server(server: str, qname: str, rdatatype: str, waittime: int, coun
     return "\n".join(output_lines) if output_lines else ""
 
 
+def load_server_list(filename: str) -> list[str]:
+    with open(filename, 'rt') as flist:
+        return flist.read().splitlines()
+
+
+def clean_server_list(names: list[str]) -> list[str]:
+    return [name.strip() for name in names if name.strip() and not name.strip().startswith('#')]
+
+
+def _file_signature(filename: str) -> tuple[int, int] | None:
+    try:
+        st = os.stat(filename)
+    except OSError:
+        return None
+    return st.st_mtime_ns, st.st_size
+
+
+def rank_results(results: dict[str, dnsdiag.dns.PingResponse | str]) -> dict[str, tuple[int, float, float]]:
+    """Rank responding servers by loss, then average latency.
+
+    Returns a mapping of server to (rank, r_avg, r_lost_percent). Servers that
+    failed outright or lost every query are left out of the ranking.
+    """
+    answered = [(server, r) for server, r in results.items()
+                if not isinstance(r, str) and r.r_lost_percent < 100]
+    answered.sort(key=lambda item: (item[1].r_lost_percent, item[1].r_avg))
+    return {server: (rank, r.r_avg, r.r_lost_percent) for rank, (server, r) in enumerate(answered, start=1)}
+
+
+def rank_changes(previous: dict[str, tuple[int, float, float]], current: dict[str, tuple[int, float, float]],
+                 servers: list[str], threshold: float) -> list[str]:
+    """Return the servers whose rank, loss or average latency moved since the previous round.
+
+    Latency only counts as changed when it moved by more than threshold
+    milliseconds; any change in rank, loss or reachability is always reported.
+    """
+    changed = []
+    for server in servers:
+        before = previous.get(server)
+        after = current.get(server)
+        if before is None or after is None:
+            if before != after:
+                changed.append(server)
+            continue
+        if before[0] != after[0] or before[2] != after[2] or abs(after[1] - before[1]) > threshold:
+            changed.append(server)
+    return changed
+
+
+def format_delta(server: str, before: tuple[int, float, float] | None, after: tuple[int, float, float] | None,
+                 width: int, color: Colors, removed: bool = False) -> str:
+    stamp = datetime.datetime.now().strftime('%H:%M:%S')
+    if removed:
+        return "%s  %s  removed" % (stamp, server.ljust(width + 1))
+    if after is None:
+        return "%s  %s  %sunreachable%s" % (stamp, server.ljust(width + 1), color.R, color.N)
+    if before is None:
+        return "%s  %s  %snew%s  rank=%d  avg=%.2f ms  lost=%d%%" % (
+            stamp, server.ljust(width + 1), color.G, color.N, after[0], after[1], after[2])
+
+    if after[0] < before[0]:
+        r_color = color.G
+    elif after[0] > before[0]:
+        r_color = color.O
+    else:
+        r_color = color.N
+    return "%s  %s  rank=%s%d -> %d%s  avg=%.2f -> %.2f ms  lost=%d%% -> %d%%" % (
+        stamp, server.ljust(width + 1), r_color, before[0], after[0], color.N, before[1], after[1], before[2],
+        after[2])
+
+
+def continuous_eval(servers: list[str], reload_filename: str | None, resolved: dict[str, str | None],
+                    every: float, threshold: float, qname: str, rdatatype: str, waittime: int, count: int,
+                    proto: int, dst_port: int, src_ip: str | None, use_edns: bool, force_miss: bool,
+                    want_dnssec: bool, width: int, color: Colors, verbose: bool, json_output: bool,
+                    json_filename: str) -> None:
+    """Re-evaluate the server list every few seconds and print only what changed.
+
+    The worker pool, resolved server addresses and one Prober per server are
+    kept across rounds, so that every round reuses the previous round's
+    socket or TLS, HTTP/2 or QUIC connection. The first round is printed in
+    full; later rounds only report servers whose ranking, loss or latency
+    (beyond threshold) changed. When the list came from a file, it is re-read
+    whenever the file changes on disk, and servers dropped from it are
+    reported as removed.
+    """
+    signature = _file_signature(reload_filename) if reload_filename else None
+    previous: dict[str, tuple[int, float, float]] = {}
+    probers: dict[str, dnsdiag.dns.Prober] = {}
+    rounds = 0
+
+    try:
+        with concurrent.futures.ThreadPoolExecutor(max_workers=10) as executor:
+            while not shared.shutdown:
+                round_start = time.monotonic()
+
+                if reload_filename:
+                    new_signature = _file_signature(reload_filename)
+                    if new_signature is not None and new_signature != signature:
+                        signature = new_signature
+                        try:
+                            servers = clean_server_list(load_server_list(reload_filename))
+                        except OSError as e:
+                            err(f"WARNING: cannot reload {reload_filename}: {e}")
+                        else:
+                            width = max(width, maxlen(servers))
+                            if not json_output:
+                                print("Reloaded %d servers from %s" % (len(servers), reload_filename), flush=True)
+
+                pending: dict[str, concurrent.futures.Future[dnsdiag.dns.PingResponse | str] | str] = {}
+                for server in servers:
+                    if shared.shutdown:
+                        break
+                    server = server.replace(' ', '')
+                    if server not in resolved:
+                        resolved[server] = _resolve_server(server)
+                    resolver = resolved[server]
+                    if resolver is None:
+                        pending[server] = 'ERROR: cannot resolve hostname: %s' % server
+                        continue
+                    prober = probers.get(server)
+                    if prober is None:
+                        prober = probers[server] = dnsdiag.dns.Prober(
+                            resolver, qname, rdatatype, proto, port=dst_port, timeout=waittime, src_ip=src_ip,
+                            use_edns=use_edns, want_dnssec=want_dnssec, force_miss=force_miss,
+                            server_hostname=server if server != resolver else None, overhead=client_overhead)
+                    pending[server] = executor.submit(probe_round, server, prober, count, verbose)
+                # servers dropped from the list close their connections
+                for server in [server for server in probers if server not in pending]:
+                    probers.pop(server).close()
+
+                results: dict[str, dnsdiag.dns.PingResponse | str] = {}
+                for server, future in pending.items():
+                    if shared.shutdown:
+                        break
+                    if isinstance(future, str):
+                        results[server] = future
+                        continue
+                    try:
+                        results[server] = future.result()
+                    except (KeyboardInterrupt, SystemExit):
+                        shared.shutdown = True
+                        break
+                if shared.shutdown:
+                    # servers not probed yet are skipped, the others stop after their current query
+                    for future in pending.values():
+                        if not isinstance(future, str):
+                            future.cancel()
+                    break
+
+                current = rank_results(results)
+                if rounds == 0:
+                    changed = list(results)
+                else:
+                    # including the servers a reload removed
+                    known = list(dict.fromkeys([*results, *previous]))
+                    changed = rank_changes(previous, current, known, threshold)
+
+                output_lines: list[str] = []
+                for server in changed:
+                    retval = results.get(server)
+                    if rounds == 0:
+                        if isinstance(retval, str):
+                            output_lines.append(retval)
+                        elif retval is not None:
+                            output_lines.append(format_result(server, retval, qname, width, color, verbose,
+                                                              json_output, json_filename))
+                    elif json_output:
+                        record: dict[str, Any] = {
+                            'hostname': qname,
+                            'round': rounds,
+                            'resolver': server,
+                            'rank': current[server][0] if server in current else None,
+                            'prev_rank': previous[server][0] if server in previous else None,
+                        }
+                        if retval is None:
+                            record['removed'] = True
+                        elif not isinstance(retval, str):
+                            record['data'] = result_data(qname, server, retval)
+                        write_json(record, json_filename, output_lines)
+                    else:
+                        output_lines.append(format_delta(server, previous.get(server), current.get(server), width,
+                                                         color, removed=retval is None))
+
+                output = "\n".join(line for line in output_lines if line)
+                if output:
+                    print(output, flush=True)
+
+                previous = current
+                rounds += 1
+
+                # interruptible sleep until the next round is due
+                while not shared.shutdown:
+                    remaining = round_start + every - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    time.sleep(min(0.1, remaining))
+    finally:
+        for prober in probers.values():
+            prober.close()
+
+
 def main() -> None:
+    global client_overhead
     setup_signal_handler()
 
     if len(sys.argv) == 1:
@@ -222,13 +495,17 @@ def main() -> None:
     color_mode = False
     warmup = True
     proto_option_set: str | None = None
+    every: float | None = None
+    threshold = 5.0
+    calibrate_overhead = False
+    subtract_overhead = False
     qname = 'wikipedia.org'
 
     try:
         opts, args = getopt.getopt(sys.argv[1:], "hf:c:t:w:S:TevCmXHQ3Dj:p:",
                                    ["help", "file=", "count=", "type=", "wait=", "json=", "tcp", "edns", "verbose",
                                     "color", "cache-miss", "srcip=", "tls", "doh", "quic", "http3", "dnssec", "port=",
-                                    "skip-warmup"])
+                                    "skip-warmup", "every=", "threshold=", "calibrate", "subtract-overhead"])
     except getopt.GetoptError as getopt_err:
         err(str(getopt_err))
         usage(1)
@@ -310,6 +587,25 @@ def main() -> None:
                 die(f"ERROR: invalid port value: {a}")
         elif o in ("--skip-warmup",):
             warmup = False
+        elif o == "--every":
+            try:
+                every = float(a)
+                if every <= 0:
+                    die(f"ERROR: interval must be positive: {a}")
+            except ValueError:
+                die(f"ERROR: invalid interval value: {a}")
+        elif o == "--threshold":
+            try:
+                threshold = float(a)
+                if threshold < 0:
+                    die(f"ERROR: threshold must be non-negative: {a}")
+            except ValueError:
+                die(f"ERROR: invalid threshold value: {a}")
+        elif o == "--calibrate":
+            calibrate_overhead = True
+        elif o == "--subtract-overhead":
+            calibrate_overhead = True
+            subtract_overhead = True
 
     # validate RR type
     if not dnsdiag.dns.valid_rdatatype(rdatatype):
@@ -326,8 +622,7 @@ def main() -> None:
                     f = flist.read().splitlines()
             else:
                 try:
-                    with open(inputfilename, 'rt') as flist:
-                        f = flist.read().splitlines()
+                    f = load_server_list(inputfilename)
                 except Exception as e:
                     die(str(e))
         else:
@@ -337,11 +632,15 @@ def main() -> None:
             print("ERROR: No nameserver specified")
 
         # remove blanks, comments, and empty entries
-        f = [name.strip() for name in f if name.strip() and not name.strip().startswith('#')]
+        f = clean_server_list(f)
 
         width = maxlen(f)
         blanks = (width - 5) * ' '
 
+        # resolved addresses are kept for the lifetime of the process so that
+        # continuous mode does not repeat name resolution on every round
+        resolved: dict[str, str | None] = {}
+
         if warmup and not json_output:
             print("Warming up DNS caches...")
             for server in f:
@@ -350,11 +649,12 @@ def main() -> None:
                 if not server.strip():
                     continue
                 server = server.replace(' ', '')
-                resolver = _resolve_server(server)
+                resolver = resolved.setdefault(server, _resolve_server(server))
                 if resolver is not None:
                     try:
                         dnsdiag.dns.ping(qname, resolver, dst_port, rdatatype, waittime, 1, proto, src_ip,
-                                         use_edns=use_edns, force_miss=force_miss, want_dnssec=want_dnssec)
+                                         use_edns=use_edns, force_miss=force_miss, want_dnssec=want_dnssec,
+                                         keep_response=False)
                     except (KeyboardInterrupt, SystemExit):
                         shared.shutdown = True
                         break
@@ -363,11 +663,28 @@ def main() -> None:
             if not shared.shutdown:
                 time.sleep(1)
 
+        if calibrate_overhead:
+            overhead = calibrate(proto, use_edns=use_edns, want_dnssec=want_dnssec)
+            if subtract_overhead:
+                client_overhead = overhead
+            if not json_output:
+                print("Client overhead: %.3f ms (loopback %s round trip%s)" % (
+                    overhead, proto_to_text(plain_transport(proto)), ", subtracted" if subtract_overhead else ""))
+
+        watchdog.start()
+
         if not json_output:
             print('server' + blanks +
                   '  avg(ms)  min(ms)  max(ms)  stddev(ms)  lost(%)  ttl      flags                      response')
             print((95 + width) * '-')
 
+        if every is not None:
+            continuous_eval(f, inputfilename if fromfile and inputfilename != '-' else None, resolved, every,
+                            threshold, qname, rdatatype, waittime, count, proto, dst_port, src_ip, use_edns,
+                            force_miss, want_dnssec, width, color, verbose, json_output,
+                            json_filename if json_output else '')
+            return
+
         max_workers = min(len(f), 10)
         with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
             future_to_server = {}
@@ -392,8 +709,14 @@ def main() -> None:
                 except Exception:
                     pass
 
+        health = watchdog.report()
+        if health.unreliable:
+            err(f"WARNING: client saturated ({health}), response times may be inflated")
+
     except Exception as e:
         die(f'{server}: {e}')
+    finally:
+        watchdog.stop()
 
 
 if __name__ == '__main__':
@@ -25,15 +25,18 @@
 # OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
 
 
+import array
 import errno
+import functools
 import getopt
+import json
 import os
 import socket
 import ssl
 import struct
 import sys
 import time
-from statistics import stdev
+from collections.abc import Callable
 from typing import Any
 
 import dns.edns
@@ -49,19 +52,46 @@ import dns.resolver
 import httpx
 
 from dnsdiag import shared
+from dnsdiag.capacity import (
+    DEFAULT_SLO,
+    DEFAULT_WINDOW,
+    SEARCHES,
+    CapacityStep,
+    Slo,
+    search_capacity,
+)
+from dnsdiag.compare import CONFIDENCE, PairedDifference
 from dnsdiag.dns import (
+    MAX_WINDOW,
     PROTO_HTTP3,
     PROTO_HTTPS,
     PROTO_QUIC,
     PROTO_TCP,
     PROTO_TLS,
     PROTO_UDP,
+    TLS_REUSED,
     CustomSocket,
+    DohSession,
+    Flood,
+    FloodResult,
+    Phases,
+    PhaseStats,
+    PingResponse,
+    Prober,
+    RunningStats,
+    TlsSession,
+    WireResponse,
+    format_phases,
     get_default_port,
     proto_to_text,
+    tcp_exchange,
+    udp_exchange,
     valid_rdatatype,
 )
+from dnsdiag.overhead import Watchdog, WatchdogReport, calibrate, plain_transport
 from dnsdiag.shared import (
+    JsonLines,
+    Schedule,
     __version__,
     die,
     err,
@@ -70,6 +100,8 @@ from dnsdiag.shared import (
     resolve_server_address,
     set_protocol_exclusive,
     setup_signal_handler,
+    start_profiler,
+    stop_profiler,
     unsupported_feature,
     valid_hostname,
 )
@@ -82,12 +114,16 @@ __progname__ = os.path.basename(sys.argv[0])
 def usage(exit_code: int = 0) -> None:
     print("""%s version %s
 Usage: %s [-346aDeEFhLmqnrvTQxXH] [-i interval] [-w wait] [-p dst_port] [-P src_port] [-S src_ip]
-       %s [-c count] [-t qtype] [-C class] [-s server] [--ecs client_subnet] hostname
+       %s [-c count] [-t qtype] [-C class] [-s server] [--ecs client_subnet] [--profile file]
+       %s [--calibrate] [--subtract-overhead] [--jitter fraction] [--window N] [--capacity step|aimd]
+       %s [--qps start,step,max] [--step-time seconds] [--slo limits] [--curve file] [-j output.json]
+       %s [--flush-interval seconds] hostname
 
   -h, --help        Show this help message
   -q, --quiet       Suppress output
   -v, --verbose     Print the full DNS response
-  -s, --server      Specify the DNS server to use (default: first entry from /etc/resolv.conf)
+  -s, --server      Specify the DNS server to use (default: first entry from /etc/resolv.conf);
+                    repeat to compare servers queried in turns
   -p, --port        Specify the DNS server port number (default: 53 for TCP/UDP, 853 for TLS)
   -T, --tcp         Use TCP as the transport protocol
   -X, --tls         Use TLS as the transport protocol
@@ -103,6 +139,7 @@ Usage: %s [-346aDeEFhLmqnrvTQxXH] [-i interval] [-w wait] [-p dst_port] [-P src_
   -m, --cache-miss  Force cache miss measurement by prepending a random hostname
   -w, --wait        Maximum wait time for a reply (default: 2 seconds)
   -i, --interval    Time interval between requests (default: 1 second)
+      --jitter      Delay each request by a random share of the interval, up to this fraction (0-1, default: 0)
   -t, --type        DNS request record type (default: A)
   -L, --ttl         Display the response TTL (if present)
   -C, --class       DNS request record class (default: IN)
@@ -114,11 +151,365 @@ Usage: %s [-346aDeEFhLmqnrvTQxXH] [-i interval] [-w wait] [-p dst_port] [-P src_
   -D, --dnssec      Enable the DNSSEC desired flag (implies EDNS)
       --ecs         Set EDNS Client Subnet option (format: IP/prefix, e.g., 192.168.1.0/24) (implies EDNS)
   -F, --flags       Display response flags
-  -x, --expert      Display additional information (implies --ttl, --flags)
-""" % (__progname__, __version__, __progname__, ' ' * len(__progname__)))
+  -x, --expert      Display additional information (implies --ttl, --flags; adds per-phase timings)
+      --profile     Write a cProfile dump to the given file and report per-phase timings and bytes sent/received
+      --calibrate   Measure the client's own overhead with a loopback round trip before the run
+      --subtract-overhead
+                    Subtract the measured client overhead from response times (implies --calibrate)
+      --window      Keep N queries in flight and report throughput and latency percentiles (UDP, TCP, TLS)
+      --capacity    Search for the highest query rate that meets --slo, raising it by steps or AIMD (UDP, TCP, TLS)
+      --qps         Rates for --capacity in queries/second: start[,step[,max]] (default: 100,100,100000)
+      --step-time   Seconds spent at each rate (default: 5)
+      --slo         Latency (ms) and loss (%%) limits, e.g. p50=20,p99=100,loss=1 (default: %s)
+      --curve       Save the load curve of --capacity as JSON to a file ('-' for standard output)
+  -j, --json        Stream one JSON record per query and a summary to a file in JSONL format ('-' for standard output)
+      --flush-interval
+                    Seconds between writes of buffered JSON records (default: 1, 0 to write each at once)
+""" % (__progname__, __version__, __progname__, ' ' * len(__progname__), ' ' * len(__progname__),
+       ' ' * len(__progname__), ' ' * len(__progname__), DEFAULT_SLO))
     sys.exit(exit_code)
 
 
+def format_reply(answers: WireResponse | dns.message.Message, size: int, server_display: str, seq: int,
+                 elapsed: float, show_ttl: bool = False, show_flags: bool = False, want_dnssec: bool = False,
+                 want_nsid: bool = False, show_cookie: bool = False, show_answer: bool = False,
+                 tls_state: str | None = None, handshake: float = 0.0) -> str:
+    """Build the output line printed for each reply."""
+    extras = " %s" % dns.rcode.to_text(answers.rcode())  # add response code
+
+    if show_ttl:
+        if answers.answer:
+            ans_ttl = str(answers.answer[0].ttl)
+            extras += " [TTL=%-4s]" % ans_ttl
+
+    if show_flags:
+        ans_flags = dns.flags.to_text(answers.flags)
+        edns_flags = dns.flags.edns_to_text(answers.ednsflags)
+        if want_dnssec and not (answers.flags & dns.flags.AD):
+            ans_flags += " --"  # add padding to printer output when dnssec is requested, but AD flag is not set
+        extras += " [%s]" % " ".join([ans_flags, edns_flags]).rstrip(' ')  # show both regular + edns flags
+
+    # Display EDNS options compactly (only for explicitly enabled options)
+    edns_parts = []
+
+    if want_nsid and answers.options:
+        for ans_opt in answers.options:
+            if ans_opt.otype == dns.edns.OptionType.NSID:
+                nsid_val = ans_opt.nsid
+                if nsid_val:
+                    edns_parts.append("NSID:%s" % nsid_val.decode("utf-8"))
+
+    # Always show EDE when present (server-initiated error responses)
+    if answers.options:
+        for ans_opt in answers.options:
+            if ans_opt.otype == dns.edns.EDE:
+                if ans_opt.text:
+                    # Truncate EDE text for ping output to prevent display issues
+                    truncated_text = ans_opt.text[:50] + "..." if len(ans_opt.text) > 50 else ans_opt.text
+                    edns_parts.append("EDE:%d(\"%s\")" % (ans_opt.code, truncated_text))
+                else:
+                    edns_parts.append("EDE:%d" % ans_opt.code)
+
+    # Always show ECS if present (since it's typically echoed back when requested)
+    if answers.options:
+        for ans_opt in answers.options:
+            if ans_opt.otype == dns.edns.OptionType.ECS:
+                if ans_opt.address:
+                    edns_parts.append("ECS:%s/%d/%d" % (ans_opt.address, ans_opt.srclen, ans_opt.scopelen))
+                else:
+                    edns_parts.append("ECS:auto")
+
+    # Always show cookies when present (echoed back from server)
+    if show_cookie and answers.options:
+        for ans_opt in answers.options:
+            if ans_opt.otype == 10:  # COOKIE
+                cookie_hex = ans_opt.client.hex() + ans_opt.server.hex()
+                # Truncate cookie display in normal mode (max 8 chars)
+                if len(cookie_hex) > 8:
+                    cookie_display = cookie_hex[:8] + "..."
+                else:
+                    cookie_display = cookie_hex
+                edns_parts.append("COOKIE:%s" % cookie_display)
+
+    if edns_parts:
+        extras += " [%s]" % ", ".join(edns_parts)
+
+    if show_answer and answers.answer:
+        ans = answers.answer[0]
+        rtype = dns.rdatatype.to_text(ans.rdtype)
+        extras += " [RDATA: %s %s]" % (rtype, ans[0])
+
+    if tls_state == TLS_REUSED:
+        extras += " [TLS: %s]" % tls_state
+    elif tls_state is not None:
+        extras += " [TLS: %s, handshake=%.3f ms]" % (tls_state, handshake)
+
+    return "%-3d bytes from %s: seq=%-3d time=%-7.3f ms %s" % (size, server_display, seq, elapsed, extras)
+
+
+def reply_record(answers: WireResponse | dns.message.Message, size: int, server: str, seq: int, rtt: float,
+                 timestamp: float, tls_state: str | None = None) -> dict[str, Any]:
+    """The --json record of a reply; timestamp is when the query was sent, in seconds since the epoch."""
+    record: dict[str, Any] = {
+        'type': 'reply',
+        'timestamp': round(timestamp, 6),
+        'server': server,
+        'seq': seq,
+        'rtt': round(rtt, 3),
+        'rcode': dns.rcode.to_text(answers.rcode()),
+        'size': size,
+        'flags': dns.flags.to_text(answers.flags),
+        'ednsflags': dns.flags.edns_to_text(answers.ednsflags),
+        'ttl': answers.answer[0].ttl if answers.answer else None,
+        'options': [{'code': int(option.otype), 'name': dns.edns.OptionType.to_text(option.otype),
+                     'data': option.to_wire().hex(), 'text': option.to_text()} for option in answers.options],
+    }
+    if tls_state is not None:
+        record['tls'] = tls_state
+    return record
+
+
+def lost_record(server: str, seq: int, timestamp: float, error: str = '') -> dict[str, Any]:
+    """The --json record of a query that got no usable reply."""
+    return {'type': 'lost', 'timestamp': round(timestamp, 6), 'server': server, 'seq': seq,
+            'error': error or 'no response'}
+
+
+def summary_record(server: str, sent: int, received: int, lost_percent: float, r_min: float, r_avg: float,
+                   r_max: float, r_stddev: float, phases: dict[str, float] | None = None,
+                   unreliable: str = '') -> dict[str, Any]:
+    """The --json record written after the last query to a server."""
+    record: dict[str, Any] = {
+        'type': 'summary',
+        'server': server,
+        'sent': sent,
+        'received': received,
+        'lost_percent': round(lost_percent, 3),
+        'min': round(r_min, 3),
+        'avg': round(r_avg, 3),
+        'max': round(r_max, 3),
+        'stddev': round(r_stddev, 3),
+        'unreliable': unreliable,
+    }
+    if phases is not None:
+        record['phases'] = {name: round(value, 3) for name, value in phases.items()}
+    return record
+
+
+def comparison_record(baseline: str, server: str, difference: PairedDifference) -> dict[str, Any]:
+    """The --json record of a server compared with the first one."""
+    interval = difference.interval
+    return {
+        'type': 'comparison',
+        'baseline': baseline,
+        'server': server,
+        'pairs': difference.pairs,
+        'median': round(difference.median, 3) if difference.pairs else None,
+        'ci_low': round(interval[0], 3) if interval else None,
+        'ci_high': round(interval[1], 3) if interval else None,
+        'confidence': CONFIDENCE,
+        'faster': difference.faster,
+    }
+
+
+def format_flood(result: FloodResult) -> str:
+    """Summarise a --window run: loss, response times, percentiles and throughput."""
+    stats = result.stats()
+    lines = [
+        '%d requests transmitted, %d responses received, %.0f%% lost' % (result.sent, result.received,
+                                                                         result.lost_percent),
+        'min=%.3f ms, avg=%.3f ms, max=%.3f ms, stddev=%.3f ms' % (stats.r_min, stats.r_avg, stats.r_max,
+                                                                   stats.r_stddev),
+        'percentiles: %s' % ', '.join('p%s=%.3f ms' % (p, result.percentile(p)) for p in (50, 90, 99, 99.9)),
+        'throughput: %.1f queries/s with %d in flight over %.3f s' % (result.qps, result.window, result.duration),
+    ]
+    if result.rcodes:
+        lines.append('rcodes: %s' % ', '.join('%s=%d' % item for item in sorted(result.rcodes.items())))
+    if result.reconnects:
+        lines.append('%d reconnects after the server closed the connection' % result.reconnects)
+    if result.error:
+        lines.append('run ended early: %s' % result.error)
+    return '\n'.join(lines)
+
+
+def display_name(hostname: str, ip: str) -> str:
+    """Show the hostname if it differs from the resolved IP, otherwise just the IP."""
+    display = hostname if hostname != ip else ip
+    # Wrap IPv6 addresses in brackets for better readability
+    if ':' in display and not display.startswith('['):
+        display = f"[{display}]"
+    return display
+
+
+def format_comparison(display: str, difference: PairedDifference) -> str:
+    """One line per server compared with the first one: the median of the per-round differences."""
+    if not difference.pairs:
+        return '%s: no round in which both servers answered' % display
+    interval = difference.interval
+    confidence = ' (%d%% CI %+.3f to %+.3f ms)' % ((CONFIDENCE * 100,) + interval) if interval else ''
+    return '%s: median difference %+.3f ms%s over %d rounds, faster in %d' % (
+        display, difference.median, confidence, difference.pairs, difference.faster)
+
+
+def format_step(step: CapacityStep) -> str:
+    """One line per rate offered by --capacity."""
+    result = step.result
+    line = 'offered %g qps: sent %.1f qps, answered %.1f qps, p50=%.3f ms, p99=%.3f ms, loss=%.1f%%' % (
+        step.rate, result.sent_qps, result.qps, result.percentile(50), result.percentile(99),
+        result.lost_percent)
+    line += '  SLO met' if step.met else '  SLO broken (%s)' % ', '.join(step.breaches)
+    if step.unreliable:
+        line += '  [client saturated]'
+    return line
+
+
+def print_statistics(display: str, sent: int, stats: RunningStats, json_out: JsonLines | None, show_text: bool,
+                     phases: dict[str, float] | None = None, unreliable: str = '') -> None:
+    """Write the summary record and print the statistics of a server after its last query."""
+    retval = PingResponse()
+    stats.fill(retval, sent)
+    if json_out is not None:
+        json_out.write(summary_record(display, sent, stats.count, retval.r_lost_percent, retval.r_min,
+                                      retval.r_avg, retval.r_max, retval.r_stddev, phases, unreliable))
+    if show_text:
+        print('\n--- %s dnsping statistics ---' % display, flush=True)
+        print('%d requests transmitted, %d responses received, %.0f%% lost' % (
+            sent, stats.count, retval.r_lost_percent), flush=True)
+        print('min=%.3f ms, avg=%.3f ms, max=%.3f ms, stddev=%.3f ms' % (
+            retval.r_min, retval.r_avg, retval.r_max, retval.r_stddev), flush=True)
+
+
+def ping_servers(probers: list[Prober], displays: list[str], count: int, interval: float, jitter: float,
+                 reply_line: Callable[..., str], json_out: JsonLines | None, quiet: bool, verbose: bool,
+                 show_text: bool, finish: Callable[[], WatchdogReport]) -> None:
+    """Query several servers in turns, then compare each one with the first (-s given more than once).
+
+    The order rotates every round, so that no server always goes first. The
+    probers are closed and the JSON output is finished before returning.
+    """
+    samples: list[list[float | None]] = [[] for _ in probers]
+    schedule = Schedule(interval, jitter, shared.shutdown_event)
+    i = 0
+    try:
+        while not shared.shutdown and not 0 < count <= i and schedule.wait():
+            i += 1
+            for turn in range(len(probers)):
+                index = (i - 1 + turn) % len(probers)
+                timestamp = time.time()
+                probe = probers[index].query()
+                samples[index].append(probe.rtt)
+                failure = "Request timeout" if probe.error == "timeout" else probe.error or ''
+                if json_out is not None:
+                    if probe.rtt is None or probe.response is None:
+                        json_out.write(lost_record(displays[index], i, timestamp, failure))
+                    else:
+                        json_out.write(reply_record(probe.response, probe.size, displays[index], i, probe.rtt,
+                                                    timestamp))
+                if quiet:
+                    pass
+                elif probe.rtt is None or probe.response is None:
+                    print("%s: %s" % (displays[index], failure), flush=True)
+                else:
+                    print(reply_line(probe.response, probe.size, displays[index], i, probe.rtt), flush=True)
+                    if verbose:
+                        print(probe.response.to_text(), flush=True)
+                if shared.shutdown:
+                    break
+    finally:
+        for prober in probers:
+            prober.close()
+    client_health = finish()
+    unreliable = str(client_health) if client_health.unreliable else ''
+    for display, server_samples in zip(displays, samples):
+        stats = RunningStats()
+        for sample in server_samples:
+            if sample is not None:
+                stats.add(sample)
+        print_statistics(display, len(server_samples), stats, json_out, show_text, unreliable=unreliable)
+    if show_text:
+        print('\n--- paired comparison against %s ---' % displays[0], flush=True)
+    for display, server_samples in zip(displays[1:], samples[1:]):
+        difference = PairedDifference(samples[0], server_samples)
+        if json_out is not None:
+            json_out.write(comparison_record(displays[0], display, difference))
+        if show_text:
+            print(format_comparison(display, difference), flush=True)
+    if json_out is not None:
+        json_out.close()
+    if show_text and client_health.unreliable:
+        print('WARNING: client saturated (%s), response times may be inflated' % client_health, flush=True)
+
+
+def ping_window(flood: Flood, count: int, display: str, overhead: float,
+                finish: Callable[[], WatchdogReport]) -> None:
+    """Keep the window of queries in flight until count are answered or lost, then report (--window).
+
+    overhead is subtracted from every response time, 0 to keep them as measured.
+    """
+    try:
+        result = flood.run(count, stop=lambda: shared.shutdown)
+    except ssl.SSLCertVerificationError as e:
+        die(f"Certificate verification failed: {e}")
+    except dns.exception.Timeout:
+        die("ERROR: connection timed out")
+    except OSError as e:
+        die(f"ERROR: {e}")
+    if result.error and not result.sent:
+        die(f"ERROR: {result.error}")
+    client_health = finish()
+    if overhead:
+        result.rtts = array.array('d', (max(0.0, rtt - overhead) for rtt in result.rtts))
+    print('\n--- %s dnsping statistics ---' % display, flush=True)
+    print(format_flood(result), flush=True)
+    if client_health.unreliable:
+        print('WARNING: client saturated (%s), throughput and response times are limited by the client' %
+              client_health, flush=True)
+
+
+def ping_capacity(flood: Flood, search: str, slo: Slo, rates: tuple[float, float, float], step_time: float,
+                  watchdog: Watchdog, finish: Callable[[], WatchdogReport], display: str, show_steps: bool,
+                  curve: dict[str, Any], curve_filename: str | None) -> None:
+    """Search for the highest rate that meets slo and report it (--capacity).
+
+    rates are the start, step and highest rate in queries/second. The load
+    curve is added to curve, which holds the run parameters, and saved to
+    curve_filename ('-' for standard output) when one is given.
+    """
+    def print_step(step: CapacityStep) -> None:
+        if show_steps:
+            print(format_step(step), flush=True)
+
+    start, step, max_rate = rates
+    try:
+        report = search_capacity(flood, slo, search, start=start, step=step, max_rate=max_rate,
+                                 step_time=step_time, watchdog=watchdog, on_step=print_step,
+                                 stop=lambda: shared.shutdown)
+    except ssl.SSLCertVerificationError as e:
+        die(f"Certificate verification failed: {e}")
+    except dns.exception.Timeout:
+        die("ERROR: connection timed out")
+    except OSError as e:
+        die(f"ERROR: {e}")
+    finish()
+    if show_steps:
+        print('\n--- %s dnsping capacity ---' % display, flush=True)
+        if report.sustainable:
+            print('sustainable: %g queries/s (%s)' % (report.sustainable, slo), flush=True)
+        else:
+            print('sustainable: none, no rate met the objective (%s)' % slo, flush=True)
+    if curve_filename:
+        curve.update(report.to_dict())
+        if curve_filename == '-':
+            print(json.dumps(curve, indent=2), flush=True)
+        else:
+            try:
+                with open(curve_filename, 'w') as outfile:
+                    json.dump(curve, outfile, indent=2)
+                    outfile.write('\n')
+            except OSError as e:
+                die(f"ERROR: cannot write {curve_filename}: {e}")
+
+
 def main() -> None:
     setup_signal_handler()
 
@@ -136,7 +527,7 @@ def main() -> None:
     verbose = False
     show_flags = False
     show_cookie = False
-    dnsserver = None  # do not try to use system resolver by default
+    dnsservers: list[str] = []  # do not try to use system resolver by default
     proto = PROTO_UDP
     dst_port = get_default_port(proto)
     use_default_dst_port = True
@@ -149,6 +540,20 @@ def main() -> None:
     show_ttl = False
     force_miss = False
     show_answer = False
+    show_phases = False
+    profile_filename = ''
+    calibrate_overhead = False
+    subtract_overhead = False
+    overhead = 0.0
+    jitter = 0.0
+    window = 0
+    capacity_search = ''
+    qps_start, qps_step, qps_max = 100.0, 100.0, 100000.0
+    step_time = 5.0
+    slo = Slo.parse(DEFAULT_SLO)
+    curve_filename = ''
+    json_filename = ''
+    flush_interval = 1.0
     request_flags = dns.flags.from_text('RD')
     af = None
     af_ipv4_set = False
@@ -157,11 +562,14 @@ def main() -> None:
     qname = 'wikipedia.org'
 
     try:
-        opts, args = getopt.getopt(sys.argv[1:], "qhc:s:t:w:i:vp:P:S:TQ346meDFXHrnEC:Lxa",
+        opts, args = getopt.getopt(sys.argv[1:], "qhc:s:t:w:i:vp:P:S:TQ346meDFXHrnEC:Lxaj:",
                                    ["help", "count=", "server=", "quiet", "type=", "wait=", "interval=", "verbose",
                                     "port=", "srcip=", "tcp", "ipv4", "ipv6", "cache-miss", "srcport=", "edns",
                                     "dnssec", "flags", "norecurse", "tls", "doh", "nsid", "ede", "class=", "ttl",
-                                    "expert", "answer", "quic", "http3", "ecs=", "cookie"])
+                                    "expert", "answer", "quic", "http3", "ecs=", "cookie", "profile=",
+                                    "calibrate", "subtract-overhead", "jitter=", "window=",
+                                    "capacity=", "qps=", "step-time=", "slo=", "curve=", "json=",
+                                    "flush-interval="])
     except getopt.GetoptError as getopt_err:
         err(str(getopt_err))
         usage(1)
@@ -188,7 +596,7 @@ def main() -> None:
             verbose = True
 
         elif o in ("-s", "--server"):
-            dnsserver = a
+            dnsservers.append(a)
 
         elif o in ("-q", "--quiet"):
             quiet = True
@@ -208,6 +616,7 @@ def main() -> None:
         elif o in ("-x", "--expert"):
             show_flags = True
             show_ttl = True
+            show_phases = True
 
         elif o in ("-m", "--cache-miss"):
             force_miss = True
@@ -316,6 +725,73 @@ def main() -> None:
         elif o in ("-S", "--srcip"):
             src_ip = parse_ip_address(a)
 
+        elif o == "--profile":
+            profile_filename = a
+            show_phases = True
+
+        elif o == "--calibrate":
+            calibrate_overhead = True
+
+        elif o == "--subtract-overhead":
+            calibrate_overhead = True
+            subtract_overhead = True
+
+        elif o == "--jitter":
+            try:
+                jitter = float(a)
+            except ValueError:
+                die(f"ERROR: invalid jitter value: {a}")
+            if not 0 <= jitter <= 1:
+                die(f"ERROR: jitter must be between 0 and 1: {a}")
+
+        elif o == "--window":
+            if a.isdigit() and 0 < int(a) <= MAX_WINDOW:
+                window = int(a)
+            else:
+                die(f"ERROR: invalid window size: {a} (expected 1 to {MAX_WINDOW})")
+
+        elif o == "--capacity":
+            if a not in SEARCHES:
+                die(f"ERROR: invalid capacity search: {a} (expected {' or '.join(SEARCHES)})")
+            capacity_search = a
+
+        elif o == "--qps":
+            try:
+                rates = [float(rate) for rate in a.split(',')]
+            except ValueError:
+                die(f"ERROR: invalid query rates: {a}")
+            if not 1 <= len(rates) <= 3 or min(rates) <= 0:
+                die(f"ERROR: invalid query rates: {a}")
+            qps_start, qps_step, qps_max = (rates + [qps_step, qps_max][len(rates) - 1:])[:3]
+
+        elif o == "--step-time":
+            try:
+                step_time = float(a)
+            except ValueError:
+                die(f"ERROR: invalid step time: {a}")
+            if step_time <= 0:
+                die(f"ERROR: step time must be positive: {a}")
+
+        elif o == "--slo":
+            try:
+                slo = Slo.parse(a)
+            except ValueError as e:
+                die(f"ERROR: {e}")
+
+        elif o == "--curve":
+            curve_filename = a
+
+        elif o in ("-j", "--json"):
+            json_filename = a
+
+        elif o == "--flush-interval":
+            try:
+                flush_interval = float(a)
+            except ValueError:
+                die(f"ERROR: invalid flush interval: {a}")
+            if flush_interval < 0:
+                die(f"ERROR: flush interval must be non-negative: {a}")
+
         elif o == "--ecs":
             client_subnet = a
             use_edns = True  # ECS requires EDNS
@@ -323,6 +799,25 @@ def main() -> None:
         else:
             usage(1)
 
+    if (window or capacity_search) and proto not in (PROTO_UDP, PROTO_TCP, PROTO_TLS):
+        die("ERROR: --window and --capacity are only supported over UDP, TCP and TLS")
+    if curve_filename and not capacity_search:
+        die("ERROR: --curve needs --capacity")
+    if subtract_overhead and capacity_search:
+        die("ERROR: --subtract-overhead cannot be used with --capacity")
+    if json_filename and (window or capacity_search):
+        die("ERROR: --json cannot be used with --window or --capacity (see --curve)")
+    # with records or the curve on standard output, they are the only output
+    show_text = json_filename != '-' and curve_filename != '-'
+    if json_filename == '-':
+        quiet = True
+        verbose = False
+    if len(dnsservers) > 1:
+        if window or capacity_search:
+            die("ERROR: --window and --capacity take a single server")
+        if src_port > 0:
+            die("ERROR: a source port cannot be used with several servers")
+
     if src_ip is not None:
         if af is not None:
             parse_ip_address(src_ip, family=af)
@@ -336,13 +831,16 @@ def main() -> None:
 
     # Use system DNS server if parameter is not specified
     # remember not all systems have /etc/resolv.conf (i.e. Android)
-    if dnsserver is None:
-        dnsserver = str(dns.resolver.get_default_resolver().nameservers[0])
+    if not dnsservers:
+        dnsservers = [str(dns.resolver.get_default_resolver().nameservers[0])]
 
-    dnsserver_hostname = dnsserver  # keep original name for display and SNI
-    dnsserver_ip = resolve_server_address(dnsserver, af)
+    dnsserver_hostname = dnsservers[0]  # keep original name for display and SNI
+    dnsserver_ip = resolve_server_address(dnsserver_hostname, af)
+    # further servers are compared against the first one, taking turns in every round
+    others = [(hostname, resolve_server_address(hostname, af)) for hostname in dnsservers[1:]]
 
-    response_time = []
+    rtt_stats = RunningStats()
+    phase_stats = PhaseStats()
     i = 0
 
     # validate RR type
@@ -353,7 +851,7 @@ def main() -> None:
     # TIME_WAIT exhaustion — the OS cannot reuse an identical 4-tuple while the old one is in
     # TIME_WAIT, even with SO_REUSEADDR.  This is also the RFC 7766-recommended pattern.
     tcp_sock = None
-    if proto is PROTO_TCP and src_port > 0:
+    if proto is PROTO_TCP and src_port > 0 and not (window or capacity_search):
         af_tcp = socket.AF_INET6 if ':' in dnsserver_ip else socket.AF_INET
         tcp_sock = socket.socket(af_tcp, socket.SOCK_STREAM)
         tcp_sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
@@ -362,22 +860,14 @@ def main() -> None:
         tcp_sock.connect((dnsserver_ip, dst_port))
         tcp_sock.setblocking(False)
 
-    # Display the hostname if it differs from the resolved IP, otherwise just the IP
-    server_display = dnsserver_hostname if dnsserver_hostname != dnsserver_ip else dnsserver_ip
-    # Wrap IPv6 addresses in brackets for better readability
-    if ':' in server_display and not server_display.startswith('['):
-        server_display = f"[{server_display}]"
-    print("%s DNS: %s:%d, hostname: %s, proto: %s, class: %s, type: %s, flags: [%s]" %
-          (__progname__, server_display, dst_port, qname, proto_to_text(proto), dns.rdataclass.to_text(rdata_class),
-           rdatatype, dns.flags.to_text(request_flags)), flush=True)
-
-    while not shared.shutdown:
-
-        if 0 < count <= i:
-            break
-        else:
-            i += 1
+    # TLS state is kept for the whole run, as production clients do: DoT resumes the
+    # session of the previous connection, DoH keeps its HTTP/2 connection open.
+    # Connections go to the resolved IP, with the hostname for SNI/certificate validation.
+    tls_session = TlsSession(dnsserver_hostname if dnsserver_hostname != dnsserver_ip else None, alpns=['dot'])
+    # httpx cannot bind a source port, so -P keeps a new connection per DoH query
+    doh_session = DohSession(timeout, src_ip) if proto is PROTO_HTTPS and src_port == 0 else None
 
+    def make_query() -> dns.message.Message:
         if force_miss:
             fqdn = "_dnsdiag_%s_.%s" % (random_string(8, 8), qname)
         else:
@@ -398,49 +888,144 @@ def main() -> None:
                 client_cookie = os.urandom(8)
                 edns_options.append(dns.edns.CookieOption(client_cookie, b''))
 
-            query = dns.message.make_query(fqdn, rdatatype, rdata_class, flags=request_flags,
-                                           use_edns=True, want_dnssec=want_dnssec, payload=1232,
-                                           options=edns_options)
-        else:
-            query = dns.message.make_query(fqdn, rdatatype, rdata_class, flags=request_flags,
-                                           use_edns=False, want_dnssec=False)
+            return dns.message.make_query(fqdn, rdatatype, rdata_class, flags=request_flags,
+                                          use_edns=True, want_dnssec=want_dnssec, payload=1232,
+                                          options=edns_options)
+        return dns.message.make_query(fqdn, rdatatype, rdata_class, flags=request_flags,
+                                      use_edns=False, want_dnssec=False)
+
+    json_out = None
+    if json_filename:
+        try:
+            json_out = JsonLines(json_filename, flush_interval)
+        except OSError as e:
+            die(f"ERROR: cannot write {json_filename}: {e}")
+
+    server_display = display_name(dnsserver_hostname, dnsserver_ip)
+    if show_text:
+        print("%s DNS: %s, hostname: %s, proto: %s, class: %s, type: %s, flags: [%s]" %
+              (__progname__, ', '.join('%s:%d' % (display, dst_port) for display in
+                                       [server_display] + [display_name(*other) for other in others]),
+               qname, proto_to_text(proto), dns.rdataclass.to_text(rdata_class), rdatatype,
+               dns.flags.to_text(request_flags)), flush=True)
+
+    if calibrate_overhead:
+        overhead = calibrate(proto, use_edns=use_edns, want_dnssec=want_dnssec, want_nsid=want_nsid)
+        if show_text:
+            print("client overhead: %.3f ms (loopback %s round trip%s)" % (
+                overhead, proto_to_text(plain_transport(proto)), ", subtracted" if subtract_overhead else ""),
+                flush=True)
+
+    # flags the run when the client itself, not the network, limits response times
+    watchdog = Watchdog().start()
+    profiler = start_profiler() if profile_filename else None
+
+    def finish() -> WatchdogReport:
+        """Stop profiling and watching the client once the queries are done; returns how it fared."""
+        if profiler is not None:
+            stop_profiler(profiler, profile_filename)
+        client_health = watchdog.report()
+        watchdog.stop()
+        return client_health
+
+    reply_line = functools.partial(format_reply, show_ttl=show_ttl, show_flags=show_flags, want_dnssec=want_dnssec,
+                                   want_nsid=want_nsid, show_cookie=show_cookie, show_answer=show_answer)
+    # a fresh query each time only when its name or cookie has to change
+    query_source = make_query if force_miss or show_cookie else make_query()
+
+    if others:
+        servers = [(dnsserver_hostname, dnsserver_ip)] + others
+        # connect to the resolved IP, with the hostname for SNI and certificate validation
+        probers = [Prober(ip, qname, rdatatype, proto, port=dst_port, timeout=timeout, src_ip=src_ip,
+                          query=query_source, server_hostname=hostname if hostname != ip else None,
+                          overhead=overhead if subtract_overhead else 0.0)
+                   for hostname, ip in servers]
+        ping_servers(probers, [display_name(hostname, ip) for hostname, ip in servers], count, interval, jitter,
+                     reply_line, json_out, quiet, verbose, show_text, finish)
+        return
+
+    if capacity_search:
+        flood = Flood(dnsserver_ip, query_source, proto, port=dst_port, window=window or DEFAULT_WINDOW,
+                      timeout=timeout, src_ip=src_ip, src_port=src_port, tls=tls_session)
+        curve = {'server': dnsserver_hostname, 'address': dnsserver_ip, 'port': dst_port, 'qname': qname,
+                 'rdtype': rdatatype, 'proto': proto_to_text(proto), 'step_time': step_time}
+        # with the curve on standard output, it is the only output
+        ping_capacity(flood, capacity_search, slo, (qps_start, qps_step, qps_max), step_time, watchdog, finish,
+                      server_display, not quiet and curve_filename != '-', curve, curve_filename)
+        return
+
+    if window:
+        flood = Flood(dnsserver_ip, query_source, proto, port=dst_port, window=window, timeout=timeout,
+                      src_ip=src_ip, src_port=src_port, tls=tls_session)
+        ping_window(flood, count, server_display, overhead if subtract_overhead else 0.0, finish)
+        return
+
+    # queries go out at absolute deadlines, so time spent on each one does not slow the rate down
+    schedule = Schedule(interval, jitter, shared.shutdown_event)
+    recorded = 0  # the last seq with a JSON record; queries that got no reply have none yet
+    timestamp = 0.0
+    failure = ''  # why the last query got no reply, as printed
+    while not shared.shutdown:
+
+        if json_out is not None and recorded < i:
+            json_out.write(lost_record(server_display, i, timestamp, failure))
+            recorded = i
+        if 0 < count <= i:
+            break
+        if not schedule.wait():
+            break
+        i += 1
+        timestamp = time.time()
+        failure = ''
+
+        phases = Phases()
+        tls_state = None
+        btime = time.perf_counter()
+        query = make_query()
+        phases.build = (time.perf_counter() - btime) * 1000
 
         try:
             stime = time.perf_counter()
+            # UDP and TCP responses are kept as raw bytes; records are only parsed when printed
+            answers: WireResponse | dns.message.Message
             if proto is PROTO_UDP:
-                answers = dns.query.udp(query, dnsserver_ip, timeout=timeout, port=dst_port,
-                                        source=src_ip, source_port=src_port, ignore_unexpected=True)
+                answers = udp_exchange(query, dnsserver_ip, timeout, port=dst_port, source=src_ip,
+                                       source_port=src_port, phases=phases)
             elif proto is PROTO_TCP:
-                if tcp_sock:
-                    # TODO: reconnect on connection drop (currently counted as packet loss)
-                    answers = dns.query.tcp(query, dnsserver_ip, timeout=timeout, port=dst_port,
-                                            source=src_ip, source_port=src_port, sock=tcp_sock)
-                else:
-                    answers = dns.query.tcp(query, dnsserver_ip, timeout=timeout, port=dst_port,
-                                            source=src_ip, source_port=src_port)
+                # TODO: reconnect on connection drop (currently counted as packet loss)
+                answers = tcp_exchange(query, dnsserver_ip, timeout, port=dst_port, source=src_ip,
+                                       source_port=src_port, sock=tcp_sock, phases=phases)
             elif proto is PROTO_TLS:
                 if hasattr(dns.query, 'tls'):
                     try:
-                        # Use resolved IP for connection, but provide hostname for SNI/certificate validation
-                        server_hostname = dnsserver_hostname if dnsserver_hostname != dnsserver_ip else None
-                        answers = dns.query.tls(query, dnsserver_ip, timeout=timeout, port=dst_port,
-                                                source=src_ip, source_port=src_port,
-                                                server_hostname=server_hostname)
+                        # a new connection per query, resuming the TLS session of the previous one
+                        tls_sock, tls_state = tls_session.connect(dnsserver_ip, dst_port, timeout, source=src_ip,
+                                                                  source_port=src_port, phases=phases)
+                        try:
+                            answers = dns.query.tls(query, dnsserver_ip, timeout=timeout, port=dst_port,
+                                                    sock=tls_sock)
+                            tls_session.remember(tls_sock)
+                        finally:
+                            tls_sock.close()
                     except dns.exception.Timeout:
+                        failure = "Request timeout"
                         if not quiet:
                             print("Request timeout", flush=True)
                         continue
                     except (ConnectionResetError, BrokenPipeError):
+                        failure = "Connection closed unexpectedly"
                         if not quiet:
                             print("Connection closed unexpectedly", flush=True)
                         continue
                     except socket.gaierror:
+                        failure = "Name resolution failed"
                         if not quiet:
                             print("Name resolution failed", flush=True)
                         continue
                     except ssl.SSLCertVerificationError as e:
                         die(f"Certificate verification failed: {e}")
                     except ssl.SSLError:
+                        failure = "Connection failed"
                         if not quiet:
                             print("Connection failed", flush=True)
                         continue
@@ -455,26 +1040,34 @@ def main() -> None:
                             https_server = f"https://{dnsserver_hostname}/dns-query"
                         else:
                             https_server = dnsserver_ip
-                        answers = dns.query.https(query, https_server, timeout=timeout, port=dst_port,
-                                                  source=src_ip, source_port=src_port,
-                                                  http_version=dns.query.HTTPVersion.HTTP_2)
+                        if doh_session is not None:
+                            answers = doh_session.query(query, https_server, timeout, port=dst_port, phases=phases)
+                            tls_state = doh_session.state
+                        else:
+                            answers = dns.query.https(query, https_server, timeout=timeout, port=dst_port,
+                                                      source=src_ip, source_port=src_port,
+                                                      http_version=dns.query.HTTPVersion.HTTP_2)
                     except dns.query.NoDOH:
                         die("ERROR: python httpx module not available")
                     except httpx.ConnectError:
+                        failure = "Connection refused"
                         if not quiet:
                             print("Connection refused", flush=True)
                         continue
                     except (ConnectionResetError, BrokenPipeError):
+                        failure = "Connection closed unexpectedly"
                         if not quiet:
                             print("Connection closed unexpectedly", flush=True)
                         continue
                     except socket.gaierror:
+                        failure = "Name resolution failed"
                         if not quiet:
                             print("Name resolution failed", flush=True)
                         continue
                     except ssl.SSLCertVerificationError as e:
                         die(f"Certificate verification failed: {e}")
                     except (ssl.SSLError, httpx.WriteTimeout, httpx.StreamError, httpx.ProtocolError):
+                        failure = "Connection failed"
                         if not quiet:
                             print("Connection failed", flush=True)
                         continue
@@ -493,26 +1086,31 @@ def main() -> None:
                                                   source=src_ip, source_port=src_port,
                                                   http_version=dns.query.HTTPVersion.H3)
                     except ConnectionRefusedError:
+                        failure = "Connection refused"
                         if not quiet:
                             print("Connection refused", flush=True)
                         continue
                     except (ConnectionResetError, BrokenPipeError):
+                        failure = "Connection closed unexpectedly"
                         if not quiet:
                             print("Connection closed unexpectedly", flush=True)
                         continue
                     except socket.gaierror:
+                        failure = "Name resolution failed"
                         if not quiet:
                             print("Name resolution failed", flush=True)
                         continue
                     except ssl.SSLCertVerificationError as e:
                         die(f"Certificate verification failed: {e}")
                     except (ssl.SSLError, httpx.WriteTimeout, httpx.StreamError, httpx.ProtocolError):
+                        failure = "Connection failed"
                         if not quiet:
                             print("Connection failed", flush=True)
                         continue
                     except Exception as e:
                         # Catch QUIC-specific exceptions (UnexpectedEOF, etc.)
                         if e.__class__.__name__ in ('UnexpectedEOF', 'QuicConnectionError', 'H3Error'):
+                            failure = "Connection closed unexpectedly"
                             if not quiet:
                                 print("Connection closed unexpectedly", flush=True)
                             continue
@@ -530,30 +1128,36 @@ def main() -> None:
                                                  source=src_ip, source_port=src_port,
                                                  server_hostname=server_hostname)
                     except dns.exception.Timeout:
+                        failure = "Request timeout"
                         if not quiet:
                             print("Request timeout", flush=True)
                         continue
                     except ConnectionRefusedError:
+                        failure = "Connection refused"
                         if not quiet:
                             print("Connection refused", flush=True)
                         continue
                     except (ConnectionResetError, BrokenPipeError):
+                        failure = "Connection closed unexpectedly"
                         if not quiet:
                             print("Connection closed unexpectedly", flush=True)
                         continue
                     except socket.gaierror:
+                        failure = "Name resolution failed"
                         if not quiet:
                             print("Name resolution failed", flush=True)
                         continue
                     except ssl.SSLCertVerificationError as e:
                         die(f"Certificate verification failed: {e}")
                     except ssl.SSLError:
+                        failure = "Connection failed"
                         if not quiet:
                             print("Connection failed", flush=True)
                         continue
                     except Exception as e:
                         # Catch QUIC-specific exceptions
                         if e.__class__.__name__ in ('UnexpectedEOF', 'QuicConnectionError', 'StreamFinishedError'):
+                            failure = "Connection closed unexpectedly"
                             if not quiet:
                                 print("Connection closed unexpectedly", flush=True)
                             continue
@@ -570,12 +1174,16 @@ def main() -> None:
                     err(f"ERROR: {e}")
             sys.exit(1)
         except (httpx.ConnectTimeout, dns.exception.Timeout):
+            phase_stats.add(phases, answered=False)
+            failure = "Request timeout"
             if not quiet:
                 print("Request timeout", flush=True)
         except httpx.ReadTimeout:
+            failure = "Read timeout"
             if not quiet:
                 print("Read timeout", flush=True)
         except EOFError:
+            failure = "Connection closed by server"
             if not quiet:
                 err("Connection closed by server")
         except PermissionError:
@@ -585,9 +1193,11 @@ def main() -> None:
                 sys.exit(1)
         except OSError as e:
             if e.errno == errno.EHOSTUNREACH:
+                failure = "No route to host"
                 if not quiet:
                     print("No route to host", flush=True)
             elif e.errno == errno.ENETUNREACH:
+                failure = "Network unreachable"
                 if not quiet:
                     print("Network unreachable", flush=True)
             elif not quiet:
@@ -595,6 +1205,7 @@ def main() -> None:
             else:
                 sys.exit(1)
         except ValueError:
+            failure = "invalid response"
             if not quiet:
                 err("ERROR: invalid response")
                 continue
@@ -605,75 +1216,28 @@ def main() -> None:
         else:
             # Use perf_counter() measurements for accurate wall-clock time
             elapsed = (etime - stime) * 1000  # Convert seconds to milliseconds
-            response_time.append(elapsed)
+            if tls_state is not None:
+                # TLS connection setup is reported on its own
+                elapsed -= phases.connect + phases.handshake
+            if isinstance(answers, WireResponse):
+                size = len(answers)
+            else:
+                # the exchange happened inside dnspython
+                size = len(answers.to_wire())
+                phases.wait = elapsed
+                phases.bytes_sent = len(query.to_wire())
+                phases.bytes_received = size
+            if subtract_overhead:
+                elapsed = max(0.0, elapsed - overhead)
+            rtt_stats.add(elapsed)
+            if json_out is not None:
+                json_out.write(reply_record(answers, size, server_display, i, elapsed, timestamp, tls_state))
+                recorded = i
+
+            ptime = time.perf_counter()  # records are decoded on demand while the output is built
             if not quiet:
-                extras = ""
-                extras += " %s" % dns.rcode.to_text(answers.rcode())  # add response code
-
-                if show_ttl:
-                    if answers.answer:
-                        ans_ttl = str(answers.answer[0].ttl)
-                        extras += " [TTL=%-4s]" % ans_ttl
-
-                if show_flags:
-                    ans_flags = dns.flags.to_text(answers.flags)
-                    edns_flags = dns.flags.edns_to_text(answers.ednsflags)
-                    if want_dnssec and not (answers.flags & dns.flags.AD):
-                        ans_flags += " --"  # add padding to printer output when dnssec is requested, but AD flag is not set
-                    extras += " [%s]" % " ".join([ans_flags, edns_flags]).rstrip(' ')  # show both regular + edns flags
-
-                # Display EDNS options compactly (only for explicitly enabled options)
-                edns_parts = []
-
-                if want_nsid and answers.options:
-                    for ans_opt in answers.options:
-                        if ans_opt.otype == dns.edns.OptionType.NSID:
-                            nsid_val = ans_opt.nsid
-                            if nsid_val:
-                                edns_parts.append("NSID:%s" % nsid_val.decode("utf-8"))
-
-                # Always show EDE when present (server-initiated error responses)
-                if answers.options:
-                    for ans_opt in answers.options:
-                        if ans_opt.otype == dns.edns.EDE:
-                            if ans_opt.text:
-                                # Truncate EDE text for ping output to prevent display issues
-                                truncated_text = ans_opt.text[:50] + "..." if len(ans_opt.text) > 50 else ans_opt.text
-                                edns_parts.append("EDE:%d(\"%s\")" % (ans_opt.code, truncated_text))
-                            else:
-                                edns_parts.append("EDE:%d" % ans_opt.code)
-
-                # Always show ECS if present (since it's typically echoed back when requested)
-                if answers.options:
-                    for ans_opt in answers.options:
-                        if ans_opt.otype == dns.edns.OptionType.ECS:
-                            if ans_opt.address:
-                                edns_parts.append("ECS:%s/%d/%d" % (ans_opt.address, ans_opt.srclen, ans_opt.scopelen))
-                            else:
-                                edns_parts.append("ECS:auto")
-
-                # Always show cookies when present (echoed back from server)
-                if show_cookie and answers.options:
-                    for ans_opt in answers.options:
-                        if ans_opt.otype == 10:  # COOKIE
-                            cookie_hex = ans_opt.client.hex() + ans_opt.server.hex()
-                            # Truncate cookie display in normal mode (max 8 chars)
-                            if len(cookie_hex) > 8:
-                                cookie_display = cookie_hex[:8] + "..."
-                            else:
-                                cookie_display = cookie_hex
-                            edns_parts.append("COOKIE:%s" % cookie_display)
-
-                if edns_parts:
-                    extras += " [%s]" % ", ".join(edns_parts)
-
-                if show_answer and answers.answer:
-                    ans = answers.answer[0]
-                    rtype = dns.rdatatype.to_text(ans.rdtype)
-                    extras += " [RDATA: %s %s]" % (rtype, ans[0])
-
-                print("%-3d bytes from %s: seq=%-3d time=%-7.3f ms %s" % (
-                    len(answers.to_wire()), server_display, i, elapsed, extras), flush=True)
+                print(reply_line(answers, size, server_display, i, elapsed, tls_state=tls_state,
+                                 handshake=phases.connect + phases.handshake), flush=True)
 
             if verbose:
                 print(answers.to_text(), flush=True)
@@ -727,49 +1291,39 @@ def main() -> None:
 
                         print("%s (%d): %s" % (option_name, ans_opt.otype, option_details), flush=True)
 
+            phases.parse += (time.perf_counter() - ptime) * 1000
+            phase_stats.add(phases, answered=True)
+
             # Check for shutdown signal after verbose output processing
             if shared.shutdown:
                 break
 
-            time_to_next = (stime + interval) - etime
-            if time_to_next > 0:
-                # Interruptible sleep - check for shutdown signal every 0.1 seconds
-                sleep_start = time.time()
-                while time.time() - sleep_start < time_to_next:
-                    if shared.shutdown:
-                        break
-                    sleep_duration = time_to_next - (time.time() - sleep_start)
-                    if sleep_duration > 0:
-                        time.sleep(min(0.1, sleep_duration))
-
     if tcp_sock:
         try:
             tcp_sock.close()
         except OSError:
             pass
-
-    r_sent = i
-    r_received = len(response_time)
-    r_lost = r_sent - r_received
-    r_lost_percent = (100 * r_lost) / r_sent if r_sent > 0 else 0.0
-    if response_time:
-        r_min = min(response_time)
-        r_max = max(response_time)
-        r_avg = sum(response_time) / r_received
-        if len(response_time) > 1:
-            r_stddev = stdev(response_time)
-        else:
-            r_stddev = 0
-    else:
-        r_min = 0
-        r_max = 0
-        r_avg = 0
-        r_stddev = 0
-
-    print('\n--- %s dnsping statistics ---' % server_display, flush=True)
-    print('%d requests transmitted, %d responses received, %.0f%% lost' % (r_sent, r_received, r_lost_percent),
-          flush=True)
-    print('min=%.3f ms, avg=%.3f ms, max=%.3f ms, stddev=%.3f ms' % (r_min, r_avg, r_max, r_stddev), flush=True)
+    if doh_session is not None:
+        doh_session.close()
+
+    client_health = finish()
+    if json_out is not None and recorded < i:
+        json_out.write(lost_record(server_display, i, timestamp, failure))
+    print_statistics(server_display, i, rtt_stats, json_out, show_text,
+                     phase_stats.averages() if show_phases and phase_stats.count else None,
+                     str(client_health) if client_health.unreliable else '')
+    if json_out is not None:
+        json_out.close()
+    if not show_text:
+        return
+
+    if show_phases and phase_stats.count:
+        print('phases: %s' % format_phases(phase_stats.averages()), flush=True)
+    if profile_filename:
+        print('%d bytes sent, %d bytes received, profile written to %s' % (
+            phase_stats.bytes_sent, phase_stats.bytes_received, profile_filename), flush=True)
+    if client_health.unreliable:
+        print('WARNING: client saturated (%s), response times may be inflated' % client_health, flush=True)
 
 
 if __name__ == '__main__':
@@ -25,6 +25,7 @@
 # OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
 
 
+import collections
 import concurrent.futures
 import getopt
 import ipaddress
@@ -34,14 +35,23 @@ import sys
 import time
 from typing import Any
 
-import dns.edns
 import dns.query
 import dns.rdatatype
 import dns.resolver
 
+import dnsdiag.asindex
+import dnsdiag.ptr
+import dnsdiag.trace
 import dnsdiag.whois
 from dnsdiag import shared
-from dnsdiag.dns import PROTO_HTTP3, PROTO_QUIC, PROTO_TCP, PROTO_UDP, get_default_port
+from dnsdiag.dns import (
+    PROTO_HTTP3,
+    PROTO_QUIC,
+    PROTO_TCP,
+    PROTO_UDP,
+    get_default_port,
+    proto_to_text,
+)
 from dnsdiag.shared import (
     Colors,
     __version__,
@@ -56,12 +66,13 @@ from dnsdiag.shared import (
 
 # Global Variables
 quiet = False
-whois_cache: dict[str, Any] = {}
 
 # Constants
 __author__ = 'Babak Farrokhi (babak@farrokhi.net)'
 __license__ = 'BSD'
 __progname__ = os.path.basename(sys.argv[0])
+WHOIS_DEADLINE = 10.0  # seconds a hop line waits for its ASN
+DEFAULT_PROBE_RATE = 100.0  # probes per second when tracing a server list
 
 
 def test_import() -> None:
@@ -71,7 +82,7 @@ def test_import() -> None:
 
 def usage(exit_code: int = 0) -> None:
     print("""%s version %s
-Usage: %s [-aenqhCxTSQ346] [-s server] [-p port] [-c count] [-t type] [-w wait] hostname
+Usage: %s [-aenqhCxTSQ346] [-s server | -f server-list] [-p port] [-c count] [-t type] [-w wait] [--queries N] hostname
 
 Options:
   -h, --help        Show this help message
@@ -93,6 +104,16 @@ Options:
   -e, --edns        Enable EDNS0 (default: disabled)
   -N, --nsid        Enable NSID to retrieve resolver identification (implies EDNS)
   -n                Disable hostname resolution for IP addresses
+      --parallel    Send all TTL-limited probes at once and finish in about one timeout (UDP only)
+      --queries     Number of concurrent probes per hop; shows min/avg/loss per hop (default: 1)
+      --continuous  Probe every hop repeatedly and show rolling per-hop statistics, like mtr (UDP only)
+      --interval    Seconds between rounds in continuous mode (default: 1)
+  -f, --file        Trace every DNS server listed in a file ('-' for stdin) at once (UDP only)
+      --rate        Maximum probes per second when tracing a server list (default: 100)
+      --find-interceptor  Binary search on TTL for the first hop that answers DNS, to locate a transparent
+                    DNS proxy (UDP only)
+      --incremental Re-check the last known path with a few probes; re-probe only the hops that changed
+      --asn-db      Look up AS# offline in a local prefix table (pyasn-style dump or compiled index; implies -a)
 """ % (__progname__, __version__, __progname__))
     sys.exit(exit_code)
 
@@ -151,22 +172,491 @@ def ping(qname: str, server: str, rdtype: str, proto: int, port: int, ttl: int,
             resp_time = resp.r_max
 
             # Extract NSID if requested and available
-            if want_nsid and resp.response and resp.response.options:
-                for option in resp.response.options:
-                    if option.otype == dns.edns.OptionType.NSID:
-                        nsid_bytes = option.nsid
-                        if nsid_bytes:
-                            try:
-                                nsid_value = nsid_bytes.decode("utf-8")
-                            except UnicodeDecodeError:
-                                nsid_value = nsid_bytes.hex()
-                        break
+            if want_nsid and resp.response:
+                nsid_value = dnsdiag.trace.extract_nsid(resp.response)
 
     return reached, resp_time, nsid_value
 
 
+def print_hop(ttl: int, curr_addr: str | None, curr_name: str | None, rtts: list[float], sent: int,
+              nsid_value: str | None, asn: Any | None, dnsserver: str, color: Colors) -> str:
+    """Print one traceroute line and return the hop address, or '*' for a silent hop.
+
+    With a single probe per hop the line shows its response time; otherwise it
+    shows min/avg over the replies and the share of probes that went unanswered.
+    """
+    if not curr_addr:
+        print("%d\t *" % ttl, flush=True)
+        return "*"
+
+    curr_name = curr_name or curr_addr
+
+    as_name = ""
+    if asn is not None and getattr(asn, 'asn', "NA") != "NA":
+        as_name = "[AS%s %s] " % (asn.asn, asn.owner) if asn.owner else "[AS%s] " % asn.asn
+
+    c = color.N  # default
+    try:
+        IP = ipaddress.ip_address(curr_addr)
+        if IP.is_private:
+            c = color.R
+        if IP.is_reserved:
+            c = color.B
+        if curr_addr == dnsserver:
+            c = color.G
+    except Exception:
+        pass
+
+    nsid_display = ""
+    if nsid_value:
+        nsid_display = "[NSID: %s] " % nsid_value
+
+    if sent == 0:  # known from an earlier trace, not probed this time
+        timing = "(unchanged)"
+    elif sent > 1 and rtts:
+        loss = 100 * (sent - len(rtts)) / sent
+        timing = "min=%.3f ms, avg=%.3f ms, loss=%.0f%%" % (min(rtts), sum(rtts) / len(rtts), loss)
+    else:
+        timing = "%.3f ms" % (rtts[0] if rtts else 0.0)
+
+    print("%d\t%s (%s%s%s) %s%s%s" % (ttl, curr_name, c, curr_addr, color.N, as_name, nsid_display, timing),
+          flush=True)
+    return curr_addr
+
+
+class PendingHop:
+    def __init__(self, ttl: int, addr: str | None, rtts: list[float], sent: int, nsid_value: str | None) -> None:
+        self.ttl = ttl
+        self.addr = addr
+        self.rtts = rtts
+        self.sent = sent
+        self.nsid_value = nsid_value
+        self.name: concurrent.futures.Future[str] | None = None
+        self.name_deadline = 0.0
+        self.asn: concurrent.futures.Future[Any] | None = None
+        self.asn_deadline = 0.0
+
+    def ready(self) -> bool:
+        now = time.monotonic()
+        return all(future is None or future.done() or now >= deadline
+                   for future, deadline in ((self.name, self.name_deadline), (self.asn, self.asn_deadline)))
+
+
+def _future_result(future: 'concurrent.futures.Future[Any] | None', deadline: float) -> Any:
+    if future is None:
+        return None
+    try:
+        return future.result(timeout=max(0.0, deadline - time.monotonic()))
+    except (concurrent.futures.TimeoutError, concurrent.futures.CancelledError):
+        return None
+
+
+class HopPrinter:
+    """Print hop lines in TTL order, each as soon as its lookups are done.
+
+    Reverse DNS and ASN lookups start the moment a hop address is known and
+    run while the trace carries on. A line waits at most ptr_deadline seconds
+    for its name (and WHOIS_DEADLINE for its ASN) before it is printed with
+    whatever is known by then.
+    """
+
+    def __init__(self, dnsserver: str, ptr_resolver: dnsdiag.ptr.PtrResolver | None,
+                 asn_resolver: dnsdiag.whois.AsnResolver | dnsdiag.asindex.IndexResolver | None, color: Colors,
+                 ptr_deadline: float) -> None:
+        self.dnsserver = dnsserver
+        self.ptr_resolver = ptr_resolver
+        self.asn_resolver = asn_resolver
+        self.color = color
+        self.ptr_deadline = ptr_deadline
+        self.trace_path: list[str] = []
+        self._pending: collections.deque[PendingHop] = collections.deque()
+
+    def add(self, ttl: int, addr: str | None, rtts: list[float], sent: int, nsid_value: str | None) -> None:
+        now = time.monotonic()
+        hop = PendingHop(ttl, addr, rtts, sent, nsid_value)
+        if addr and self.ptr_resolver:
+            hop.name = self.ptr_resolver.lookup(addr)
+            hop.name_deadline = now + self.ptr_deadline
+        if addr and self.asn_resolver:
+            hop.asn = self.asn_resolver.lookup(addr)
+            hop.asn_deadline = now + WHOIS_DEADLINE
+        self._pending.append(hop)
+        self.flush()
+
+    def flush(self, wait: bool = False) -> None:
+        """Print every leading line whose lookups are done; with wait, print them all."""
+        while self._pending and not shared.shutdown:
+            hop = self._pending[0]
+            if not wait and not hop.ready():
+                return
+            self._pending.popleft()
+            name = _future_result(hop.name, hop.name_deadline) or hop.addr
+            asn = _future_result(hop.asn, hop.asn_deadline)
+            self.trace_path.append(print_hop(hop.ttl, hop.addr, name, hop.rtts, hop.sent, hop.nsid_value, asn,
+                                             self.dnsserver, self.color))
+
+    def close(self) -> None:
+        self.flush(wait=True)
+        if self.asn_resolver:
+            self.asn_resolver.close()
+        if self.ptr_resolver:
+            self.ptr_resolver.close()
+            try:
+                self.ptr_resolver.cache.save()
+            except OSError:
+                pass
+
+
+def make_hop_printer(dnsserver: str, should_resolve: bool, as_lookup: bool, asn_db: str | None, color: Colors,
+                     timeout: float) -> HopPrinter:
+    """Set up the reverse DNS and ASN resolvers requested on the command line and a printer using them."""
+    ptr_resolver = None
+    if should_resolve:
+        ptr_cache = dnsdiag.ptr.PtrCache()
+        ptr_cache.restore()
+        ptr_resolver = dnsdiag.ptr.PtrResolver(ptr_cache)
+    asn_resolver: dnsdiag.whois.AsnResolver | dnsdiag.asindex.IndexResolver | None = None
+    if asn_db:
+        try:
+            asn_resolver = dnsdiag.asindex.IndexResolver(dnsdiag.asindex.AsnIndex.open(asn_db))
+        except (OSError, ValueError) as e:
+            die(f"ERROR: cannot load ASN database {asn_db}: {e}")
+    elif as_lookup:
+        asn_resolver = dnsdiag.whois.AsnResolver(dnsdiag.whois.WhoisCache())
+    return HopPrinter(dnsserver, ptr_resolver, asn_resolver, color, ptr_deadline=timeout)
+
+
+class HopProber:
+    """Probe one TTL at a time with concurrent DNS queries, sharing one ICMP listener and worker pool."""
+
+    def __init__(self, listener: dnsdiag.trace.IcmpListener, pool: concurrent.futures.ThreadPoolExecutor,
+                 printer: HopPrinter, qname: str, dnsserver: str, rdatatype: str, proto: int, port: int,
+                 timeout: int, src_ip: str | None, use_edns: bool, want_nsid: bool, queries: int) -> None:
+        self.listener = listener
+        self.pool = pool
+        self.printer = printer
+        self.qname = qname
+        self.dnsserver = dnsserver
+        self.rdatatype = rdatatype
+        self.proto = proto
+        self.port = port
+        self.timeout = timeout
+        self.src_ip = src_ip
+        self.use_edns = use_edns
+        self.want_nsid = want_nsid
+        self.queries = queries
+
+    def probe(self, ttl: int) -> tuple[str | None, list[float], bool, str | None] | None:
+        """Return (address, rtts, reached, nsid) for one TTL, or None if interrupted."""
+        probes = [self.listener.register(self.port) for _ in range(self.queries)]
+        stime = time.perf_counter()
+        futures = [self.pool.submit(ping, self.qname, self.dnsserver, self.rdatatype, self.proto, self.port, ttl,
+                                    self.timeout, src_ip=self.src_ip, use_edns=self.use_edns,
+                                    want_nsid=self.want_nsid) for _ in range(self.queries)]
+
+        # print earlier hops whose reverse lookups finish while this one is probed
+        while not shared.shutdown:
+            _, not_done = concurrent.futures.wait(futures, timeout=0.1)
+            self.printer.flush()
+            if not not_done:
+                break
+
+        results = []
+        try:
+            for future in futures:
+                results.append(future.result())
+        except (KeyboardInterrupt, SystemExit):
+            shared.shutdown = True
+            self.listener.cancel(probes)
+            return None
+
+        reached = any(result[0] and result[1] is not None for result in results)
+        if not reached:
+            # DNS queries have timed out by now; give late ICMP replies the rest of the window
+            for probe in probes:
+                probe.event.wait(max(0.0, stime + self.timeout - time.perf_counter()))
+        self.listener.cancel(probes)
+
+        curr_addr = None
+        nsid_value = None
+        rtts: list[float] = []
+        for (probe_reached, resp_time, probe_nsid), probe in zip(results, probes):
+            if probe_reached and resp_time is not None:
+                curr_addr = self.dnsserver
+                nsid_value = nsid_value or probe_nsid
+                rtts.append(resp_time)
+            elif probe.addr is not None and probe.recv_time is not None:
+                curr_addr = curr_addr or probe.addr
+                rtts.append((probe.recv_time - stime) * 1000)  # convert to milliseconds
+
+        return curr_addr, rtts, reached, nsid_value
+
+
+def incremental_trace(prober: HopProber, printer: HopPrinter, store: dnsdiag.trace.PathStore, key: str,
+                      count: int) -> None:
+    """Trace by confirming the last known path to the server instead of walking every hop.
+
+    The destination, the hop before it and a few sample hops are probed
+    first. If they agree with the stored path, nothing else is probed;
+    otherwise only the segment between the nearest confirmed hops is traced
+    again. Hops that were not probed are printed from the stored path.
+    """
+    path = store.get(key)
+    results: dict[int, tuple[str | None, list[float], bool, str | None]] = {}
+
+    def probe(ttl: int) -> bool:
+        result = prober.probe(ttl)
+        if result is None:
+            return False
+        results[ttl] = result
+        return True
+
+    segment: tuple[int, int | None] | None = (0, None)
+    if path:
+        for ttl in dnsdiag.trace.check_ttls(len(path)):
+            if not probe(ttl):
+                return
+        segment = dnsdiag.trace.changed_segment(path, {ttl: result[0] for ttl, result in results.items()})
+
+    new_path: list[str | None] = list(path or [])
+    if segment is not None:
+        lo, hi = segment
+        new_path = new_path[:lo]
+        ttl = lo + 1
+        reached = False
+        while ttl <= count and (hi is None or ttl < hi):
+            if ttl not in results and not probe(ttl):
+                return
+            addr, _, reached, _ = results[ttl]
+            new_path.append(addr)
+            if reached or addr == prober.dnsserver:
+                reached = True
+                break
+            ttl += 1
+        if path and hi is not None and not reached:
+            new_path += path[hi - 1:]
+
+    for ttl, addr in enumerate(new_path, 1):
+        if ttl in results:
+            addr, rtts, _, nsid_value = results[ttl]
+            printer.add(ttl, addr, rtts, prober.queries, nsid_value)
+        else:
+            printer.add(ttl, addr, [], 0, None)
+    printer.flush(wait=True)
+
+    if new_path and new_path[-1] == prober.dnsserver:
+        try:
+            store.put(key, new_path)
+        except OSError:
+            pass
+
+    if not quiet and path:
+        if segment is None:
+            status = "path unchanged"
+        elif segment[1] is None:
+            status = "path changed after hop %d" % segment[0]
+        else:
+            status = "path changed between hops %d and %d" % (segment[0], segment[1])
+        print("%s; probed %d of %d hops" % (status, len(results), len(new_path)), flush=True)
+
+
+def locate_interceptor(qname: str, dnsserver: str, port: int, rdatatype: str, count: int, timeout: int, af: int,
+                       src_ip: str | None, use_edns: bool, color: Colors) -> None:
+    """Find the first hop that answers DNS queries by binary search on TTL.
+
+    A transparent DNS proxy answers queries addressed to any server, so on an
+    intercepted path the answer comes back from fewer hops away than the
+    server really is: from the proxy, not from the destination.
+    """
+    def probe(ttl: int) -> dnsdiag.trace.Hop:
+        try:
+            hop = dnsdiag.trace.parallel_trace(qname, dnsserver, port, rdatatype, count, timeout, af, src_ip=src_ip,
+                                               use_edns=use_edns, ttls=[ttl])[0]
+        except PermissionError:
+            die("ERROR: unable to create ICMP socket with unprivileged user. Please run as root.")
+        except OSError as e:
+            die(f"ERROR: {e}")
+        if hop.reached:
+            print("TTL %d: DNS response in %.3f ms" % (ttl, hop.rtt or 0.0), flush=True)
+        elif hop.addr:
+            print("TTL %d: time exceeded at %s" % (ttl, hop.addr), flush=True)
+        else:
+            print("TTL %d: no reply" % ttl, flush=True)
+        return hop
+
+    responder, probed = dnsdiag.trace.locate_responder(probe, count)
+    if shared.shutdown:
+        return
+    if responder is None:
+        print("\nNo DNS response within %d hops" % count, flush=True)
+        return
+
+    previous = next((hop for hop in probed if hop.ttl == responder - 1), None)
+    if responder > 1 and previous is None:
+        previous = probe(responder - 1)
+    after = " after %s" % previous.addr if previous is not None and previous.addr else ""
+    print("\nDNS responses start at hop %d%s (%d probes)" % (responder, after, len(probed)), flush=True)
+
+    private_network_radius = 4  # number of hops we assume we are still inside our local network
+    try:
+        public_server = not ipaddress.ip_address(dnsserver).is_private
+    except ValueError:
+        public_server = False
+    if public_server and responder <= private_network_radius:
+        print(" %s[*]%s public DNS server answers from within %d hops (possible transparent DNS proxy)" %
+              (color.R, color.N, responder), flush=True)
+
+
+def load_servers(filename: str, af: int | None) -> list[tuple[str, str, int]]:
+    """Read a server list (one name or address per line, '#' comments) into (name, address, family) tuples.
+
+    Names are resolved in the requested address family, IPv4 by default.
+    """
+    try:
+        if filename == '-':
+            lines = sys.stdin.read().splitlines()
+        else:
+            with open(filename, 'rt') as flist:
+                lines = flist.read().splitlines()
+    except OSError as e:
+        die(f"ERROR: cannot read server list: {e}")
+
+    servers: list[tuple[str, str, int]] = []
+    for line in lines:
+        name = line.strip()
+        if not name or name.startswith('#'):
+            continue
+        addr = resolve_server_address(name, af or socket.AF_INET)
+        server_af = socket.AF_INET6 if ':' in addr else socket.AF_INET
+        if af is not None and server_af != af:
+            die(f"ERROR: DNS server {name} does not match the requested address family")
+        servers.append((name, addr, server_af))
+    if not servers:
+        die("ERROR: no DNS servers found in server list")
+    return servers
+
+
+def trace_servers(qname: str, servers: list[tuple[str, str, int]], port: int, rdatatype: str, count: int,
+                  timeout: int, src_ip: str | None, use_edns: bool, want_nsid: bool, rate: float,
+                  printer: HopPrinter) -> None:
+    """Trace all servers at once, print each path in turn and then the routers they share."""
+    paths = dnsdiag.trace.multi_trace(qname, [(addr, af) for _, addr, af in servers], port, rdatatype, count,
+                                      timeout, src_ip=src_ip, use_edns=use_edns, want_nsid=want_nsid, rate=rate)
+    if shared.shutdown:
+        return
+
+    # start every name and ASN lookup up front; they complete while earlier paths are printed
+    for path in paths.values():
+        for hop in path:
+            if hop.addr and printer.ptr_resolver:
+                printer.ptr_resolver.lookup(hop.addr)
+            if hop.addr and printer.asn_resolver:
+                printer.asn_resolver.lookup(hop.addr)
+
+    for name, addr, _ in servers:
+        if shared.shutdown:
+            return
+        if not quiet:
+            server_display = f"[{addr}]" if ':' in addr else addr
+            label = server_display if name == addr else "%s (%s)" % (name, server_display)
+            print("\n%s DNS: %s:%d, hostname: %s, rdatatype: %s" % (__progname__, label, port, qname, rdatatype),
+                  flush=True)
+        printer.dnsserver = addr
+        for hop in paths[addr]:
+            printer.add(hop.ttl, hop.addr, [hop.rtt] if hop.rtt is not None else [], 1, hop.nsid)
+        printer.flush(wait=True)
+
+    common = dnsdiag.trace.shared_hops(paths)
+    print("\n=== Shared hops ===")
+    if not common:
+        print(" none")
+    for addr, paths_count, low_ttl, high_ttl in common:
+        ttl_range = "hop %d" % low_ttl if low_ttl == high_ttl else "hops %d-%d" % (low_ttl, high_ttl)
+        print(" %-40s %d of %d paths, %s" % (addr, paths_count, len(paths), ttl_range), flush=True)
+
+
+def _ms(value: float | None) -> str:
+    return "%7.2f" % value if value is not None else "%7s" % "-"
+
+
+def render_stats(stats: list[dnsdiag.trace.HopStats], names: dict[str, str], asns: dict[str, Any],
+                 dnsserver: str, color: Colors) -> list[str]:
+    """Format one screen of per-hop statistics for continuous mode."""
+    columns = ("Hop", "Host", "Loss%", "Snt", "Last", "Avg", "Best", "Wrst", "Jttr")
+    lines = ["%-4s %-44s %6s %5s %7s %7s %7s %7s %7s" % columns]
+    for hop in stats:
+        if hop.addr is None:
+            host = "???"
+        else:
+            host = names.get(hop.addr) or hop.addr
+            asn = asns.get(hop.addr)
+            if asn is not None and getattr(asn, 'asn', "NA") != "NA":
+                host = "[AS%s] %s" % (asn.asn, host)
+        c = color.G if hop.addr == dnsserver else color.N
+        lines.append("%3d. %s%-44s%s %5.1f%% %5d %s %s %s %s %s" % (
+            hop.ttl, c, host[:44], color.N, hop.loss(), hop.sent, _ms(hop.last()), _ms(hop.avg()), _ms(hop.best()),
+            _ms(hop.worst()), _ms(hop.jitter())))
+    return lines
+
+
+def continuous_trace(qname: str, dnsserver: str, port: int, rdatatype: str, count: int, timeout: int,
+                     af: int, src_ip: str | None, use_edns: bool, interval: float,
+                     ptr_resolver: dnsdiag.ptr.PtrResolver | None,
+                     asn_resolver: dnsdiag.whois.AsnResolver | dnsdiag.asindex.IndexResolver | None,
+                     color: Colors) -> None:
+    """Trace the path once per interval and redraw rolling statistics until interrupted.
+
+    Every round is a parallel trace, so each hop gets one real DNS query per
+    round. On a terminal the screen is redrawn in place; otherwise each
+    snapshot is printed in turn. The final statistics stay on screen.
+    """
+    stats = [dnsdiag.trace.HopStats(ttl) for ttl in range(1, count + 1)]
+    path_len = count
+    names: dict[str, concurrent.futures.Future[str]] = {}
+    asns: dict[str, concurrent.futures.Future[Any]] = {}
+    redraw = sys.stdout.isatty()
+
+    next_round = time.monotonic()
+    while not shared.shutdown:
+        try:
+            trace_hops = dnsdiag.trace.parallel_trace(qname, dnsserver, port, rdatatype, count, timeout, af,
+                                                      src_ip=src_ip, use_edns=use_edns)
+        except PermissionError:
+            die("ERROR: unable to create ICMP socket with unprivileged user. Please run as root.")
+        except OSError as e:
+            die(f"ERROR: {e}")
+        if shared.shutdown:
+            break
+
+        path_len = len(trace_hops)
+        for hop in trace_hops:
+            stats[hop.ttl - 1].add(hop.addr, hop.rtt)
+
+        # keep lookups only for addresses currently on the path, so memory stays bounded
+        addrs = {hop.addr for hop in stats[:path_len] if hop.addr is not None}
+        if ptr_resolver:
+            names = {addr: names.get(addr) or ptr_resolver.lookup(addr) for addr in addrs}
+        if asn_resolver:
+            asns = {addr: asns.get(addr) or asn_resolver.lookup(addr) for addr in addrs}
+
+        lines = render_stats(stats[:path_len],
+                             {addr: f.result() for addr, f in names.items() if f.done() and not f.cancelled()},
+                             {addr: f.result() for addr, f in asns.items() if f.done() and not f.cancelled()},
+                             dnsserver, color)
+        if redraw:
+            print("\033[H\033[2J", end="")
+        else:
+            print()
+        print("\n".join(lines), flush=True)
+
+        next_round += interval
+        while not shared.shutdown and time.monotonic() < next_round:
+            time.sleep(min(0.1, max(0.0, next_round - time.monotonic())))
+        next_round = max(next_round, time.monotonic())
+
+
 def main() -> None:
-    global quiet, whois_cache
+    global quiet
 
     setup_signal_handler()
 
@@ -183,11 +673,20 @@ def main() -> None:
     src_ip = None
     hops = 0
     as_lookup = False
+    asn_db = None
     expert_mode = False
     should_resolve = True
     use_edns = False
     want_nsid = False
     color_mode = False
+    parallel = False
+    continuous = False
+    incremental = False
+    find_interceptor = False
+    servers_file = None
+    rate = DEFAULT_PROBE_RATE
+    interval = 1.0
+    queries = 1
     af = None  # auto-detect from server address
     af_ipv4_set = False
     af_ipv6_set = False
@@ -195,9 +694,11 @@ def main() -> None:
 
     args = None
     try:
-        opts, args = getopt.getopt(sys.argv[1:], "aqhc:s:S:t:w:p:nexCTQ346N",
+        opts, args = getopt.getopt(sys.argv[1:], "aqhc:s:S:t:w:p:nexCTQ346Nf:",
                                    ["help", "count=", "server=", "quiet", "type=", "wait=", "asn", "port=", "expert",
-                                    "color", "srcip=", "tcp", "quic", "http3", "ipv4", "ipv6", "nsid"])
+                                    "color", "srcip=", "tcp", "quic", "http3", "ipv4", "ipv6", "nsid",
+                                    "parallel", "queries=", "asn-db=", "continuous", "interval=",
+                                    "incremental", "find-interceptor", "file=", "rate="])
     except getopt.GetoptError as getopt_err:
         err(str(getopt_err))
         usage(1)
@@ -274,11 +775,63 @@ def main() -> None:
             af_ipv6_set = True
         elif o in ("-a", "--asn"):
             as_lookup = True
+        elif o == "--asn-db":
+            as_lookup = True
+            asn_db = a
         elif o in ("-e", "--edns"):
             use_edns = True
         elif o in ("-N", "--nsid"):
             use_edns = True
             want_nsid = True
+        elif o == "--parallel":
+            parallel = True
+        elif o == "--continuous":
+            continuous = True
+        elif o == "--incremental":
+            incremental = True
+        elif o == "--find-interceptor":
+            find_interceptor = True
+        elif o in ("-f", "--file"):
+            servers_file = a
+        elif o == "--rate":
+            try:
+                rate = float(a)
+                if rate <= 0:
+                    die(f"ERROR: probe rate must be positive: {a}")
+            except ValueError:
+                die(f"ERROR: invalid probe rate value: {a}")
+        elif o == "--interval":
+            try:
+                interval = float(a)
+                if interval <= 0:
+                    die(f"ERROR: interval must be positive: {a}")
+            except ValueError:
+                die(f"ERROR: invalid interval value: {a}")
+        elif o == "--queries":
+            try:
+                queries = int(a)
+                if queries < 1:
+                    die(f"ERROR: queries per hop must be positive: {a}")
+            except ValueError:
+                die(f"ERROR: invalid queries per hop value: {a}")
+
+    if parallel and proto != PROTO_UDP:
+        die("ERROR: --parallel is only supported with UDP")
+    if continuous and proto != PROTO_UDP:
+        die("ERROR: --continuous is only supported with UDP")
+    if incremental and (parallel or continuous):
+        die("ERROR: --incremental cannot be combined with --parallel or --continuous")
+    if find_interceptor and proto != PROTO_UDP:
+        die("ERROR: --find-interceptor is only supported with UDP")
+    if find_interceptor and (parallel or continuous or incremental):
+        die("ERROR: --find-interceptor cannot be combined with other trace modes")
+    if servers_file is not None:
+        if dnsserver is not None:
+            die("ERROR: cannot specify both -s and -f")
+        if proto != PROTO_UDP:
+            die("ERROR: -f is only supported with UDP")
+        if continuous or incremental or find_interceptor:
+            die("ERROR: -f cannot be combined with other trace modes")
 
     color = Colors(color_mode)
 
@@ -286,6 +839,18 @@ def main() -> None:
     if not dnsdiag.dns.valid_rdatatype(rdatatype):
         die(f'ERROR: invalid record type "{rdatatype}"')
 
+    if servers_file is not None:
+        servers = load_servers(servers_file, af)
+        if src_ip:
+            parse_ip_address(src_ip)
+        printer = make_hop_printer(servers[0][1], should_resolve, as_lookup, asn_db, color, timeout)
+        try:
+            trace_servers(qname, servers, dest_port, rdatatype, count, timeout, src_ip, use_edns, want_nsid, rate,
+                          printer)
+        finally:
+            printer.close()
+        return
+
     # Use system DNS server if parameter is not specified
     # remember not all systems have /etc/resolv.conf (i.e. Android)
     if dnsserver is None:
@@ -332,15 +897,9 @@ def main() -> None:
     # At this point dnsserver must be set (either from command line or system resolver)
     assert dnsserver is not None
 
-    # Select correct ICMP protocol based on address family
-    if af == socket.AF_INET:
-        icmp_proto = socket.getprotobyname('icmp')
-    else:  # AF_INET6
-        icmp_proto = socket.getprotobyname('ipv6-icmp')
-
     ttl = 1
-    reached = False
-    trace_path = []
+
+    printer = make_hop_printer(dnsserver, should_resolve, as_lookup, asn_db, color, timeout)
 
     if not quiet:
         # Wrap IPv6 addresses in brackets for better readability
@@ -348,158 +907,64 @@ def main() -> None:
         print("%s DNS: %s:%d, hostname: %s, rdatatype: %s" % (__progname__, server_display, dest_port, qname, rdatatype),
               flush=True)
 
-    while True:
-        # Check for shutdown signal
-        if shared.shutdown:
-            break
-
-        # some platforms permit opening a DGRAM socket for ICMP without root permission
-        # if not availble, we will fall back to RAW which explicitly requires root permission
+    if find_interceptor:
         try:
-            icmp_socket = socket.socket(af, socket.SOCK_RAW, icmp_proto)
-        except OSError:
-            try:
-                icmp_socket = socket.socket(af, socket.SOCK_DGRAM, icmp_proto)
-            except OSError:
-                die("ERROR: unable to create ICMP socket with unprivileged user. Please run as root.")
-
-        # Bind socket based on address family
-        if af == socket.AF_INET:
-            icmp_socket.bind(("", dest_port))
-        else:  # AF_INET6
-            icmp_socket.bind(("::", dest_port))
-        icmp_socket.settimeout(timeout)
-
-        curr_addr = None
-
-        with concurrent.futures.ThreadPoolExecutor(max_workers=1) as pool:  # dispatch dns lookup to another thread
-            stime = time.perf_counter()
-            thr = pool.submit(ping, qname, dnsserver, rdatatype, proto, dest_port, ttl, timeout, src_ip=src_ip,
-                              use_edns=use_edns, want_nsid=want_nsid)
-
-            try:  # expect ICMP response
-                packet, curr_addr = icmp_socket.recvfrom(512)
-                # Parse ICMP packet based on address family
-                if af == socket.AF_INET:
-                    # IPv4: IP header (20 bytes) + ICMP header (8 bytes) + IP header (20 bytes) + UDP header
-                    # ICMP Time Exceeded type = 11
-                    if len(packet) > 51:
-                        icmp_type = packet[20]
-                        l4_dst_port = packet[50] << 8 | packet[51]
-                        if icmp_type == 11 and l4_dst_port == dest_port:
-                            curr_addr = curr_addr[0]
-                        else:
-                            curr_addr = None
-                    else:
-                        curr_addr = None
-                else:  # AF_INET6
-                    # IPv6: kernel strips IPv6 header, so we get:
-                    # ICMPv6 header (8 bytes) + Original IPv6 header (40 bytes) + UDP header
-                    # ICMPv6 Time Exceeded type = 3
-                    if len(packet) > 50:
-                        icmp_type = packet[0]
-                        l4_dst_port = packet[50] << 8 | packet[51]
-                        if icmp_type == 3 and l4_dst_port == dest_port:
-                            curr_addr = curr_addr[0]
-                        else:
-                            curr_addr = None
-                    else:
-                        curr_addr = None
-            except OSError:
-                pass
-            except KeyboardInterrupt:
-                shared.shutdown = True
-                break
-            except SystemExit:
-                shared.shutdown = True
-                break
-            finally:
-                etime = time.perf_counter()
-                icmp_socket.close()
+            locate_interceptor(qname, dnsserver, dest_port, rdatatype, count, timeout, af, src_ip, use_edns, color)
+        finally:
+            printer.close()
+        return
 
+    if continuous:
         try:
-            reached, resp_time, nsid_value = thr.result()
-        except SystemExit:
-            shared.shutdown = True
-            break
-        except KeyboardInterrupt:
-            shared.shutdown = True
-            break
+            continuous_trace(qname, dnsserver, dest_port, rdatatype, count, timeout, af, src_ip, use_edns, interval,
+                             printer.ptr_resolver, printer.asn_resolver, color)
+        finally:
+            printer.close()
+        return
 
-        if reached and resp_time is not None:
-            curr_addr = dnsserver
-            elapsed = resp_time
-        else:
-            elapsed = abs(etime - stime) * 1000  # convert to milliseconds
-            nsid_value = None
+    if parallel:
+        try:
+            trace_hops = dnsdiag.trace.parallel_trace(qname, dnsserver, dest_port, rdatatype, count, timeout, af,
+                                                      src_ip=src_ip, use_edns=use_edns, want_nsid=want_nsid)
+        except PermissionError:
+            die("ERROR: unable to create ICMP socket with unprivileged user. Please run as root.")
+        except OSError as e:
+            die(f"ERROR: {e}")
+        for hop in trace_hops:
+            printer.add(hop.ttl, hop.addr, [hop.rtt] if hop.rtt is not None else [], 1, hop.nsid)
+        printer.close()
+        if expert_mode and not shared.shutdown:
+            expert_report(printer.trace_path, color_mode)
+        return
 
-        curr_name = curr_addr
-        if should_resolve:
-            try:
-                if curr_addr:
-                    curr_name = socket.gethostbyaddr(curr_addr)[0]
-            except OSError:
-                curr_name = curr_addr
-            except KeyboardInterrupt:
-                shared.shutdown = True
-                break
-            except SystemExit:
-                shared.shutdown = True
+    try:
+        listener = dnsdiag.trace.IcmpListener(af)
+    except OSError:
+        die("ERROR: unable to create ICMP socket with unprivileged user. Please run as root.")
+
+    # one ICMP receive thread and one worker pool serve the whole trace
+    with listener, concurrent.futures.ThreadPoolExecutor(max_workers=queries) as pool:
+        prober = HopProber(listener, pool, printer, qname, dnsserver, rdatatype, proto, dest_port, timeout, src_ip,
+                           use_edns, want_nsid, queries)
+        if incremental:
+            path_key = "%s:%d/%s" % (dnsserver, dest_port, proto_to_text(proto))
+            incremental_trace(prober, printer, dnsdiag.trace.PathStore(), path_key, count)
+        while not incremental and not shared.shutdown:
+            result = prober.probe(ttl)
+            if result is None:
                 break
-            except Exception:
-                print("unexpected error: ", sys.exc_info()[0])
+            curr_addr, rtts, reached, nsid_value = result
+            printer.add(ttl, curr_addr, rtts, queries, nsid_value)
 
-        # Check for shutdown signal after hostname resolution
-        if shared.shutdown:
-            break
-
-        if curr_addr:
-            as_name = ""
-            if as_lookup:
-                asn, whois_cache = dnsdiag.whois.asn_lookup(curr_addr, whois_cache)
-                as_name = ''
-                try:
-                    if asn and asn.asn != "NA":
-                        as_name = "[AS%s %s] " % (asn.asn, asn.owner)
-                except AttributeError:
-                    if shared.shutdown:
-                        sys.exit(0)
-
-            c = color.N  # default
-            if curr_addr != '*':
-                try:
-                    IP = ipaddress.ip_address(curr_addr)
-                    if IP.is_private:
-                        c = color.R
-                    if IP.is_reserved:
-                        c = color.B
-                    if curr_addr == dnsserver:
-                        c = color.G
-                except Exception:
-                    pass
-
-            nsid_display = ""
-            if nsid_value:
-                nsid_display = "[NSID: %s] " % nsid_value
-
-            print("%d\t%s (%s%s%s) %s%s%.3f ms" % (ttl, curr_name, c, curr_addr, color.N, as_name, nsid_display, elapsed), flush=True)
-            trace_path.append(curr_addr)
-        else:
-            print("%d\t *" % ttl, flush=True)
-            trace_path.append("*")
-
-        ttl += 1
-        hops += 1
-        if (hops >= count) or (curr_addr == dnsserver) or reached:
-            break
+            ttl += 1
+            hops += 1
+            if (hops >= count) or (curr_addr == dnsserver) or reached:
+                break
 
+    printer.close()
     if expert_mode and not shared.shutdown:
-        expert_report(trace_path, color_mode)
+        expert_report(printer.trace_path, color_mode)
 
 
 if __name__ == '__main__':
-    try:
-        whois_cache = dnsdiag.whois.restore()
-        main()
-    finally:
-        dnsdiag.whois.save(whois_cache)
+    main()
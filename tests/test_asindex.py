@@ -0,0 +1,143 @@
+#!/usr/bin/env python3
+
+"""
+Test suite for the offline IP-to-ASN index (no network required)
+"""
+
+import os
+
+import pytest
+
+from dnsdiag.asindex import AsnIndex, IndexResolver, build_index, compile_index, index_cache_path, parse_prefixes
+
+DUMP = """\
+; IP-ASN32-DAT file
+; Original source: test
+10.0.0.0/8\t64500
+10.1.0.0/16\t64501
+10.1.2.0/24\t64502
+10.3.0.0/16\t64503
+192.0.2.0/24|AS64510
+198.51.100.0/24 {64520,64521}
+2001:db8::/32\t64530
+2001:db8:1::/48\t64531
+not-a-prefix\t64599
+203.0.113.0/24\tnot-an-asn
+"""
+
+
+@pytest.fixture
+def index():
+    return AsnIndex(build_index(parse_prefixes(DUMP.splitlines())))
+
+
+class TestParsing:
+    """Test reading pyasn-style and pipe separated dumps"""
+
+    def test_skips_comments_and_garbage(self):
+        prefixes = parse_prefixes(DUMP.splitlines())
+        assert len(prefixes) == 8
+
+    def test_as_prefix_and_as_set(self):
+        prefixes = dict((str(net), asn) for net, asn in parse_prefixes(DUMP.splitlines()))
+        assert prefixes['192.0.2.0/24'] == 64510
+        assert prefixes['198.51.100.0/24'] == 64520
+
+
+class TestLookup:
+    """Test longest-prefix matching"""
+
+    def test_most_specific_wins(self, index):
+        assert index.lookup('10.1.2.3').asn == '64502'
+        assert index.lookup('10.1.2.3').prefix == '10.1.2.0/24'
+        assert index.lookup('10.1.3.1').asn == '64501'
+        assert index.lookup('10.2.0.1').asn == '64500'
+        assert index.lookup('10.3.255.255').asn == '64503'
+        assert index.lookup('10.255.255.255').asn == '64500'
+
+    def test_range_boundaries(self, index):
+        assert index.lookup('10.0.0.0').asn == '64500'
+        assert index.lookup('10.1.1.255').asn == '64501'
+        assert index.lookup('10.1.3.0').asn == '64501'
+        assert index.lookup('9.255.255.255') is None
+        assert index.lookup('11.0.0.0') is None
+
+    def test_ipv6(self, index):
+        assert index.lookup('2001:db8:1::1').asn == '64531'
+        assert index.lookup('2001:db8:2::1').asn == '64530'
+        assert index.lookup('2001:db9::1') is None
+
+    def test_invalid_address(self, index):
+        assert index.lookup('not-an-ip') is None
+
+    def test_duplicate_prefix_last_wins(self):
+        idx = AsnIndex(build_index(parse_prefixes(['192.0.2.0/24 64500', '192.0.2.0/24 64501'])))
+        assert len(idx) == 1
+        assert idx.lookup('192.0.2.1').asn == '64501'
+
+    def test_empty_index(self):
+        idx = AsnIndex(build_index([]))
+        assert len(idx) == 0
+        assert idx.lookup('192.0.2.1') is None
+
+    def test_resolver_future(self, index):
+        resolver = IndexResolver(index)
+        record = resolver.lookup('192.0.2.10').result(timeout=0)
+        assert record.asn == '64510'
+        assert record.owner == ''
+
+
+class TestIndexFile:
+    """Test compiling and memory-mapping index files"""
+
+    def test_compile_and_map(self, tmp_path):
+        source = tmp_path / 'ipasn.dat'
+        source.write_text(DUMP)
+        target = str(tmp_path / 'ipasn.idx')
+        assert compile_index(str(source), target) == 8
+
+        idx = AsnIndex.open(target)
+        try:
+            assert idx.lookup('10.1.2.3').asn == '64502'
+        finally:
+            idx.close()
+
+    def test_open_text_dump_caches_index(self, tmp_path, monkeypatch):
+        monkeypatch.setenv('XDG_CACHE_HOME', str(tmp_path / 'cache'))
+        data = tmp_path / 'data'
+        data.mkdir()
+        source = data / 'ipasn.dat'
+        source.write_text(DUMP)
+        data.chmod(0o555)  # the dump's directory may be read-only
+        try:
+            idx = AsnIndex.open(str(source))
+        finally:
+            data.chmod(0o755)
+        try:
+            assert idx.lookup('2001:db8:1::1').asn == '64531'
+        finally:
+            idx.close()
+        compiled = index_cache_path(str(source))
+        assert os.listdir(data) == ['ipasn.dat'] and os.path.exists(compiled)
+        assert os.path.dirname(compiled) == str(tmp_path / 'cache' / 'dnsdiag')
+
+    def test_changed_dump_is_compiled_again(self, tmp_path, monkeypatch):
+        monkeypatch.setenv('XDG_CACHE_HOME', str(tmp_path / 'cache'))
+        source = tmp_path / 'ipasn.dat'
+        source.write_text(DUMP)
+        AsnIndex.open(str(source)).close()
+        compiled = index_cache_path(str(source))
+        source.write_text(DUMP + '203.0.113.0/24\t64599\n')
+        assert index_cache_path(str(source)) != compiled
+        idx = AsnIndex.open(str(source))
+        try:
+            assert idx.lookup('203.0.113.1').asn == '64599'
+        finally:
+            idx.close()
+
+    def test_rejects_truncated_index(self):
+        data = build_index(parse_prefixes(DUMP.splitlines()))
+        with pytest.raises(ValueError):
+            AsnIndex(data[:-1])
+        with pytest.raises(ValueError):
+            AsnIndex(b'XXXXXXXX' + data[8:])
@@ -0,0 +1,46 @@
+#!/usr/bin/env python3
+
+"""
+Test suite for the client microbenchmark harness (loopback only)
+"""
+
+import importlib.util
+from pathlib import Path
+
+import pytest
+
+BENCH_FILE = Path(__file__).parent.parent / 'benchmarks' / 'bench_client.py'
+
+
+@pytest.fixture(scope='module')
+def bench():
+    spec = importlib.util.spec_from_file_location('bench_client', BENCH_FILE)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+class TestHarness:
+    """Test timing, allocation profiling and comparison"""
+
+    def test_measure(self, bench):
+        result = bench.measure(lambda: sum(range(100)), 1, min_time=0.01, repeat=3)
+        assert result['ops'] > 0 and result['repeat'] == 3
+        assert result['ns_per_op'] > 0 and result['ops_per_cpu_second'] > 0
+
+    def test_allocations_counts_retained_memory(self, bench):
+        kept = []
+        result = bench.allocations(lambda: kept.append(bytearray(1000)), 1, calls=50)
+        assert result['retained_bytes_per_op'] >= 1000
+        assert result['top_sites'][0]['count_diff'] >= 50
+
+    def test_compare_flags_regressions(self, bench):
+        before = {'results': {'a': {'cpu_ns_per_op': 100}, 'b': {'cpu_ns_per_op': 100}, 'c': {'error': 'x'}}}
+        after = {'results': {'a': {'cpu_ns_per_op': 105}, 'b': {'cpu_ns_per_op': 150}, 'c': {'cpu_ns_per_op': 1}}}
+        assert bench.compare(before, after, threshold=10) == ['b']
+
+    def test_run_against_fake_server(self, bench):
+        report = bench.run(['valid_hostname', 'ping_udp'], min_time=0.01, repeat=1, profile_alloc=False)
+        assert set(report['results']) == {'valid_hostname', 'ping_udp'}
+        assert 'error' not in report['results']['ping_udp']
+        assert report['meta']['ping_batch'] == bench.PING_BATCH
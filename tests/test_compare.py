@@ -0,0 +1,76 @@
+#!/usr/bin/env python3
+
+"""
+Test suite for paired server comparison (dnsping with several servers) against fake servers (loopback only)
+"""
+
+import os
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+import dnsping
+from dnsdiag.compare import PairedDifference, median_interval
+from dnsdiag.fakeserver import Delay, FakeServer
+
+DNSPING = Path(__file__).parent.parent / 'dnsping.py'
+
+
+class TestMedianInterval:
+    """Test the distribution-free confidence interval of the median"""
+
+    def test_order_statistics(self):
+        assert median_interval([1.0, 2.0, 3.0, 4.0, 5.0]) is None  # too few for 95%
+        assert median_interval([float(n) for n in range(1, 7)]) == (1.0, 6.0)
+        assert median_interval([float(n) for n in range(20, 0, -1)]) == (6.0, 15.0)
+        assert median_interval([float(n) for n in range(1, 101)]) == (40.0, 61.0)
+
+    def test_long_run(self):
+        assert median_interval([float(n) for n in range(1, 1001)]) == (469.0, 532.0)
+        values = [float(n) for n in range(100000)]
+        start = time.perf_counter()
+        assert median_interval(values) == (49689.0, 50310.0)
+        assert time.perf_counter() - start < 2  # the summary of a long run must not stall after Ctrl-C
+
+
+class TestPairedDifference:
+    """Test pairing rounds and summarising their differences"""
+
+    def test_only_rounds_both_answered(self):
+        difference = PairedDifference([10.0, 12.0, None, 11.0, 9.0], [8.0, None, 5.0, 12.0, 6.0])
+        assert difference.rounds == 5 and difference.differences == [-2.0, 1.0, -3.0]
+        assert difference.median == -2.0 and difference.faster == 2
+        assert difference.interval is None
+
+    def test_unfinished_round(self):
+        assert PairedDifference([1.0, 2.0, 3.0], [2.0, 4.0]).differences == [1.0, 2.0]
+
+    def test_format(self):
+        difference = PairedDifference([10.0] * 8, [7.0, 8.0, 9.0, 8.5, 7.5, 8.0, 11.0, 8.0])
+        assert dnsping.format_comparison('b', difference) == \
+            'b: median difference -2.000 ms (95% CI -3.000 to +1.000 ms) over 8 rounds, faster in 7'
+        assert dnsping.format_comparison('b', PairedDifference([None], [1.0])) == \
+            'b: no round in which both servers answered'
+
+
+class TestInterleaved:
+    """Test dnsping taking turns between two servers"""
+
+    def test_two_servers(self):
+        with FakeServer(ports={'udp': 0}, delay=Delay.parse('20')) as slow:
+            port = slow.ports['udp']
+            with FakeServer('127.0.0.2', ports={'udp': port}):
+                output = subprocess.run([sys.executable, str(DNSPING), '-s', '127.0.0.1', '-s', '127.0.0.2',
+                                         '-p', str(port), '-c', '6', '-i', '0', 'example.com'],
+                                        capture_output=True, text=True, timeout=60,
+                                        env=dict(os.environ, PYTHONPATH=str(DNSPING.parent))).stdout
+        lines = output.splitlines()
+        assert lines[0].startswith('dnsping.py DNS: 127.0.0.1:%d, 127.0.0.2:%d,' % (port, port))
+        assert sum('bytes from 127.0.0.1' in line for line in lines) == 6
+        assert sum('bytes from 127.0.0.2' in line for line in lines) == 6
+        # the first server goes first in odd rounds only
+        replies = [line for line in lines if 'bytes from' in line]
+        assert '127.0.0.1' in replies[0] and '127.0.0.2' in replies[2]
+        comparison = lines[lines.index('--- paired comparison against 127.0.0.1 ---') + 1]
+        assert comparison.startswith('127.0.0.2: median difference -') and comparison.endswith('faster in 6')
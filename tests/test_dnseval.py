@@ -0,0 +1,86 @@
+#!/usr/bin/env python3
+
+"""
+Test suite for dnseval's continuous mode: ranking, change detection and rounds (loopback only)
+"""
+
+import dnseval
+from dnsdiag import shared
+from dnsdiag.dns import PROTO_TCP, PingResponse, Prober
+from dnsdiag.fakeserver import FakeServer
+from dnsdiag.shared import Colors
+
+
+def _response(r_avg, r_lost_percent=0.0):
+    retval = PingResponse()
+    retval.r_avg = r_avg
+    retval.r_lost_percent = r_lost_percent
+    return retval
+
+
+class TestRanking:
+    """Test ranking servers and spotting what changed between rounds"""
+
+    def test_rank_by_loss_then_latency(self):
+        ranks = dnseval.rank_results({
+            'slow': _response(30.0),
+            'fast': _response(10.0),
+            'lossy': _response(5.0, 20.0),
+            'dead': _response(0.0, 100.0),
+            'broken': 'broken: connection refused',
+        })
+        assert ranks == {'fast': (1, 10.0, 0.0), 'slow': (2, 30.0, 0.0), 'lossy': (3, 5.0, 20.0)}
+
+    def test_changes(self):
+        previous = {'a': (1, 10.0, 0.0), 'b': (2, 20.0, 0.0), 'c': (3, 30.0, 0.0), 'gone': (4, 40.0, 0.0)}
+        current = {'a': (1, 12.0, 0.0), 'b': (2, 20.0, 10.0), 'c': (3, 40.0, 0.0), 'new': (4, 50.0, 0.0)}
+        servers = ['a', 'b', 'c', 'new', 'gone']
+        assert dnseval.rank_changes(previous, current, servers, threshold=5) == ['b', 'c', 'new', 'gone']
+        assert dnseval.rank_changes(previous, current, servers, threshold=1) == ['a', 'b', 'c', 'new', 'gone']
+        assert dnseval.rank_changes(previous, previous, list(previous), threshold=0) == []
+
+    def test_rank_swap(self):
+        previous = {'a': (1, 10.0, 0.0), 'b': (2, 11.0, 0.0)}
+        current = {'a': (2, 11.0, 0.0), 'b': (1, 10.0, 0.0)}
+        assert dnseval.rank_changes(previous, current, ['a', 'b'], threshold=5) == ['a', 'b']
+
+
+class TestFormatDelta:
+    """Test the lines printed for servers that changed"""
+
+    def test_change(self):
+        line = dnseval.format_delta('a', (2, 10.0, 0.0), (1, 8.5, 5.0), 3, Colors(False))
+        assert line.endswith('  a     rank=2 -> 1  avg=10.00 -> 8.50 ms  lost=0% -> 5%')
+
+    def test_new_unreachable_and_removed(self):
+        color = Colors(False)
+        assert dnseval.format_delta('a', None, (3, 8.5, 0.0), 1, color).endswith('new  rank=3  avg=8.50 ms  lost=0%')
+        assert dnseval.format_delta('a', (3, 8.5, 0.0), None, 1, color).endswith('unreachable')
+        assert dnseval.format_delta('a', (3, 8.5, 0.0), None, 1, color, removed=True).endswith('removed')
+
+
+class TestProbeRound:
+    """Test rounds sent through a prober kept across rounds"""
+
+    def test_rounds_share_the_connection(self):
+        with FakeServer(ports={'tcp': 0}) as server, \
+                Prober('127.0.0.1', 'example.com', proto=PROTO_TCP, port=server.ports['tcp']) as prober:
+            first = dnseval.probe_round('127.0.0.1', prober, 3)
+            sock = prober._sock
+            second = dnseval.probe_round('127.0.0.1', prober, 2)
+            assert prober._sock is sock and prober.sent == 2  # aggregates start afresh
+        assert first.r_lost_percent == second.r_lost_percent == 0
+        assert first.rcode_text == 'NOERROR' and first.response is None
+
+    def test_error(self):
+        with FakeServer(ports={'tcp': 0}) as server:
+            port = server.ports['tcp']
+        with Prober('127.0.0.1', 'example.com', proto=PROTO_TCP, port=port) as prober:
+            assert dnseval.probe_round('127.0.0.1', prober, 2).startswith('127.0.0.1: ConnectionRefusedError')
+
+    def test_shutdown_ends_the_round(self, monkeypatch):
+        with FakeServer(ports={'tcp': 0}) as server, \
+                Prober('127.0.0.1', 'example.com', proto=PROTO_TCP, port=server.ports['tcp']) as prober:
+            monkeypatch.setattr(shared, 'shutdown', True)
+            dnseval.probe_round('127.0.0.1', prober, 100)
+            assert prober.sent == 0
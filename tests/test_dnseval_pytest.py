@@ -302,6 +302,24 @@ class TestCLIParameterValidation:
         assert not result.success, "Hostname with @ should fail"
         assert "invalid hostname" in result.output.lower()
 
+    def test_invalid_every_zero(self, runner):
+        """Test handling of zero continuous-mode interval"""
+        result = runner.run(['--every', '0', 'google.com'])
+        assert not result.success, "Zero interval should fail"
+        assert "positive" in result.output.lower()
+
+    def test_invalid_every_non_numeric(self, runner):
+        """Test handling of non-numeric continuous-mode interval"""
+        result = runner.run(['--every', 'abc', 'google.com'])
+        assert not result.success, "Non-numeric interval should fail"
+        assert "invalid interval" in result.output.lower()
+
+    def test_invalid_threshold_negative(self, runner):
+        """Test handling of negative delta threshold"""
+        result = runner.run(['--threshold', '-1', 'google.com'])
+        assert not result.success, "Negative threshold should fail"
+        assert "Traceback" not in result.output, "Should not show Python traceback"
+
 
 class TestJSONOutput:
     """Tests for JSON output functionality"""
@@ -0,0 +1,98 @@
+#!/usr/bin/env python3
+
+"""
+Test suite for dnsping's reply lines and --json records (loopback only)
+"""
+
+import json
+import os
+import subprocess
+import sys
+from pathlib import Path
+
+import dns.edns
+import dns.flags
+import dns.message
+import dns.rrset
+
+import dnsping
+from dnsdiag.dns import TLS_FULL, TLS_REUSED, WireResponse
+from dnsdiag.fakeserver import FakeServer
+
+DNSPING = Path(__file__).parent.parent / 'dnsping.py'
+
+
+def _response(options=None):
+    query = dns.message.make_query('example.com', 'A', use_edns=True, want_dnssec=True)
+    response = dns.message.make_response(query)
+    if options:
+        response.use_edns(0, dns.flags.DO, options=options)
+    response.answer.append(dns.rrset.from_text('example.com.', 300, 'IN', 'A', '192.0.2.1'))
+    return WireResponse(response.to_wire())
+
+
+class TestFormatReply:
+    """Test the per-reply line printed by dnsping"""
+
+    def test_plain(self):
+        line = dnsping.format_reply(_response(), 56, '127.0.0.1', 3, 1.5)
+        assert line == '56  bytes from 127.0.0.1: seq=3   time=1.500   ms  NOERROR'
+
+    def test_extras(self):
+        line = dnsping.format_reply(_response(), 56, '127.0.0.1', 1, 1.5, show_ttl=True, show_flags=True,
+                                    want_dnssec=True, show_answer=True)
+        assert line.endswith(' NOERROR [TTL=300 ] [QR RD --] [RDATA: A 192.0.2.1]')
+
+    def test_tls_state(self):
+        assert dnsping.format_reply(_response(), 56, 'h', 1, 1.0, tls_state=TLS_REUSED).endswith('[TLS: reused]')
+        assert dnsping.format_reply(_response(), 56, 'h', 1, 1.0, tls_state=TLS_FULL,
+                                    handshake=2.5).endswith('[TLS: full, handshake=2.500 ms]')
+
+
+class TestJsonRecords:
+    """Test the records streamed by dnsping --json"""
+
+    def test_reply(self):
+        answers = _response([dns.edns.NSIDOption(b'ns1')])
+        record = dnsping.reply_record(answers, len(answers), '127.0.0.1', 4, 1.23456, 1700000000.5,
+                                      tls_state=TLS_REUSED)
+        assert record == {
+            'type': 'reply', 'timestamp': 1700000000.5, 'server': '127.0.0.1', 'seq': 4, 'rtt': 1.235,
+            'rcode': 'NOERROR', 'size': len(answers), 'flags': 'QR RD', 'ednsflags': 'DO', 'ttl': 300,
+            'options': [{'code': 3, 'name': 'NSID', 'data': '6e7331', 'text': 'NSID ns1'}], 'tls': 'reused',
+        }
+        json.dumps(record)
+
+    def test_lost_and_summary(self):
+        assert dnsping.lost_record('h', 2, 1.0) == {'type': 'lost', 'timestamp': 1.0, 'server': 'h', 'seq': 2,
+                                                    'error': 'no response'}
+        summary = dnsping.summary_record('h', 4, 3, 25.0, 1.0, 2.0, 3.0, 1.0, phases={'wait': 1.23456})
+        assert summary['sent'] == 4 and summary['lost_percent'] == 25.0 and summary['phases'] == {'wait': 1.235}
+
+    def test_stream(self):
+        with FakeServer() as server:
+            output = subprocess.run([sys.executable, str(DNSPING), '-s', '127.0.0.1', '-p', str(server.ports['udp']),
+                                     '-c', '3', '-i', '0', '-j', '-', 'example.com'],
+                                    capture_output=True, text=True, timeout=60,
+                                    env=dict(os.environ, PYTHONPATH=str(DNSPING.parent))).stdout
+        records = [json.loads(line) for line in output.splitlines()]  # nothing but records
+        assert [record['type'] for record in records] == ['reply', 'reply', 'reply', 'summary']
+        assert [record['seq'] for record in records[:3]] == [1, 2, 3]
+        assert records[-1]['received'] == 3
+
+    def test_lost_reason(self):
+        with FakeServer(loss=1.0) as server:
+            output = subprocess.run([sys.executable, str(DNSPING), '-s', '127.0.0.1', '-p', str(server.ports['udp']),
+                                     '-c', '1', '-w', '1', '-j', '-', 'example.com'],
+                                    capture_output=True, text=True, timeout=60,
+                                    env=dict(os.environ, PYTHONPATH=str(DNSPING.parent))).stdout
+        lost = json.loads(output.splitlines()[0])
+        assert lost['type'] == 'lost' and lost['error'] == 'Request timeout'
+
+    def test_unwritable_file(self, tmp_path):
+        output = subprocess.run([sys.executable, str(DNSPING), '-s', '127.0.0.1', '-c', '1',
+                                 '-j', str(tmp_path / 'missing' / 'x.json'), 'example.com'],
+                                capture_output=True, text=True, timeout=60,
+                                env=dict(os.environ, PYTHONPATH=str(DNSPING.parent)))
+        assert output.returncode == 1 and output.stdout == ''
+        assert output.stderr.startswith('ERROR: cannot write ') and 'Traceback' not in output.stderr
@@ -13,6 +13,7 @@ Usage:
     pytest tests/test_dnstraceroute_pytest.py::TestBasicFunctionality
 """
 
+import signal
 import subprocess
 import sys
 import pytest
@@ -234,6 +235,67 @@ class TestCLIOptions:
         assert result.has_hops
 
 
+class TestParallelMode:
+    """Tests for parallel TTL probing"""
+
+    def test_parallel_trace(self, runner):
+        """Test that a parallel trace reaches the resolver"""
+        result = runner.run(['--parallel', '-n', '-s', '8.8.8.8', 'google.com'])
+        assert result.success, f"Parallel trace failed: {result.error}"
+        assert '8.8.8.8' in result.output
+
+
+class TestContinuousMode:
+    """Tests for mtr-style continuous tracing"""
+
+    def test_continuous_until_interrupted(self, runner):
+        """Test that rolling statistics are printed until CTRL+C"""
+        cmd = [sys.executable, runner.dnstraceroute_path, '--continuous', '--interval', '0.5', '-n',
+               '-s', '8.8.8.8', 'google.com']
+        proc = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True)
+        time.sleep(3)
+        proc.send_signal(signal.SIGINT)
+        output, _ = proc.communicate(timeout=10)
+        assert proc.returncode == 0, f"Continuous trace failed: {output}"
+        assert 'Loss%' in output
+        assert '8.8.8.8' in output
+
+
+class TestInterceptorLocator:
+    """Tests for the TTL binary search for intercepting DNS proxies"""
+
+    def test_find_interceptor(self, runner):
+        """Test that the first answering hop is reported"""
+        result = runner.run(['--find-interceptor', '-s', '8.8.8.8', 'google.com'])
+        assert result.success, f"Interceptor search failed: {result.error}"
+        assert 'DNS responses start at hop' in result.output
+
+
+class TestServerList:
+    """Tests for tracing a list of servers at once"""
+
+    def test_trace_server_list(self, runner, tmp_path):
+        """Test that every listed server gets a path and the shared hops are summarised"""
+        server_list = tmp_path / 'servers.txt'
+        server_list.write_text('# resolvers\n8.8.8.8\n1.1.1.1\n')
+        result = runner.run(['-f', str(server_list), '-n', 'google.com'])
+        assert result.success, f"Server list trace failed: {result.error}"
+        assert 'DNS: 8.8.8.8:53' in result.output
+        assert 'DNS: 1.1.1.1:53' in result.output
+        assert 'Shared hops' in result.output
+
+
+class TestMultipleProbes:
+    """Tests for multiple probes per hop"""
+
+    def test_queries_per_hop(self, runner):
+        """Test that per-hop statistics are shown with several probes"""
+        result = runner.run(['--queries', '3', '-n', '-c', '3', '-s', '8.8.8.8', 'google.com'])
+        assert result.success, f"Trace failed: {result.error}"
+        assert result.has_hops
+        assert 'loss=' in result.output or '*' in result.output
+
+
 class TestSourceIPValidation:
     """Tests for source IP address validation"""
 
@@ -359,6 +421,60 @@ class TestCLIParameterValidation:
         result = runner.run([''])
         assert not result.success, "Empty hostname should fail"
 
+    def test_invalid_queries_zero(self, runner):
+        """Test handling of zero probes per hop"""
+        result = runner.run(['--queries', '0', '-s', '8.8.8.8', 'google.com'])
+        assert not result.success, "Zero queries per hop should fail"
+        assert "positive" in result.output.lower()
+
+    def test_parallel_requires_udp(self, runner):
+        """Test that --parallel is rejected for non-UDP transports"""
+        result = runner.run(['--parallel', '-T', '-s', '8.8.8.8', 'google.com'])
+        assert not result.success, "--parallel with TCP should fail"
+        assert "only supported with UDP" in result.output
+
+    def test_continuous_requires_udp(self, runner):
+        """Test that --continuous is rejected for non-UDP transports"""
+        result = runner.run(['--continuous', '-T', '-s', '8.8.8.8', 'google.com'])
+        assert not result.success, "--continuous with TCP should fail"
+        assert "only supported with UDP" in result.output
+
+    def test_find_interceptor_requires_udp(self, runner):
+        """Test that --find-interceptor is rejected for non-UDP transports"""
+        result = runner.run(['--find-interceptor', '-T', '-s', '8.8.8.8', 'google.com'])
+        assert not result.success, "--find-interceptor with TCP should fail"
+        assert "only supported with UDP" in result.output
+
+    def test_file_and_server_conflict(self, runner):
+        """Test that -f cannot be combined with -s"""
+        result = runner.run(['-f', 'rootservers.txt', '-s', '8.8.8.8', 'google.com'])
+        assert not result.success, "-f with -s should fail"
+        assert "cannot specify both -s and -f" in result.output
+
+    def test_invalid_rate(self, runner):
+        """Test that a non-positive probe rate is rejected"""
+        result = runner.run(['-f', 'rootservers.txt', '--rate', '0', 'google.com'])
+        assert not result.success, "zero rate should fail"
+        assert "probe rate must be positive" in result.output
+
+    def test_incremental_excludes_parallel(self, runner):
+        """Test that --incremental cannot be combined with --parallel"""
+        result = runner.run(['--incremental', '--parallel', '-s', '8.8.8.8', 'google.com'])
+        assert not result.success, "--incremental with --parallel should fail"
+        assert "cannot be combined" in result.output
+
+    def test_invalid_interval(self, runner):
+        """Test that a non-positive interval is rejected"""
+        result = runner.run(['--continuous', '--interval', '0', '-s', '8.8.8.8', 'google.com'])
+        assert not result.success, "zero interval should fail"
+        assert "interval must be positive" in result.output
+
+    def test_missing_asn_db(self, runner):
+        """Test that an unreadable --asn-db file is reported"""
+        result = runner.run(['--asn-db', '/nonexistent/ipasn.dat', '-s', '8.8.8.8', 'google.com'])
+        assert not result.success, "missing ASN database should fail"
+        assert "cannot load ASN database" in result.output
+
 
 class TestRegressionBugs:
     """Tests for specific regression bugs and fixes"""
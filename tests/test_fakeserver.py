@@ -0,0 +1,148 @@
+#!/usr/bin/env python3
+
+"""
+Test suite for the bundled fake DNS server (loopback only, no network required)
+"""
+
+import random
+import time
+
+import dns.edns
+import dns.exception
+import dns.flags
+import dns.message
+import dns.query
+import dns.rcode
+import dns.rdatatype
+import pytest
+
+from dnsdiag.dns import DohSession, TlsSession, tcp_exchange, udp_exchange
+from dnsdiag.fakeserver import Delay, FakeServer, TokenBucket
+
+
+def _query(name='example.com', rdtype='A', **kwargs):
+    return dns.message.make_query(name, rdtype, **kwargs)
+
+
+@pytest.fixture(scope='module')
+def server():
+    with FakeServer(ports={'udp': 0, 'tcp': 0, 'tls': 0, 'https': 0, 'quic': 0}) as fake:
+        yield fake
+
+
+class TestTransports:
+    """Test that every transport answers from the zone"""
+
+    def test_udp_and_tcp_share_a_port(self, server):
+        assert server.ports['udp'] == server.ports['tcp']
+        for exchange in (udp_exchange, tcp_exchange):
+            response = exchange(_query(), '127.0.0.1', 2, port=server.ports['udp']).message()
+            assert response.answer[0][0].address == '192.0.2.1'
+
+    def test_tls(self, server):
+        session = TlsSession(verify=server.certfile, alpns=['dot'])
+        sock, _ = session.connect('127.0.0.1', server.ports['tls'], 2)
+        with sock:
+            response = dns.query.tls(_query(), '127.0.0.1', timeout=2, sock=sock)
+        assert response.rcode() == dns.rcode.NOERROR
+        assert response.answer
+
+    def test_https(self, server):
+        session = DohSession(timeout=2, verify=False)
+        try:
+            response = session.query(_query(), '127.0.0.1', 2, port=server.ports['https']).message()
+        finally:
+            session.close()
+        assert response.answer[0][0].address == '192.0.2.1'
+
+    def test_quic(self, server):
+        response = dns.query.quic(_query(), '127.0.0.1', timeout=5, port=server.ports['quic'], verify=server.certfile)
+        assert response.answer[0][0].address == '192.0.2.1'
+
+
+class TestZone:
+    """Test authoritative answers from the built-in zone"""
+
+    def _ask(self, server, name, rdtype='A', **kwargs):
+        return udp_exchange(_query(name, rdtype, **kwargs), '127.0.0.1', 2, port=server.ports['udp']).message()
+
+    def test_rcodes(self, server):
+        assert self._ask(server, 'nosuchname.example.com').rcode() == dns.rcode.NXDOMAIN
+        assert self._ask(server, 'example.org').rcode() == dns.rcode.REFUSED
+        nodata = self._ask(server, 'mail.example.com', 'AAAA')
+        assert nodata.rcode() == dns.rcode.NOERROR and not nodata.answer and nodata.authority
+
+    def test_cname_is_followed(self, server):
+        response = self._ask(server, 'www.example.com')
+        assert response.flags & dns.flags.AA
+        assert [rrset.rdtype for rrset in response.answer] == [dns.rdatatype.CNAME, dns.rdatatype.A]
+
+    def test_nsid(self, server):
+        response = self._ask(server, 'example.com', use_edns=0, options=[dns.edns.NSIDOption(b'')])
+        assert response.options[0].nsid == b'dnsdiag-fakeserver'
+
+    def test_large_answer_truncated_over_udp_only(self, server):
+        response = self._ask(server, 'big.example.com', 'TXT')
+        assert response.flags & dns.flags.TC and not response.answer
+        full = tcp_exchange(_query('big.example.com', 'TXT'), '127.0.0.1', 2, port=server.ports['tcp']).message()
+        assert len(full.answer[0]) == 8
+
+
+class TestImpairments:
+    """Test delay, loss, truncation and rate limiting"""
+
+    def test_fixed_delay(self):
+        with FakeServer(delay=Delay.parse('50')) as fake:
+            start = time.perf_counter()
+            udp_exchange(_query(), '127.0.0.1', 2, port=fake.ports['udp'])
+            assert time.perf_counter() - start >= 0.05
+
+    def test_loss(self):
+        with FakeServer(loss=1.0) as fake:
+            with pytest.raises(dns.exception.Timeout):
+                udp_exchange(_query(), '127.0.0.1', 0.2, port=fake.ports['udp'])
+            assert fake.counters['lost'] == 1
+
+    def test_forced_truncation(self):
+        with FakeServer(truncate=1.0) as fake:
+            response = udp_exchange(_query(), '127.0.0.1', 2, port=fake.ports['udp']).message()
+            assert response.flags & dns.flags.TC
+            assert tcp_exchange(_query(), '127.0.0.1', 2, port=fake.ports['tcp']).message().answer
+
+    def test_rate_limit(self):
+        with FakeServer(rate=1, burst=2) as fake:
+            answered = 0
+            for _ in range(4):
+                try:
+                    udp_exchange(_query(), '127.0.0.1', 0.2, port=fake.ports['udp'])
+                    answered += 1
+                except dns.exception.Timeout:
+                    pass
+            assert answered == 2
+            assert fake.counters['limited'] == 2
+
+    def test_token_bucket_refills(self):
+        bucket = TokenBucket(rate=1000, burst=1)
+        assert bucket.admit() and not bucket.admit()
+        time.sleep(0.01)
+        assert bucket.admit()
+
+
+class TestDelay:
+    """Test delay specs and distributions"""
+
+    def test_parse(self):
+        assert Delay.parse('5').sample(random.Random()) == 0.005
+        assert Delay.parse('fixed:5').sample(random.Random()) == 0.005
+        assert 0.001 <= Delay.parse('uniform:1,3').sample(random.Random()) <= 0.003
+        assert Delay.parse('normal:5,100').sample(random.Random(1)) >= 0
+
+    def test_seeded_samples_repeat(self):
+        delay = Delay.parse('exp:10')
+        first, second = random.Random(7), random.Random(7)
+        assert [delay.sample(first) for _ in range(5)] == [delay.sample(second) for _ in range(5)]
+
+    @pytest.mark.parametrize('spec', ['gamma:1', 'uniform:1', 'fixed:-1', 'fixed:abc'])
+    def test_invalid(self, spec):
+        with pytest.raises(ValueError):
+            Delay.parse(spec)
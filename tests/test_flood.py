@@ -0,0 +1,237 @@
+#!/usr/bin/env python3
+
+"""
+Test suite for load generation (dnsping --window and --capacity) against the fake server (loopback only)
+"""
+
+import socket
+import threading
+import time
+
+import dns.message
+import pytest
+
+import dnsping
+from dnsdiag.capacity import (
+    SEARCH_AIMD,
+    SEARCH_STEP,
+    CapacityStep,
+    Slo,
+    search_capacity,
+)
+from dnsdiag.dns import (
+    MAX_WINDOW,
+    PROTO_QUIC,
+    PROTO_TCP,
+    PROTO_TLS,
+    PROTO_UDP,
+    Flood,
+    FloodResult,
+    TlsSession,
+)
+from dnsdiag.fakeserver import Delay, FakeServer
+
+
+@pytest.fixture(scope='module')
+def server():
+    with FakeServer(ports={'udp': 0, 'tcp': 0, 'tls': 0}) as server:
+        yield server
+
+
+def _closed_port():
+    with socket.create_server(('127.0.0.1', 0)) as listener:
+        return listener.getsockname()[1]
+
+
+class TestFlood:
+    """Test the closed-loop sender over each transport"""
+
+    @pytest.mark.parametrize('proto, transport', [(PROTO_UDP, 'udp'), (PROTO_TCP, 'tcp'), (PROTO_TLS, 'tls')])
+    def test_all_answered(self, server, proto, transport):
+        tls = TlsSession(verify=False, alpns=['dot'])
+        query = dns.message.make_query('example.com', 'A')
+        result = Flood('127.0.0.1', query, proto, port=server.ports[transport], window=8, tls=tls).run(200)
+        assert result.sent == result.received == len(result.rtts) == 200
+        assert result.lost == 0 and result.rcodes == {'NOERROR': 200}
+        assert result.qps > 0 and result.percentile(50) <= result.percentile(99)
+
+    def test_fresh_query_each_time(self, server):
+        names = []
+
+        def make_query():
+            names.append('q%d.example.com' % len(names))
+            return dns.message.make_query(names[-1], 'A')
+
+        result = Flood('127.0.0.1', make_query, PROTO_UDP, port=server.ports['udp'], window=4).run(20)
+        assert len(names) == 20 and result.rcodes == {'NXDOMAIN': 20}
+
+    def test_loss(self):
+        query = dns.message.make_query('example.com', 'A')
+        with FakeServer(loss=0.5, seed=1) as lossy:
+            result = Flood('127.0.0.1', query, port=lossy.ports['udp'], window=16, timeout=0.2).run(100)
+        assert result.sent == 100 and result.received + result.lost == 100
+        assert 20 < result.lost_percent < 80
+
+    def test_stop_abandons_queries_in_flight(self, server):
+        query = dns.message.make_query('example.com', 'A')
+        calls = []
+        result = Flood('127.0.0.1', query, port=server.ports['udp'], window=4).run(
+            stop=lambda: calls.append(1) or len(calls) > 50)
+        assert result.sent == result.received + result.lost and result.received > 0
+
+    def test_offered_rate(self, server):
+        query = dns.message.make_query('example.com', 'A')
+        result = Flood('127.0.0.1', query, port=server.ports['udp'], window=100).run(50, rate=250)
+        assert result.received == 50 and result.rate == 250
+        assert 0.18 < result.send_span < 0.5  # 49 intervals of 4 ms, unless the client fell behind
+        assert result.sent_qps <= 250.1
+
+    def test_transport_and_window_checked(self):
+        query = dns.message.make_query('example.com', 'A')
+        with pytest.raises(ValueError):
+            Flood('127.0.0.1', query, PROTO_QUIC)
+        with pytest.raises(ValueError):
+            Flood('127.0.0.1', query, window=0)
+        with pytest.raises(ValueError):
+            Flood('127.0.0.1', query, window=MAX_WINDOW + 1)  # more than there are IDs
+
+    def test_connection_refused(self):
+        query = dns.message.make_query('example.com', 'A')
+        result = Flood('127.0.0.1', query, PROTO_TCP, port=_closed_port(), window=4).run(10)
+        assert result.sent == 0 and 'refused' in result.error
+
+    def test_server_drops_then_refuses(self):
+        listener = socket.create_server(('127.0.0.1', 0))
+        port = listener.getsockname()[1]
+
+        def serve():
+            conn, _ = listener.accept()
+            conn.recv(2)
+            listener.close()  # nobody to reconnect to
+            conn.close()
+
+        thread = threading.Thread(target=serve)
+        thread.start()
+        query = dns.message.make_query('example.com', 'A')
+        result = Flood('127.0.0.1', query, PROTO_TCP, port=port, window=4).run(100)
+        thread.join()
+        # sends after the server hung up may fail at once, so fewer than the window can go out
+        assert 0 < result.sent == result.lost <= 4 and result.received == 0
+        assert 'refused' in result.error and 'run ended early' in dnsping.format_flood(result)
+
+
+class TestFloodResult:
+    """Test percentiles and the dnsping summary"""
+
+    def test_nearest_rank_percentile(self):
+        result = FloodResult(1)
+        result.rtts.extend(float(n) for n in range(1, 101))
+        assert result.percentile(50) == 50.0 and result.percentile(99) == 99.0
+        assert result.percentile(99.9) == 100.0 and result.percentile(0) == 1.0
+        assert FloodResult(1).percentile(50) == 0.0
+
+    def test_summary(self):
+        result = FloodResult(16)
+        result.sent, result.received, result.lost, result.duration = 4, 3, 1, 0.5
+        result.rtts.extend([1.0, 2.0, 3.0])
+        result.rcodes = {'NOERROR': 2, 'SERVFAIL': 1}
+        summary = dnsping.format_flood(result)
+        assert '4 requests transmitted, 3 responses received, 25% lost' in summary
+        assert 'p50=2.000 ms, p90=3.000 ms' in summary
+        assert 'throughput: 6.0 queries/s with 16 in flight over 0.500 s' in summary
+        assert summary.endswith('rcodes: NOERROR=2, SERVFAIL=1')
+
+
+def _result(rtts, sent=None):
+    result = FloodResult(1, 100)
+    result.rtts.extend(rtts)
+    result.received = len(rtts)
+    result.sent = sent if sent is not None else len(rtts)
+    result.lost = result.sent - result.received
+    return result
+
+
+class TestSlo:
+    """Test parsing and checking latency and loss objectives"""
+
+    def test_parse(self):
+        assert Slo.parse('p99=100,loss=1').limits == {'p99': 100.0, 'loss': 1.0}
+        assert Slo.parse(' p50=20 , p99.9=250').limits == {'p50': 20.0, 'p99.9': 250.0}
+        for text in ('p98=3', 'p99', 'loss=x', 'p50=-1', ''):
+            with pytest.raises(ValueError):
+                Slo.parse(text)
+
+    def test_breaches(self):
+        slo = Slo.parse('p50=5,loss=10')
+        assert slo.breaches(_result([1.0, 2.0, 3.0])) == []
+        assert slo.breaches(_result([1.0, 9.0, 9.0], sent=4)) == ['p50=9.000 ms > 5 ms', 'loss=25.000% > 10%']
+        assert str(slo) == 'p50 <= 5 ms, loss <= 10%'
+
+
+class TestCapacity:
+    """Test the step and AIMD searches"""
+
+    def test_step_search_stops_at_first_break(self):
+        query = dns.message.make_query('example.com', 'A')
+        with FakeServer(delay=Delay.parse('20')) as slow:
+            flood = Flood('127.0.0.1', query, port=slow.ports['udp'], window=1000)
+            report = search_capacity(flood, Slo.parse('p50=10'), SEARCH_STEP, start=50, step=50, step_time=0.1)
+        assert len(report.steps) == 1 and report.sustainable == 0.0
+        assert report.steps[0].breaches[0].startswith('p50=')
+
+    def test_step_search_reaches_max(self, server):
+        flood = Flood('127.0.0.1', dns.message.make_query('example.com', 'A'), port=server.ports['udp'], window=100)
+        steps = []
+        report = search_capacity(flood, Slo.parse('loss=50'), SEARCH_STEP, start=50, step=50, max_rate=100,
+                                 step_time=0.2, on_step=steps.append)
+        assert [step.rate for step in report.steps] == [50, 100] and steps == report.steps
+        assert report.sustainable == 100
+        curve = report.to_dict()
+        assert curve['search'] == 'step' and curve['sustainable_qps'] == 100
+        assert curve['steps'][0]['slo_met'] and curve['steps'][0]['sent'] == 10
+
+    def test_aimd_backs_off_after_a_break(self, monkeypatch):
+        rates = []
+
+        def fake_run(self, count, stop=None, rate=0.0):
+            rates.append(rate)
+            return _result([1.0] * count if rate < 300 else [100.0] * count)
+
+        monkeypatch.setattr(Flood, 'run', fake_run)
+        flood = Flood('127.0.0.1', dns.message.make_query('example.com', 'A'))
+        report = search_capacity(flood, Slo.parse('p99=10'), SEARCH_AIMD, start=100, step=100, step_time=1)
+        assert rates[:4] == [100, 200, 300, 225]  # a quarter off, then half the step
+        assert sum(not step.met for step in report.steps) == 3
+        assert report.sustainable == 293.75  # 243.75 + 2 * 25, just below the break at 300
+
+    def test_refusing_server_breaks_a_step(self):
+        flood = Flood('127.0.0.1', dns.message.make_query('example.com', 'A'), PROTO_TCP, port=_closed_port())
+        report = search_capacity(flood, Slo.parse('loss=1'), SEARCH_AIMD, start=50, step_time=0.1)
+        assert len(report.steps) == 3 and report.sustainable == 0.0  # backed off until MAX_BREAKS
+        assert report.steps[0].breaches == ['connection failed: %s' % report.steps[0].result.error]
+
+    def test_full_window_blames_the_server(self):
+        query = dns.message.make_query('example.com', 'A')
+        with FakeServer(delay=Delay.parse('50')) as slow:
+            # two queries in flight answered in 50 ms allow about 40 qps
+            flood = Flood('127.0.0.1', query, port=slow.ports['udp'], window=2)
+            report = search_capacity(flood, Slo.parse('loss=50'), SEARCH_STEP, start=200, step_time=0.3)
+        result = report.steps[0].result
+        assert result.sent_qps < 100 and result.window_wait > 0.5
+        assert len(report.steps) == 1 and report.steps[0].breaches[0].startswith('window full, sent ')
+
+    def test_slow_sender_is_the_client(self, server):
+        def make_query():
+            time.sleep(0.02)  # no more than 50 qps
+            return dns.message.make_query('example.com', 'A')
+
+        flood = Flood('127.0.0.1', make_query, port=server.ports['udp'], window=10)
+        report = search_capacity(flood, Slo.parse('loss=50'), SEARCH_STEP, start=200, step_time=0.2)
+        assert report.steps[0].result.window_wait < 0.05
+        assert len(report.steps) == 1 and report.steps[0].breaches[0].startswith('client sent ')
+
+    def test_format_step(self):
+        step = CapacityStep(200, _result([1.0, 2.0]), ['p99=2.000 ms > 1 ms'], unreliable='cpu=95%')
+        line = dnsping.format_step(step)
+        assert line.startswith('offered 200 qps: ')
+        assert line.endswith('SLO broken (p99=2.000 ms > 1 ms)  [client saturated]')
@@ -0,0 +1,84 @@
+#!/usr/bin/env python3
+
+"""
+Test suite for client overhead calibration and the saturation watchdog (loopback only)
+"""
+
+import time
+
+import dns.flags
+import dns.message
+
+from dnsdiag.dns import (
+    PROTO_HTTPS,
+    PROTO_QUIC,
+    PROTO_TCP,
+    PROTO_TLS,
+    PROTO_UDP,
+    ping,
+    udp_exchange,
+)
+from dnsdiag.fakeserver import FakeServer
+from dnsdiag.overhead import (
+    MAX_LAG,
+    Watchdog,
+    WatchdogReport,
+    calibrate,
+    plain_transport,
+)
+
+
+class TestCalibration:
+    """Test loopback calibration and subtracting it"""
+
+    def test_plain_transport(self):
+        assert plain_transport(PROTO_UDP) == PROTO_UDP
+        assert plain_transport(PROTO_QUIC) == PROTO_UDP
+        assert plain_transport(PROTO_TLS) == PROTO_TCP
+        assert plain_transport(PROTO_HTTPS) == PROTO_TCP
+
+    def test_calibrate(self):
+        for proto in (PROTO_UDP, PROTO_TCP):
+            overhead = calibrate(proto, count=5)
+            assert 0 < overhead < 100
+
+    def test_reflecting_server(self):
+        with FakeServer(reflect=True) as server:
+            query = dns.message.make_query('anything.invalid', 'A')
+            response = udp_exchange(query, '127.0.0.1', 2, port=server.ports['udp']).message()
+        assert response.id == query.id and response.flags & dns.flags.QR
+        assert response.question == query.question and not response.answer
+
+    def test_ping_subtracts_overhead(self):
+        with FakeServer() as server:
+            result = ping('example.com', '127.0.0.1', server.ports['udp'], 'A', 2, 3, PROTO_UDP, None,
+                          overhead=1000.0)
+        assert result.r_lost_percent == 0
+        assert result.r_min == result.r_avg == result.r_max == 0.0
+
+
+class TestWatchdog:
+    """Test saturation detection"""
+
+    def test_reasons(self):
+        assert not WatchdogReport(0.2, 0.1, 9.0, 12.0, 100, 2.0).unreliable  # the odd late wakeup is fine
+        assert WatchdogReport(0.95, 0.1, 0.5, 1.0, 100, 2.0).reasons == ['cpu=95%']
+        assert not WatchdogReport(0.95, 0.1, 0.5, 1.0, 5, 0.1).unreliable  # window too short to judge CPU
+        assert 'scheduler lag median' in str(WatchdogReport(0.2, MAX_LAG + 3, 9.0, 12.0, 100, 2.0))
+
+    def test_idle_client(self):
+        with Watchdog(interval=0.01) as watchdog:
+            time.sleep(0.6)
+            report = watchdog.report()
+        assert report.samples > 10
+        assert report.cpu_load < 0.5  # nowhere near a busy core
+        assert 'cpu' not in ' '.join(report.reasons)
+
+    def test_busy_client(self):
+        with Watchdog(interval=0.01) as watchdog:
+            mark = watchdog.mark()
+            deadline = time.monotonic() + 1.0
+            while time.monotonic() < deadline:
+                sum(range(1000))  # hold the GIL
+            report = watchdog.report(mark)
+        assert report.unreliable
@@ -0,0 +1,477 @@
+#!/usr/bin/env python3
+
+"""
+Test suite for the Prober library API against local stand-in DNS servers (no network required)
+"""
+
+import datetime
+import ipaddress
+import itertools
+import socket
+import socketserver
+import ssl
+import statistics
+import struct
+import threading
+
+import dns.exception
+import dns.flags
+import dns.message
+import dns.query
+import dns.rcode
+import dns.rrset
+import pytest
+from cryptography import x509
+from cryptography.hazmat.primitives import hashes, serialization
+from cryptography.hazmat.primitives.asymmetric import ec
+from cryptography.x509.oid import NameOID
+
+from dnsdiag import shared
+from dnsdiag.dns import (
+    PHASES,
+    PROTO_HTTPS,
+    PROTO_TCP,
+    PROTO_TLS,
+    PROTO_UDP,
+    TLS_FULL,
+    TLS_RESUMED,
+    Phases,
+    PhaseStats,
+    PingResponse,
+    Prober,
+    RunningStats,
+    TlsSession,
+    WireResponse,
+    iter_ping,
+    ping,
+    tcp_exchange,
+    udp_exchange,
+)
+
+
+def _answer(wire):
+    query = dns.message.from_wire(wire)
+    response = dns.message.make_response(query)
+    if query.question[0].name.to_text().startswith('nxdomain.'):
+        response.set_rcode(dns.rcode.NXDOMAIN)
+    else:
+        response.answer.append(dns.rrset.from_text(query.question[0].name, 300, 'IN', 'A', '192.0.2.1'))
+    return response.to_wire()
+
+
+class _UdpHandler(socketserver.BaseRequestHandler):
+    def handle(self):
+        data, sock = self.request
+        self.server.queries.append(dns.message.from_wire(data))
+        if self.server.decoy:
+            # a stray response with the wrong ID arrives first and must be ignored
+            stray = bytearray(_answer(data))
+            stray[0] ^= 0xff
+            sock.sendto(bytes(stray), self.client_address)
+        if not self.server.silent:
+            sock.sendto(_answer(data), self.client_address)
+
+
+class _TcpHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        self.server.connections += 1
+        for _ in range(self.server.per_connection):
+            header = self.rfile.read(2)
+            if len(header) < 2:
+                return
+            data = self.rfile.read(struct.unpack('!H', header)[0])
+            self.server.queries.append(dns.message.from_wire(data))
+            wire = _answer(data)
+            self.wfile.write(struct.pack('!H', len(wire)) + wire)
+
+
+class _UdpServer(socketserver.ThreadingUDPServer):
+    daemon_threads = True
+
+    def __init__(self, silent=False, decoy=False):
+        super().__init__(('127.0.0.1', 0), _UdpHandler)
+        self.queries = []
+        self.silent = silent
+        self.decoy = decoy
+
+
+class _TcpServer(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, per_connection=100):
+        super().__init__(('127.0.0.1', 0), _TcpHandler)
+        self.queries = []
+        self.connections = 0
+        self.per_connection = per_connection  # queries answered before the server hangs up
+
+
+class _TlsServer(_TcpServer):
+    def __init__(self, certfile, keyfile):
+        super().__init__()
+        self.context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+        self.context.load_cert_chain(certfile, keyfile)
+
+    def get_request(self):
+        sock, addr = self.socket.accept()
+        return self.context.wrap_socket(sock, server_side=True), addr
+
+
+def _self_signed(directory):
+    key = ec.generate_private_key(ec.SECP256R1())
+    name = x509.Name([x509.NameAttribute(NameOID.COMMON_NAME, '127.0.0.1')])
+    now = datetime.datetime.now(datetime.timezone.utc)
+    cert = (x509.CertificateBuilder().subject_name(name).issuer_name(name).public_key(key.public_key())
+            .serial_number(x509.random_serial_number()).not_valid_before(now)
+            .not_valid_after(now + datetime.timedelta(days=1))
+            .add_extension(x509.SubjectAlternativeName([x509.IPAddress(ipaddress.ip_address('127.0.0.1'))]),
+                           critical=False)
+            .sign(key, hashes.SHA256()))
+    certfile, keyfile = directory / 'cert.pem', directory / 'key.pem'
+    certfile.write_bytes(cert.public_bytes(serialization.Encoding.PEM))
+    keyfile.write_bytes(key.private_bytes(serialization.Encoding.PEM, serialization.PrivateFormat.PKCS8,
+                                          serialization.NoEncryption()))
+    return str(certfile), str(keyfile)
+
+
+def _serve(server):
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    return server
+
+
+@pytest.fixture
+def udp_server():
+    server = _serve(_UdpServer())
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def tcp_server():
+    server = _serve(_TcpServer())
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def tls_server(tmp_path):
+    server = _serve(_TlsServer(*_self_signed(tmp_path)))
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+class TestProberUdp:
+    """Test per-query results and aggregates over UDP"""
+
+    def test_queries_and_summary(self, udp_server):
+        with Prober('127.0.0.1', 'example.com', port=udp_server.server_address[1], timeout=2) as prober:
+            results = [prober.query() for _ in range(3)]
+            summary = prober.summary()
+        assert [r.seq for r in results] == [1, 2, 3]
+        assert all(r.rtt is not None and r.rcode_text == 'NOERROR' and r.ttl == 300 for r in results)
+        assert len({q.id for q in udp_server.queries}) == 3  # fresh ID for every query
+        assert summary.r_lost_percent == 0
+        assert summary.r_min <= summary.r_avg <= summary.r_max
+
+    def test_rcode(self, udp_server):
+        with Prober('127.0.0.1', 'nxdomain.example', port=udp_server.server_address[1]) as prober:
+            assert prober.query().rcode_text == 'NXDOMAIN'
+
+    def test_timeout(self):
+        server = _serve(_UdpServer(silent=True))
+        try:
+            with Prober('127.0.0.1', 'example.com', port=server.server_address[1], timeout=0.2) as prober:
+                result = prober.query()
+                assert result.rtt is None
+                assert result.error == 'timeout'
+                assert prober.summary().r_lost_percent == 100
+        finally:
+            server.shutdown()
+            server.server_close()
+
+    def test_force_miss(self, udp_server):
+        with Prober('127.0.0.1', 'example.com', port=udp_server.server_address[1], force_miss=True) as prober:
+            first = prober.query().qname
+            second = prober.query().qname
+        assert first != second
+        assert first.endswith('example.com.')
+
+    def test_caller_query(self, udp_server):
+        port = udp_server.server_address[1]
+        template = dns.message.make_query('example.com', 'TXT', use_edns=True, want_dnssec=True)
+        with Prober('127.0.0.1', 'ignored.example', port=port, query=template) as prober:
+            assert prober.query().qname == 'example.com.'
+        names = iter(['a.example.com', 'b.example.com'])
+        with Prober('127.0.0.1', 'ignored.example', port=port,
+                    query=lambda: dns.message.make_query(next(names), 'A')) as prober:
+            assert [prober.query().qname for _ in range(2)] == ['a.example.com.', 'b.example.com.']
+        assert udp_server.queries[0].ednsflags & dns.flags.DO and udp_server.queries[0].question[0].rdtype == 16
+
+
+class TestProberConnections:
+    """Test that stream connections are kept warm"""
+
+    def test_tcp_connection_is_reused(self, tcp_server):
+        with Prober('127.0.0.1', 'example.com', proto=PROTO_TCP, port=tcp_server.server_address[1]) as prober:
+            assert all(prober.query().rtt is not None for _ in range(3))
+        assert tcp_server.connections == 1
+
+    def test_tcp_reconnects_when_server_hangs_up(self):
+        server = _serve(_TcpServer(per_connection=1))
+        try:
+            with Prober('127.0.0.1', 'example.com', proto=PROTO_TCP, port=server.server_address[1]) as prober:
+                assert prober.query().rtt is not None
+                assert prober.query().rtt is not None
+            assert server.connections == 2
+        finally:
+            server.shutdown()
+            server.server_close()
+
+
+class TestTlsSession:
+    """Test that new TLS connections resume the session of the previous one"""
+
+    def test_full_then_resumed(self, tls_server):
+        port = tls_server.server_address[1]
+        session = TlsSession(verify=False)
+        states = []
+        for _ in range(3):
+            phases = Phases()
+            sock, state = session.connect('127.0.0.1', port, 2, phases=phases)
+            try:
+                response = dns.query.tls(dns.message.make_query('example.com', 'A'), '127.0.0.1', 2, port,
+                                         sock=sock)
+                session.remember(sock)
+            finally:
+                sock.close()
+            assert response.answer
+            assert phases.handshake > 0
+            states.append(state)
+        assert states == [TLS_FULL, TLS_RESUMED, TLS_RESUMED]
+
+    def test_prober_keeps_tls_connection(self, tls_server, monkeypatch):
+        monkeypatch.setattr(ssl, 'create_default_context', ssl._create_unverified_context)
+        with Prober('127.0.0.1', 'example.com', proto=PROTO_TLS, port=tls_server.server_address[1]) as prober:
+            assert all(prober.query().rcode_text == 'NOERROR' for _ in range(3))
+        assert tls_server.connections == 1
+
+    def test_prober_checks_server_hostname(self, tmp_path, monkeypatch):
+        certfile, keyfile = _self_signed(tmp_path)  # valid for 127.0.0.1 only
+        create_default_context = ssl.create_default_context
+        monkeypatch.setattr(ssl, 'create_default_context', lambda *args, **kwargs: create_default_context(
+            cafile=certfile))
+        server = _serve(_TlsServer(certfile, keyfile))
+        try:
+            port = server.server_address[1]
+            with Prober('127.0.0.1', 'example.com', proto=PROTO_TLS, port=port) as prober:
+                assert prober.query().rcode_text == 'NOERROR'  # trusted, and no hostname to check
+            with Prober('127.0.0.1', 'example.com', proto=PROTO_TLS, port=port,
+                        server_hostname='dns.example') as prober:
+                assert 'Hostname mismatch' in prober.query().error
+        finally:
+            server.shutdown()
+            server.server_close()
+
+    def test_doh_url_uses_server_hostname(self):
+        assert Prober('192.0.2.1', 'example.com', proto=PROTO_HTTPS, server_hostname='dns.example')._url() == \
+            'https://dns.example:443/dns-query'
+        assert Prober('2001:db8::1', 'example.com', proto=PROTO_HTTPS)._url() == 'https://[2001:db8::1]:443/dns-query'
+
+
+class TestProberIsolation:
+    """Test that a Prober leaves global state alone"""
+
+    def test_no_global_state(self, udp_server):
+        factory = dns.query.socket_factory
+        shared.shutdown = False
+        with Prober('127.0.0.1', 'example.com', port=udp_server.server_address[1], ttl=64) as prober:
+            prober.query()
+        assert dns.query.socket_factory is factory
+        assert shared.shutdown is False
+
+    def test_ttl_needs_socket_transport(self):
+        with pytest.raises(ValueError):
+            Prober('127.0.0.1', 'example.com', proto=PROTO_HTTPS, ttl=3)
+
+    def test_unknown_protocol(self):
+        with pytest.raises(ValueError):
+            Prober('127.0.0.1', 'example.com', proto=42)
+
+    def test_default_port(self):
+        assert Prober('127.0.0.1', 'example.com', proto=PROTO_UDP).port == 53
+
+
+class TestIterPing:
+    """Test the streaming per-sample generator"""
+
+    def test_yields_one_sample_per_query(self, udp_server):
+        samples = list(iter_ping('example.com', '127.0.0.1', udp_server.server_address[1], count=3))
+        assert [s.seq for s in samples] == [1, 2, 3]
+        assert all(s.rtt is not None and s.rcode == 0 and s.ttl == 300 and s.size > 0 for s in samples)
+        assert not hasattr(samples[0], 'response')
+
+    def test_unlimited_until_caller_stops(self, tcp_server):
+        stream = iter_ping('example.com', '127.0.0.1', tcp_server.server_address[1], proto=PROTO_TCP)
+        assert len(list(itertools.islice(stream, 5))) == 5
+        stream.close()
+        assert tcp_server.connections == 1
+
+    def test_lost_sample(self):
+        server = _serve(_UdpServer(silent=True))
+        try:
+            sample = next(iter_ping('example.com', '127.0.0.1', server.server_address[1], timeout=0.2, count=1))
+            assert sample.rtt is None
+            assert sample.error == 'timeout'
+        finally:
+            server.shutdown()
+            server.server_close()
+
+
+class TestCompactResults:
+    """Test that result records stay small"""
+
+    def test_records_are_slotted(self):
+        for record in (PingResponse(), RunningStats()):
+            assert not hasattr(record, '__dict__')
+
+    def test_ping_drops_message_unless_asked(self, udp_server):
+        port = udp_server.server_address[1]
+        retval = ping('example.com', '127.0.0.1', port, 'A', 2, 2, PROTO_UDP, None, keep_response=False)
+        assert retval.response is None and retval.answer is None
+        assert retval.ttl == 300 and retval.rcode_text == 'NOERROR' and retval.r_lost_percent == 0
+
+        retval = ping('example.com', '127.0.0.1', port, 'A', 2, 1, PROTO_UDP, None)
+        assert retval.response is not None and retval.answer
+
+
+class TestWireExchange:
+    """Test raw exchanges that decode only the response header"""
+
+    def test_header_only_until_records_are_needed(self, udp_server):
+        query = dns.message.make_query('example.com', 'A')
+        response = udp_exchange(query, '127.0.0.1', 2, port=udp_server.server_address[1])
+        assert isinstance(response, WireResponse)
+        assert response.id == query.id and response.ancount == 1 and response.arcount == 0
+        assert response.rcode() == 0 and response.ednsflags == 0 and response.options == []
+        assert len(response) == len(response.wire)
+        assert response._message is None
+        assert response.answer[0].ttl == 300
+        assert response._message is not None
+
+    def test_rcode_from_header(self, udp_server):
+        query = dns.message.make_query('nxdomain.example', 'A')
+        response = udp_exchange(query, '127.0.0.1', 2, port=udp_server.server_address[1])
+        assert response.rcode() == dns.rcode.NXDOMAIN
+        assert response._message is None
+
+    def test_edns_response_is_parsed_for_rcode(self, udp_server):
+        query = dns.message.make_query('example.com', 'A', use_edns=0)
+        response = udp_exchange(query, '127.0.0.1', 2, port=udp_server.server_address[1])
+        assert response.arcount == 1
+        assert response.rcode() == 0
+        assert response._message is not None
+
+    def test_ignores_unrelated_responses(self):
+        server = _serve(_UdpServer(decoy=True))
+        try:
+            query = dns.message.make_query('example.com', 'A')
+            assert udp_exchange(query, '127.0.0.1', 2, port=server.server_address[1]).id == query.id
+        finally:
+            server.shutdown()
+            server.server_close()
+
+    def test_question_case_is_ignored(self, udp_server):
+        query = dns.message.make_query('ExAmPlE.CoM', 'A')
+        assert udp_exchange(query, '127.0.0.1', 2, port=udp_server.server_address[1]).id == query.id
+
+    def test_timeout(self):
+        server = _serve(_UdpServer(silent=True))
+        try:
+            with pytest.raises(dns.exception.Timeout):
+                udp_exchange(dns.message.make_query('example.com', 'A'), '127.0.0.1', 0.2,
+                             port=server.server_address[1])
+        finally:
+            server.shutdown()
+            server.server_close()
+
+    def test_tcp_with_and_without_socket(self, tcp_server):
+        port = tcp_server.server_address[1]
+        assert tcp_exchange(dns.message.make_query('example.com', 'A'), '127.0.0.1', 2, port=port).ancount == 1
+        with socket.create_connection(('127.0.0.1', port)) as sock:
+            for _ in range(2):
+                assert tcp_exchange(dns.message.make_query('example.com', 'A'), '127.0.0.1', 2, port=port,
+                                    sock=sock).rcode() == 0
+        assert tcp_server.connections == 2
+
+    def test_phases_and_bytes(self, udp_server):
+        query = dns.message.make_query('example.com', 'A')
+        phases = Phases()
+        response = udp_exchange(query, '127.0.0.1', 2, port=udp_server.server_address[1], phases=phases)
+        assert phases.bytes_sent == len(query.to_wire())
+        assert phases.bytes_received == len(response)
+        assert all(getattr(phases, name) >= 0 for name in PHASES)
+        assert phases.wait > 0
+
+    def test_short_header(self):
+        with pytest.raises(dns.message.ShortHeader):
+            WireResponse(b'\x00' * 11)
+
+
+class TestPhaseStats:
+    """Test per-phase averages and byte accounting"""
+
+    def test_averages_over_answered_queries(self):
+        stats = PhaseStats()
+        for wait, answered in ((2.0, True), (4.0, True), (100.0, False)):
+            phases = Phases()
+            phases.wait = wait
+            phases.bytes_sent = 30
+            phases.bytes_received = 50 if answered else 0
+            stats.add(phases, answered)
+        assert stats.averages()['wait'] == 3.0
+        assert stats.bytes_sent == 90
+        assert stats.bytes_received == 100
+
+    def test_no_answers(self):
+        assert PhaseStats().averages() == {}
+
+    def test_ping_reports_phases(self, udp_server):
+        retval = ping('example.com', '127.0.0.1', udp_server.server_address[1], 'A', 2, 2, PROTO_UDP, None)
+        assert set(retval.phases) == set(PHASES)
+        assert retval.bytes_sent > 0 and retval.bytes_received > 0
+
+
+class TestRunningStats:
+    """Test constant-memory RTT aggregates"""
+
+    def test_matches_statistics(self):
+        samples = [12.5, 10.0, 31.25, 9.5, 18.0]
+        stats = RunningStats()
+        for rtt in samples:
+            stats.add(rtt)
+        assert stats.r_min == 9.5
+        assert stats.r_max == 31.25
+        assert stats.r_avg == pytest.approx(statistics.mean(samples))
+        assert stats.r_stddev == pytest.approx(statistics.stdev(samples))
+
+    def test_fill_with_loss(self):
+        stats = RunningStats()
+        stats.add(5.0)
+        retval = PingResponse()
+        stats.fill(retval, 4)
+        assert retval.r_lost_percent == 75
+        assert retval.r_stddev == 0.0
+
+    def test_fill_nothing_sent(self):
+        retval = PingResponse()
+        RunningStats().fill(retval, 0)
+        assert retval.r_lost_percent == 0.0
+        assert retval.r_avg == 0.0
+
+
+if __name__ == '__main__':
+    pytest.main([__file__, '-v'])
@@ -0,0 +1,96 @@
+#!/usr/bin/env python3
+
+"""
+Test suite for the reverse lookup cache (no network required)
+"""
+
+import time
+
+import pytest
+
+from dnsdiag.ptr import PtrCache, PtrResolver
+
+
+class TestPtrCache:
+    """Test LRU and TTL behaviour of the reverse lookup cache"""
+
+    def test_miss_and_hit(self):
+        cache = PtrCache()
+        assert cache.get('192.0.2.1') is None
+        cache.put('192.0.2.1', 'router.example', 60)
+        assert cache.get('192.0.2.1') == 'router.example'
+
+    def test_negative_entry(self):
+        """A failed lookup is cached as an empty name, not a miss"""
+        cache = PtrCache()
+        cache.put('192.0.2.2', '', 60)
+        assert cache.get('192.0.2.2') == ''
+
+    def test_expiry(self):
+        cache = PtrCache()
+        cache.put('192.0.2.3', 'old.example', 10, now=1000.0)
+        assert cache.get('192.0.2.3', now=1005.0) == 'old.example'
+        assert cache.get('192.0.2.3', now=1011.0) is None
+        assert len(cache) == 0
+
+    def test_lru_eviction(self):
+        cache = PtrCache(max_entries=2)
+        cache.put('192.0.2.1', 'a.example', 60)
+        cache.put('192.0.2.2', 'b.example', 60)
+        cache.get('192.0.2.1')  # refresh, so .2 becomes least recently used
+        cache.put('192.0.2.3', 'c.example', 60)
+        assert cache.get('192.0.2.2') is None
+        assert cache.get('192.0.2.1') == 'a.example'
+        assert cache.get('192.0.2.3') == 'c.example'
+
+    def test_save_and_restore(self, tmp_path):
+        filename = str(tmp_path / 'ptr.cache')
+        cache = PtrCache()
+        cache.put('192.0.2.1', 'a.example', 60)
+        cache.put('192.0.2.2', 'gone.example', 60, now=0.0)  # already expired
+        cache.save(filename)
+        assert not cache.dirty
+
+        restored = PtrCache()
+        restored.restore(filename)
+        assert restored.get('192.0.2.1') == 'a.example'
+        assert len(restored) == 1
+
+    def test_restore_missing_or_corrupt_file(self, tmp_path):
+        cache = PtrCache()
+        cache.restore(str(tmp_path / 'missing'))
+        corrupt = tmp_path / 'corrupt'
+        corrupt.write_text('not json')
+        cache.restore(str(corrupt))
+        assert len(cache) == 0
+
+    def test_restore_wrong_shape(self, tmp_path):
+        cache = PtrCache()
+        for text in ('[1, 2]', '{"192.0.2.1": "x"}', '{"192.0.2.1": [1, 2, 3]}', '{"192.0.2.1": ["x", "y"]}'):
+            wrong = tmp_path / 'wrong'
+            wrong.write_text(text)
+            cache.restore(str(wrong))
+        assert len(cache) == 0
+        mixed = tmp_path / 'mixed'
+        mixed.write_text('{"192.0.2.1": null, "192.0.2.2": ["b.example", %d]}' % (time.time() + 60))
+        cache.restore(str(mixed))
+        assert len(cache) == 1 and cache.get('192.0.2.2') == 'b.example'
+
+
+class TestPtrResolver:
+    """Test that cached names are served without a lookup"""
+
+    def test_cached_lookup_is_immediate(self):
+        cache = PtrCache()
+        cache.put('192.0.2.1', 'cached.example', 60)
+        resolver = PtrResolver(cache)
+        try:
+            future = resolver.lookup('192.0.2.1')
+            assert future.done()
+            assert future.result() == 'cached.example'
+        finally:
+            resolver.close()
+
+
+if __name__ == '__main__':
+    pytest.main([__file__, '-v'])
@@ -4,8 +4,22 @@
 Test suite for shared module functions
 """
 
+import json
+import pstats
+import threading
+import time
+
 import pytest
-from dnsdiag.shared import valid_hostname, set_protocol_exclusive
+
+from dnsdiag.shared import (
+    JsonLines,
+    Schedule,
+    cache_path,
+    set_protocol_exclusive,
+    start_profiler,
+    stop_profiler,
+    valid_hostname,
+)
 
 
 class TestHostnameValidation:
@@ -224,6 +238,119 @@ class TestSignalHandling:
         setup_signal_handler()
         assert shared.shutdown is False
 
+    def test_handler_sets_event(self):
+        from dnsdiag import shared
+        shared.setup_signal_handler()
+        assert not shared.shutdown_event.is_set()
+        shared.signal_handler(2, None)
+        assert shared.shutdown and shared.shutdown_event.is_set()
+        shared.setup_signal_handler()
+        assert not shared.shutdown_event.is_set()
+
+
+class TestSchedule:
+    def test_deadlines_do_not_drift(self):
+        schedule = Schedule(0.01)
+        start = time.monotonic()
+        for _ in range(50):
+            assert schedule.wait()
+            time.sleep(0.004)  # work done between sends does not push the next one back
+        # the 50th send is due 49 intervals after the first
+        assert 0.49 <= time.monotonic() - start < 0.6
+        assert schedule.skipped == 0
+
+    def test_overrun_sends_at_once_then_skips_missed_slots(self):
+        schedule = Schedule(0.05)
+        schedule.wait()
+        time.sleep(0.07)  # less than one interval late: no wait, no skip
+        start = time.monotonic()
+        schedule.wait()
+        assert time.monotonic() - start < 0.01 and schedule.skipped == 0
+        time.sleep(0.2)  # several intervals late: missed slots are skipped, not sent in a burst
+        schedule.wait()
+        assert schedule.skipped >= 2
+        start = time.monotonic()
+        schedule.wait()
+        assert time.monotonic() - start > 0.01
+
+    def test_stop_wakes_waiter(self):
+        stop = threading.Event()
+        schedule = Schedule(10, stop=stop)
+        assert schedule.wait()
+        threading.Timer(0.05, stop.set).start()
+        start = time.monotonic()
+        assert not schedule.wait()
+        assert time.monotonic() - start < 1
+
+    def test_jitter_stays_within_slot(self):
+        schedule = Schedule(0.01, jitter=1.0)
+        start = time.monotonic()
+        for _ in range(21):
+            schedule.wait()
+        assert 0.2 <= time.monotonic() - start < 0.3
+
+    def test_invalid_arguments(self):
+        with pytest.raises(ValueError):
+            Schedule(-1)
+        with pytest.raises(ValueError):
+            Schedule(1, jitter=1.5)
+
+
+class TestCachePath:
+    def test_uses_xdg_cache_home(self, tmp_path, monkeypatch):
+        monkeypatch.setenv('XDG_CACHE_HOME', str(tmp_path))
+        assert cache_path('whois.db') == str(tmp_path / 'dnsdiag' / 'whois.db')
+        assert (tmp_path / 'dnsdiag').is_dir()
+
+    def test_falls_back_to_current_directory(self, tmp_path, monkeypatch):
+        blocker = tmp_path / 'file'
+        blocker.write_text('')
+        monkeypatch.setenv('XDG_CACHE_HOME', str(blocker))
+        assert cache_path('whois.db') == 'whois.db'
+
+
+class TestProfiler:
+    def test_writes_pstats_dump(self, tmp_path):
+        filename = str(tmp_path / 'run.prof')
+        profiler = start_profiler()
+        sorted(range(1000))
+        stop_profiler(profiler, filename)
+        assert pstats.Stats(filename).total_calls > 0
+
+    def test_unwritable_target_is_reported(self, tmp_path, capsys):
+        stop_profiler(start_profiler(), str(tmp_path / 'missing' / 'run.prof'))
+        assert 'cannot write profile' in capsys.readouterr().err
+
+
+class TestJsonLines:
+    def test_buffers_until_due(self, tmp_path):
+        filename = tmp_path / 'out.jsonl'
+        writer = JsonLines(str(filename), flush_interval=60)
+        writer.write({'seq': 1})
+        writer.write({'seq': 2})
+        assert filename.read_text() == ''  # nothing written before the cadence is due
+        writer.close()
+        assert [json.loads(line) for line in filename.read_text().splitlines()] == [{'seq': 1}, {'seq': 2}]
+
+    def test_zero_interval_writes_each_record(self, tmp_path):
+        filename = tmp_path / 'out.jsonl'
+        writer = JsonLines(str(filename), flush_interval=0)
+        writer.write({'seq': 1})
+        assert filename.read_text() == '{"seq": 1}\n'
+        writer.close()
+
+    def test_appends_and_stdout(self, tmp_path, capsys):
+        filename = tmp_path / 'out.jsonl'
+        filename.write_text('{"old": true}\n')
+        writer = JsonLines(str(filename))
+        writer.write({'new': True})
+        writer.close()
+        assert len(filename.read_text().splitlines()) == 2
+        writer = JsonLines('-')
+        writer.write({'seq': 1})
+        writer.close()
+        assert capsys.readouterr().out == '{"seq": 1}\n'
+
 
 if __name__ == '__main__':
     pytest.main([__file__, '-v'])
@@ -0,0 +1,245 @@
+#!/usr/bin/env python3
+
+"""
+Test suite for traceroute probe helpers (no network required)
+"""
+
+import collections
+import socket
+
+import pytest
+
+from dnsdiag.trace import (
+    LOCATE_RETRIES,
+    Hop,
+    HopStats,
+    PathStore,
+    changed_segment,
+    check_ttls,
+    locate_responder,
+    parse_time_exceeded,
+    shared_hops,
+)
+
+
+def _ipv4_time_exceeded(src_port, dst_port, icmp_type=11, with_outer_header=True, dst='192.0.2.53'):
+    outer = bytes([0x45]) + bytes(19) if with_outer_header else b''
+    icmp = bytes([icmp_type, 0]) + bytes(6)
+    inner_ip = bytes([0x45]) + bytes(15) + socket.inet_pton(socket.AF_INET, dst)
+    udp = src_port.to_bytes(2, 'big') + dst_port.to_bytes(2, 'big') + bytes(4)
+    return outer + icmp + inner_ip + udp
+
+
+def _ipv6_time_exceeded(src_port, dst_port, icmp_type=3, dst='2001:db8::53'):
+    icmp = bytes([icmp_type, 0]) + bytes(6)
+    inner_ip = bytes(24) + socket.inet_pton(socket.AF_INET6, dst)
+    udp = src_port.to_bytes(2, 'big') + dst_port.to_bytes(2, 'big') + bytes(4)
+    return icmp + inner_ip + udp
+
+
+class TestParseTimeExceeded:
+    """Test extraction of the quoted probe ports and destination from ICMP errors"""
+
+    def test_ipv4_raw(self):
+        """IPv4 raw sockets include the outer IP header"""
+        assert parse_time_exceeded(_ipv4_time_exceeded(40000, 53), socket.AF_INET) == (40000, 53, '192.0.2.53')
+
+    def test_ipv4_without_outer_header(self):
+        """Packets without the outer IP header are handled as well"""
+        packet = _ipv4_time_exceeded(40001, 53, with_outer_header=False)
+        assert parse_time_exceeded(packet, socket.AF_INET) == (40001, 53, '192.0.2.53')
+
+    def test_ipv4_inner_options(self):
+        """The quoted IP header length is taken from its IHL field"""
+        packet = bytearray(_ipv4_time_exceeded(40002, 53))
+        packet[28] = 0x46  # IHL=6, one word of options
+        packet[48:48] = bytes(4)
+        assert parse_time_exceeded(bytes(packet), socket.AF_INET) == (40002, 53, '192.0.2.53')
+
+    def test_ipv6(self):
+        """ICMPv6 Time Exceeded (type 3)"""
+        assert parse_time_exceeded(_ipv6_time_exceeded(40003, 853), socket.AF_INET6) == (40003, 853, '2001:db8::53')
+
+    @pytest.mark.parametrize("packet,af", [
+        (_ipv4_time_exceeded(40000, 53, icmp_type=3), socket.AF_INET),
+        (_ipv6_time_exceeded(40000, 53, icmp_type=1), socket.AF_INET6),
+        (_ipv4_time_exceeded(40000, 53)[:40], socket.AF_INET),
+        (_ipv6_time_exceeded(40000, 53)[:50], socket.AF_INET6),
+        (b'', socket.AF_INET),
+    ])
+    def test_rejected(self, packet, af):
+        """Other ICMP types and truncated packets are ignored"""
+        assert parse_time_exceeded(packet, af) is None
+
+
+class TestHopStats:
+    """Test rolling per-hop statistics"""
+
+    def test_statistics(self):
+        hop = HopStats(1)
+        for rtt in (10.0, 20.0, None, 15.0):
+            hop.add('192.0.2.1' if rtt is not None else None, rtt)
+        assert hop.sent == 4
+        assert hop.loss() == 25.0
+        assert hop.last() == 15.0
+        assert hop.avg() == 15.0
+        assert hop.best() == 10.0
+        assert hop.worst() == 20.0
+        assert hop.jitter() == 7.5
+        assert hop.addr == '192.0.2.1'
+
+    def test_empty(self):
+        hop = HopStats(1)
+        assert hop.loss() == 0.0
+        assert hop.last() is None
+        assert hop.avg() is None
+        assert hop.jitter() is None
+
+    def test_window_is_bounded(self):
+        hop = HopStats(1, size=3)
+        for _ in range(10):
+            hop.add(None, None)
+        for _ in range(3):
+            hop.add('192.0.2.1', 5.0)
+        assert hop.sent == 13
+        assert len(hop.samples) == 3
+        assert hop.loss() == 0.0
+
+
+PATH = ['192.0.2.1', '192.0.2.2', '192.0.2.3', '192.0.2.4', '192.0.2.5', '192.0.2.6', '192.0.2.7', '8.8.8.8']
+
+
+class TestIncrementalTrace:
+    """Test detection of the path segment that needs re-probing"""
+
+    def test_check_ttls(self):
+        assert check_ttls(8) == [2, 4, 5, 7, 8]
+        assert check_ttls(2) == [1, 2]
+        assert check_ttls(1) == [1]
+
+    def test_unchanged(self):
+        observed = {ttl: PATH[ttl - 1] for ttl in check_ttls(len(PATH))}
+        assert changed_segment(PATH, observed) is None
+
+    def test_silent_hop_is_not_a_change(self):
+        observed = {2: None, 4: PATH[3], 6: PATH[5], 7: PATH[6], 8: '8.8.8.8'}
+        assert changed_segment(PATH, observed) is None
+
+    def test_changed_middle_segment(self):
+        observed = {2: PATH[1], 4: '198.51.100.4', 6: PATH[5], 7: PATH[6], 8: '8.8.8.8'}
+        assert changed_segment(PATH, observed) == (2, 6)
+
+    def test_destination_moved(self):
+        observed = {2: PATH[1], 4: PATH[3], 6: '198.51.100.6', 7: '198.51.100.7', 8: None}
+        assert changed_segment(PATH, observed) == (4, None)
+
+    def test_path_got_shorter(self):
+        observed = {2: PATH[1], 4: PATH[3], 6: PATH[5], 7: '8.8.8.8', 8: '8.8.8.8'}
+        assert changed_segment(PATH, observed) == (6, 8)
+
+
+class TestPathStore:
+    """Test persistence of known paths"""
+
+    def test_put_and_get(self, tmp_path):
+        store = PathStore(str(tmp_path / 'paths.json'))
+        assert store.get('8.8.8.8:53/UDP') is None
+        store.put('8.8.8.8:53/UDP', ['192.0.2.1', None, '8.8.8.8'])
+        assert PathStore(store.filename).get('8.8.8.8:53/UDP') == ['192.0.2.1', None, '8.8.8.8']
+
+    def test_corrupt_file(self, tmp_path):
+        filename = tmp_path / 'paths.json'
+        filename.write_text('not json')
+        store = PathStore(str(filename))
+        assert store.get('8.8.8.8:53/UDP') is None
+        store.put('8.8.8.8:53/UDP', ['8.8.8.8'])
+        assert store.get('8.8.8.8:53/UDP') == ['8.8.8.8']
+
+
+def _fake_path(responder):
+    """Return a probe function for a path whose DNS answers start at the given TTL"""
+    sent = []
+
+    def probe(ttl):
+        sent.append(ttl)
+        hop = Hop(ttl)
+        hop.reached = responder is not None and ttl >= responder
+        hop.addr = '8.8.8.8' if hop.reached else '192.0.2.%d' % ttl
+        return hop
+    return probe, sent
+
+
+class TestLocateResponder:
+    """Test the binary search for the first hop answering DNS"""
+
+    @pytest.mark.parametrize('responder', [1, 2, 7, 16, 29, 30])
+    def test_finds_first_answering_hop(self, responder):
+        probe, sent = _fake_path(responder)
+        ttl, probed = locate_responder(probe, 30)
+        assert ttl == responder
+        assert len(sent) <= 6
+        assert [hop.ttl for hop in probed] == sent
+
+    def test_no_response(self):
+        probe, sent = _fake_path(None)
+        ttl, _ = locate_responder(probe, 30)
+        assert ttl is None
+        assert sent == [30]
+
+    @pytest.mark.parametrize('responder', [1, 7, 16, 29])
+    def test_lost_answers_are_probed_again(self, responder):
+        path, _ = _fake_path(responder)
+        attempts = collections.Counter()
+
+        def lossy(ttl):
+            attempts[ttl] += 1
+            if ttl >= responder and attempts[ttl] == 1:
+                return Hop(ttl)  # the first answer at every answering TTL is lost
+            return path(ttl)
+
+        ttl, probed = locate_responder(lossy, 30)
+        assert ttl == responder
+        assert len(probed) == sum(attempts.values())
+
+    def test_silent_hop(self):
+        path, _ = _fake_path(16)
+
+        def silent(ttl):
+            return Hop(ttl) if ttl == 15 else path(ttl)  # a router that sends no ICMP
+
+        ttl, probed = locate_responder(silent, 30)
+        assert ttl == 16
+        assert [hop.ttl for hop in probed].count(15) == 1 + LOCATE_RETRIES
+
+
+def _path(*addrs, reached=True):
+    hops = []
+    for ttl, addr in enumerate(addrs, 1):
+        hop = Hop(ttl)
+        hop.addr = addr
+        hops.append(hop)
+    hops[-1].reached = reached
+    return hops
+
+
+class TestSharedHops:
+    """Test the summary of routers common to several paths"""
+
+    def test_shared_hops(self):
+        paths = {
+            '8.8.8.8': _path('192.0.2.1', '198.51.100.1', '8.8.8.8'),
+            '1.1.1.1': _path('192.0.2.1', None, '198.51.100.1', '1.1.1.1'),
+            '9.9.9.9': _path('192.0.2.1', '203.0.113.1', '9.9.9.9'),
+        }
+        assert shared_hops(paths) == [('192.0.2.1', 3, 1, 1), ('198.51.100.1', 2, 2, 3)]
+
+    def test_destinations_are_not_shared_hops(self):
+        paths = {
+            'a': _path('192.0.2.1', '8.8.8.8'),
+            'b': _path('192.0.2.1', '8.8.8.8'),
+        }
+        assert shared_hops(paths) == [('192.0.2.1', 2, 1, 1)]
+
+
+if __name__ == '__main__':
+    pytest.main([__file__, '-v'])
@@ -0,0 +1,211 @@
+#!/usr/bin/env python3
+
+"""
+Test suite for ASN lookups against a local stand-in for the Cymru bulk whois service
+"""
+
+import socketserver
+import threading
+import time
+
+import pytest
+
+from dnsdiag.whois import AsnResolver, WhoisCache, WhoisRecord, bulk_lookup
+
+# address -> (asn, prefix, cc, owner)
+ASN_TABLE = {
+    '192.0.2.1': ('64500', '192.0.2.0/24', 'ZZ', 'EXAMPLE-NET-A, ZZ'),
+    '198.51.100.7': ('64501', '198.51.100.0/24', 'ZZ', 'EXAMPLE-NET-B, ZZ'),
+    '2001:db8::1': ('64502', '2001:db8::/32', 'ZZ', 'EXAMPLE-NET-C, ZZ'),
+}
+
+
+class _BulkWhoisHandler(socketserver.StreamRequestHandler):
+    """Speak just enough of the Cymru bulk protocol: BEGIN, options, one IP per line, END"""
+
+    def handle(self):
+        self.server.sessions += 1
+        for raw in self.rfile:
+            line = raw.decode().strip()
+            if line == 'BEGIN':
+                self.wfile.write(b'Bulk mode; whois.cymru.com [stand-in]\n')
+            elif line == 'END':
+                break
+            elif line in ('PREFIX', 'ASNUMBER', 'COUNTRYCODE', 'NOTRUNC', ''):
+                continue
+            else:
+                self.server.queries.append(line)
+                if line in ASN_TABLE:
+                    asn, prefix, cc, owner = ASN_TABLE[line]
+                    reply = '%s | %s | %s | %s | %s\n' % (asn, line, prefix, cc, owner)
+                else:
+                    reply = 'Error: no ASN or IP match on line 1.\n'
+                self.wfile.write(reply.encode())
+
+
+class _WhoisServer(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self):
+        super().__init__(('127.0.0.1', 0), _BulkWhoisHandler)
+        self.sessions = 0
+        self.queries = []
+
+
+@pytest.fixture
+def cache(tmp_path):
+    whois_cache = WhoisCache(str(tmp_path / 'whois.db'))
+    yield whois_cache
+    whois_cache.close()
+
+
+@pytest.fixture
+def whois_server():
+    server = _WhoisServer()
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+class TestWhoisCache:
+    """Test the prefix-keyed persistent cache"""
+
+    def test_prefix_covers_neighbours(self, cache):
+        record = WhoisRecord('64500', '192.0.2.0/24', 'ZZ', 'EXAMPLE-NET-A, ZZ')
+        cache.put_many({'192.0.2.1': record})
+        hit, found = cache.get('192.0.2.200')
+        assert hit and found.asn == '64500'
+        assert cache.get('192.0.3.1') == (False, None)
+
+    def test_most_specific_prefix_wins(self, cache):
+        cache.put_many({'10.0.0.1': WhoisRecord('64500', '10.0.0.0/8', 'ZZ', 'A')})
+        cache.put_many({'10.1.0.1': WhoisRecord('64501', '10.1.0.0/16', 'ZZ', 'B')})
+        assert cache.get('10.1.2.3')[1].asn == '64501'
+        assert cache.get('10.2.0.1')[1].asn == '64500'
+
+    def test_negative_entry_is_host_route(self, cache):
+        cache.put_many({'203.0.113.9': None})
+        assert cache.get('203.0.113.9') == (True, None)
+        assert cache.get('203.0.113.10') == (False, None)
+
+    def test_ipv6(self, cache):
+        cache.put_many({'2001:db8::1': WhoisRecord('64502', '2001:db8::/32', 'ZZ', 'C')})
+        assert cache.get('2001:db8:ffff::1')[1].asn == '64502'
+        assert cache.get('192.0.2.1') == (False, None)
+
+    def test_expiry(self, cache):
+        cache.put_many({'192.0.2.1': None}, now=1000.0)
+        assert cache.get('192.0.2.1', now=1000.0 + cache.ttl - 1) == (True, None)
+        assert cache.get('192.0.2.1', now=1000.0 + cache.ttl + 1) == (False, None)
+
+    def test_size_eviction(self, tmp_path):
+        cache = WhoisCache(str(tmp_path / 'small.db'), max_entries=2)
+        try:
+            for i, now in enumerate((1000.0, 2000.0, 3000.0)):
+                cache.put_many({'192.0.2.%d' % i: None}, now=time.time() + now)
+            assert len(cache) == 2
+            assert cache.get('192.0.2.0') == (False, None)
+            assert cache.get('192.0.2.2') == (True, None)
+        finally:
+            cache.close()
+
+    def test_persistent_and_shared(self, tmp_path):
+        """A second connection (e.g. another traceroute) sees the entries"""
+        filename = str(tmp_path / 'whois.db')
+        first = WhoisCache(filename)
+        second = WhoisCache(filename)
+        try:
+            first.put_many({'192.0.2.1': WhoisRecord('64500', '192.0.2.0/24', 'ZZ', 'A')})
+            assert second.get('192.0.2.99')[1].owner == 'A'
+        finally:
+            first.close()
+            second.close()
+
+    def test_unwritable_location_falls_back_to_memory(self, tmp_path):
+        cache = WhoisCache(str(tmp_path / 'missing' / 'whois.db'))
+        try:
+            cache.put_many({'192.0.2.1': None})
+            assert cache.get('192.0.2.1') == (True, None)
+        finally:
+            cache.close()
+
+
+class TestBulkLookup:
+    """Test bulk lookups and caching"""
+
+    def test_all_addresses_in_one_session(self, whois_server, cache):
+        host, port = whois_server.server_address
+        records = bulk_lookup(['192.0.2.1', '198.51.100.7', '203.0.113.9'], cache, host=host, port=port)
+        assert records['192.0.2.1'].asn == '64500'
+        assert records['198.51.100.7'].owner == 'EXAMPLE-NET-B, ZZ'
+        assert records['203.0.113.9'] is None
+        assert whois_server.sessions == 1
+
+    def test_cached_addresses_are_not_queried(self, whois_server, cache):
+        host, port = whois_server.server_address
+        bulk_lookup(['192.0.2.1'], cache, host=host, port=port)
+        bulk_lookup(['192.0.2.1', '198.51.100.7'], cache, host=host, port=port)
+        assert whois_server.queries == ['192.0.2.1', '198.51.100.7']
+
+    def test_one_lookup_covers_the_prefix(self, whois_server, cache):
+        host, port = whois_server.server_address
+        bulk_lookup(['192.0.2.1', '2001:db8::1'], cache, host=host, port=port)
+        records = bulk_lookup(['192.0.2.77', '2001:db8:1::5'], cache, host=host, port=port)
+        assert records['192.0.2.77'].asn == '64500'
+        assert records['2001:db8:1::5'].asn == '64502'
+        assert sorted(whois_server.queries) == ['192.0.2.1', '2001:db8::1']
+
+    def test_stale_entries_are_refreshed(self, whois_server, cache):
+        host, port = whois_server.server_address
+        cache.put_many({'192.0.2.1': None}, now=time.time() - cache.ttl - 1)
+        records = bulk_lookup(['192.0.2.1'], cache, host=host, port=port)
+        assert records['192.0.2.1'].asn == '64500'
+
+
+class TestAsnResolver:
+    """Test background resolution over a single session"""
+
+    def test_lookups_share_one_session(self, whois_server, tmp_path):
+        host, port = whois_server.server_address
+        filename = str(tmp_path / 'whois.db')
+        resolver = AsnResolver(WhoisCache(filename), host=host, port=port)
+        try:
+            first = resolver.lookup('192.0.2.1')
+            assert first.result(timeout=5).asn == '64500'
+            second = resolver.lookup('198.51.100.7')
+            assert second.result(timeout=5).asn == '64501'
+            assert resolver.lookup('203.0.113.9').result(timeout=5) is None
+        finally:
+            resolver.close()
+        assert whois_server.sessions == 1
+
+        cache = WhoisCache(filename)
+        try:
+            assert cache.get('192.0.2.1')[1].asn == '64500'
+        finally:
+            cache.close()
+
+    def test_cached_lookup_is_immediate(self, tmp_path):
+        cache = WhoisCache(str(tmp_path / 'whois.db'))
+        cache.put_many({'192.0.2.1': WhoisRecord('64500', '192.0.2.0/24', 'ZZ', 'cached')})
+        resolver = AsnResolver(cache, host='127.0.0.1', port=9)
+        try:
+            future = resolver.lookup('192.0.2.1')
+            assert future.done()
+            assert future.result().owner == 'cached'
+        finally:
+            resolver.close()
+
+    def test_unreachable_server_yields_none(self, tmp_path):
+        resolver = AsnResolver(WhoisCache(str(tmp_path / 'whois.db')), host='127.0.0.1', port=9)
+        try:
+            assert resolver.lookup('192.0.2.1').result(timeout=15) is None
+        finally:
+            resolver.close()
+
+
+if __name__ == '__main__':
+    pytest.main([__file__, '-v'])